@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Génère un dépôt synthétique (decks/ et media/) pour les benchmarks : N CSV répartis
+entre plusieurs matières, des cartes courtes, chargées en LaTeX ou en images,
+et des images PNG de tailles variées. Même graine, même corpus.
+
+Usage :
+    python3 benchmarks/generate_corpus.py /tmp/corpus --decks 1000 --cards 100000 --images 10000
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import zlib
+from typing import Dict, List
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../scripts'))
+
+from cards import card_row, write_rows
+
+SUBJECTS = ['Maths', 'Physique', 'SI', 'Chimie', 'Anglais']
+
+# Share of each kind of card
+ROW_KINDS = [('text', 0.6), ('latex', 0.3), ('image', 0.1)]
+
+WORDS = """
+fonction dérivée intégrale limite suite série matrice vecteur espace base noyau image
+torseur liaison mécanisme effort vitesse énergie puissance couple rendement signal
+tension courant résistance condensateur bobine champ onde réaction acide équilibre
+""".split()
+
+LATEX_SNIPPETS = [
+    r"\( \lim_{x \to 0} \frac{\sin x}{x} = 1 \)",
+    r"\[ \int_a^b f(t)\,\mathrm{d}t = F(b) - F(a) \]",
+    r"\( e^x = \sum_{k=0}^{n} \frac{x^k}{k!} + o(x^n) \)",
+    r"\[ \begin{pmatrix} a & b \\ c & d \end{pmatrix}^{-1} = \frac{1}{ad-bc} \begin{pmatrix} d & -b \\ -c & a \end{pmatrix} \]",
+    r"\( \overrightarrow{V_{B \in 2/1}} = \overrightarrow{V_{A \in 2/1}} + \overrightarrow{BA} \wedge \overrightarrow{\Omega_{2/1}} \)",
+    r"\( \mathrm{pH} = \mathrm{p}K_a + \log \frac{[A^-]}{[AH]} \)",
+]
+
+# Side of the generated images, in pixels
+MIN_IMAGE_SIZE = 64
+MAX_IMAGE_SIZE = 480
+IMAGES_PER_FOLDER = 100
+
+PRESETS: Dict[str, Dict[str, int]] = {
+    'small': {'decks': 10, 'cards': 1000, 'images': 100},
+    'medium': {'decks': 1000, 'cards': 20000, 'images': 2000},
+    'large': {'decks': 10000, 'cards': 100000, 'images': 10000},
+}
+
+def png_bytes(width: int, height: int, seed: int) -> bytes:
+    """Image PNG RGB en dégradé (sans Pillow), différente pour chaque graine."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    # Each row is a shifted window over one gradient line: cheap to build, still varied
+    line = bytes((seed + k * 7) % 256 for k in range(3 * (width + height)))
+    rows = b''.join(b'\x00' + line[3 * y:3 * (y + width)] for y in range(height))  # filter byte: none
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows, 6)) + chunk(b'IEND', b'')
+
+def random_text(rng: random.Random, words: int) -> str:
+    """Phrase de mots tirés au hasard."""
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+def random_card(rng: random.Random, kind: str, images: List[str]) -> List[str]:
+    """Recto et verso d'une carte du type donné (texte, LaTeX ou image)."""
+    front = f"{random_text(rng, rng.randint(3, 10))} ?"
+    if kind == 'latex':
+        back = ' '.join(rng.choice(LATEX_SNIPPETS) for _ in range(rng.randint(2, 5)))
+    elif kind == 'image' and images:
+        back = f'{random_text(rng, 4)}<br><img src="{rng.choice(images)}">'
+    else:
+        back = random_text(rng, rng.randint(5, 30))
+    return [front, back]
+
+def generate_corpus(root: str, decks: int, cards: int, images: int, seed: int = 0) -> Dict[str, int]:
+    """Écrit root/decks et root/media, et retourne la taille du corpus généré."""
+    rng = random.Random(seed)
+    decks_dir = os.path.join(root, 'decks')
+    media_dir = os.path.join(root, 'media')
+
+    image_names = []
+    image_bytes = 0
+    for i in range(images):
+        name = f"bench-{i:06d}.png"
+        folder = os.path.join(media_dir, f"chapitre_{i // IMAGES_PER_FOLDER:04d}")
+        os.makedirs(folder, exist_ok=True)
+        data = png_bytes(rng.randint(MIN_IMAGE_SIZE, MAX_IMAGE_SIZE), rng.randint(MIN_IMAGE_SIZE, MAX_IMAGE_SIZE), i)
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(data)
+        image_names.append(name)
+        image_bytes += len(data)
+
+    kinds, weights = zip(*ROW_KINDS)
+    csv_bytes = 0
+    for i in range(decks):
+        subject = SUBJECTS[i % len(SUBJECTS)]
+        os.makedirs(os.path.join(decks_dir, subject), exist_ok=True)
+        csv_path = os.path.join(decks_dir, subject, f"Chapitre {i:05d} - {random_text(rng, 2)}.csv")
+        # Spread the cards evenly, the first decks taking the remainder
+        count = cards // decks + (1 if i < cards % decks else 0)
+        rows = (card_row(random_card(rng, rng.choices(kinds, weights)[0], image_names), [f"chap{i}", subject.lower()])
+                for _ in range(count))
+        write_rows(csv_path, rows)
+        csv_bytes += os.path.getsize(csv_path)
+
+    return {'decks': decks, 'cards': cards, 'images': images, 'csv_bytes': csv_bytes, 'image_bytes': image_bytes}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Génère un corpus synthétique de decks et d'images.")
+    parser.add_argument("root", help="Dossier de sortie (decks/ et media/ y sont créés)")
+    parser.add_argument("--preset", choices=sorted(PRESETS), help="Taille prédéfinie")
+    parser.add_argument("--decks", type=int, default=10, help="Nombre de CSV")
+    parser.add_argument("--cards", type=int, default=1000, help="Nombre total de cartes")
+    parser.add_argument("--images", type=int, default=100, help="Nombre d'images")
+    parser.add_argument("--seed", type=int, default=0, help="Graine du générateur")
+    args = parser.parse_args()
+
+    size = PRESETS[args.preset] if args.preset else {'decks': args.decks, 'cards': args.cards, 'images': args.images}
+    stats = generate_corpus(args.root, seed=args.seed, **size)
+    print(f"✅ {stats['decks']} CSV, {stats['cards']} cartes, {stats['images']} images "
+          f"({(stats['csv_bytes'] + stats['image_bytes']) / 1024 / 1024:.1f} Mo) dans {args.root}")
+
+if __name__ == "__main__":
+    main()
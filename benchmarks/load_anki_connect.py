@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test de charge d'imports_decks.py et export_with_media.py contre le faux serveur
+AnkiConnect (scripts/fake_anki_connect.py) : import complet d'un corpus synthétique,
+nouvel import en --sync, puis export de tous les decks. Pour chaque phase : durée,
+requêtes HTTP, actions AnkiConnect, requêtes par seconde et pannes injectées.
+
+Comme run_benchmarks.py, le corpus est généré dans un dossier temporaire avec une copie
+de scripts/ : l'import lit ses decks/ et media/, l'export y réécrit ses CSV.
+
+Usage :
+    python3 benchmarks/load_anki_connect.py --preset small --latency 0.005
+    python3 benchmarks/load_anki_connect.py --decks 50 --cards 5000 --failure-rate 0.05 --jobs 4
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from generate_corpus import PRESETS, generate_corpus
+from run_benchmarks import RESULTS_DIR, SCRIPTS_DIR, git_commit
+
+# Bump when the layout of the result files changes
+RESULTS_VERSION = 1
+PHASES = ['import', 'sync', 'export']
+
+def measure_phase(fake: Any, clients: List[Any], run: Callable[[], None], log: io.TextIOBase) -> Dict[str, Any]:
+    """Exécute une phase (sortie des scripts vers log) et retourne ses compteurs côté serveur et client."""
+    fake.reset_stats()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        run()
+    seconds = time.perf_counter() - start
+    stats = fake.stats
+    return {
+        'seconds': round(seconds, 4),
+        'requests': stats['requests'],
+        'round_trips': sum(client.round_trips for client in clients),
+        'actions': stats['actions'],
+        'failures': stats['failures'],
+        'requests_per_second': round(stats['requests'] / seconds, 1) if seconds else None,
+        'actions_per_second': round(stats['actions'] / seconds, 1) if seconds else None,
+        'by_action': {key.split(':', 1)[1]: count for key, count in sorted(stats.items()) if key.startswith('action:')},
+    }
+
+def run_load(workspace: str, phases: List[str], jobs: int, server_options: Dict[str, Any],
+             client_options: Dict[str, Any], log: io.TextIOBase) -> Dict[str, Any]:
+    """Lance le faux serveur et mesure chaque phase sur le corpus de workspace."""
+    sys.path.insert(0, os.path.join(workspace, 'scripts'))
+    import imports_decks
+    import export_with_media
+    from fake_anki_connect import DEFAULT_DECK, FakeAnkiConnect
+    from utils import AnkiConnectClient, build_media_index
+
+    anki_media_dir = os.path.join(workspace, 'anki_media')
+    csv_paths = sorted(os.path.join(root, name) for root, _, files in os.walk(imports_decks.DECKS_DIR)
+                       for name in files if name.endswith('.csv'))
+    measures = {}
+
+    with FakeAnkiConnect(media_dir=anki_media_dir, **server_options) as fake:
+        clients: List[AnkiConnectClient] = []
+
+        def make_client() -> AnkiConnectClient:
+            client = AnkiConnectClient(fake.url, **client_options)
+            clients.append(client)
+            return client
+
+        def import_all(sync: bool) -> None:
+            with make_client() as client:
+                model = imports_decks.get_anki_model(client)
+                fields = imports_decks.get_model_fields(client, model)
+                media_index = build_media_index(imports_decks.MEDIA_DIR)
+                known_media = imports_decks.get_existing_media(client)
+                for path in csv_paths:
+                    if sync:
+                        imports_decks.sync_file(client, path, model, fields, media_index, known_media)
+                    else:
+                        imports_decks.import_file(client, path, model, fields, media_index, known_media)
+                imports_decks.save_uploaded_media(known_media)
+
+        def export_all() -> None:
+            with make_client() as client:
+                decks = [name for name in client.invoke("deckNames") if name != DEFAULT_DECK]
+            media_copier = export_with_media.MediaCopier(anki_media_dir)
+            export_with_media.export_decks(decks, media_copier, make_client, jobs)
+
+        runs = {'import': lambda: import_all(False), 'sync': lambda: import_all(True), 'export': export_all}
+        for phase in phases:
+            clients.clear()
+            measures[phase] = measure_phase(fake, clients, runs[phase], log)
+        measures['collection'] = {'decks': len(fake.collection.decks) - 1, 'notes': len(fake.collection.notes)}
+
+    return measures
+
+def print_measures(measures: Dict[str, Any]) -> None:
+    """Affiche les compteurs de chaque phase."""
+    for phase in PHASES:
+        if phase not in measures:
+            continue
+        values = measures[phase]
+        failures = f", {values['failures']} panne(s)" if values['failures'] else ""
+        print(f"   {phase:<7} {values['seconds']:8.2f} s  {values['requests']:6} requête(s) "
+              f"({values['requests_per_second'] or 0:.0f}/s), {values['actions']} action(s){failures}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Test de charge de l'import et de l'export contre un faux AnkiConnect.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), help="Taille de corpus (small par défaut)")
+    parser.add_argument("--decks", type=int, help="Corpus sur mesure : nombre de CSV")
+    parser.add_argument("--cards", type=int, default=1000, help="Corpus sur mesure : nombre total de cartes")
+    parser.add_argument("--images", type=int, default=100, help="Corpus sur mesure : nombre d'images")
+    parser.add_argument("--phases", default=','.join(PHASES),
+                        help=f"Phases mesurées, séparées par des virgules ({','.join(PHASES)} par défaut)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Decks exportés en parallèle")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latence ajoutée à chaque requête, en secondes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latence aléatoire supplémentaire maximale")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Part des requêtes qui échouent (0 à 1)")
+    parser.add_argument("--failure-mode", choices=['drop', 'error'], default='drop',
+                        help="drop : connexion coupée (le client réessaie), error : erreur AnkiConnect")
+    parser.add_argument("--retries", type=int, default=3, help="Nouvelles tentatives du client AnkiConnect")
+    parser.add_argument("--output", help="Fichier de résultats (benchmarks/results/<date>-anki-connect-<commit>.json par défaut)")
+    parser.add_argument("--keep", action="store_true", help="Garde le corpus et le journal des scripts")
+    args = parser.parse_args()
+
+    phases = [name.strip() for name in args.phases.split(',') if name.strip()]
+    unknown = sorted(set(phases) - set(PHASES))
+    if unknown:
+        parser.error(f"phase(s) inconnue(s) : {', '.join(unknown)}")
+    if args.decks:
+        preset, size = 'custom', {'decks': args.decks, 'cards': args.cards, 'images': args.images}
+    else:
+        preset = args.preset or 'small'
+        size = PRESETS[preset]
+
+    server_options = {'latency': args.latency, 'jitter': args.jitter,
+                      'failure_rate': args.failure_rate, 'failure_mode': args.failure_mode}
+    # Short backoff: the injected failures are instantaneous, unlike a restarting Anki
+    client_options = {'retries': args.retries, 'backoff': 0.01}
+    commit = git_commit()
+    created = datetime.datetime.now(datetime.timezone.utc)
+
+    print("="*60)
+    print(f"🧪 CHARGE ANKICONNECT ({commit or 'hors git'})")
+    print("="*60)
+    print(f"📦 Corpus {preset} : {size['decks']} CSV, {size['cards']} cartes, {size['images']} images")
+    workspace = tempfile.mkdtemp(prefix=f"anki-load-{preset}-")
+    try:
+        shutil.copytree(SCRIPTS_DIR, os.path.join(workspace, 'scripts'),
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        corpus = generate_corpus(workspace, **size)
+        with open(os.path.join(workspace, 'load.log'), 'w', encoding='utf-8') as log:
+            measures = run_load(workspace, phases, args.jobs, server_options, client_options, log)
+    finally:
+        if args.keep:
+            print(f"   📁 Corpus et journal gardés : {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+    print_measures(measures)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'created': created.isoformat(timespec='seconds'),
+        'commit': commit,
+        'preset': preset,
+        'corpus': corpus,
+        'jobs': args.jobs,
+        'server': server_options,
+        'client': client_options,
+        'phases': measures,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{created:%Y%m%d-%H%M%S}-anki-connect-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print()
+    print(f"💾 Résultats : {output}")
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        main()
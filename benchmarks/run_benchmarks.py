@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks du pipeline de build sur des corpus synthétiques : durée et pic mémoire
+de chaque étape (parse, package, previews, index), enregistrés en JSON pour comparer
+deux versions du code.
+
+Chaque corpus est généré dans un dossier temporaire avec une copie de scripts/ :
+les chemins des scripts (decks/, media/, docs/, .cache/) pointent alors vers le corpus,
+et chaque mesure tourne dans un processus neuf.
+
+Usage :
+    python3 benchmarks/run_benchmarks.py --preset small --preset medium
+    python3 benchmarks/run_benchmarks.py --preset small --warm --compare benchmarks/results/avant.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+from generate_corpus import PRESETS, generate_corpus
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# --- CONFIGURATION ---
+SCRIPT_PATH = os.path.realpath(__file__)
+BENCH_DIR = os.path.dirname(SCRIPT_PATH)
+BASE_DIR = os.path.dirname(BENCH_DIR)
+SCRIPTS_DIR = os.path.join(BASE_DIR, "scripts")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# Bump when the layout of the result files changes
+RESULTS_VERSION = 1
+DEFAULT_STAGES = ['parse', 'package', 'previews', 'index']
+
+def git_commit() -> Optional[str]:
+    """Commit courant (suffixé de -dirty si la copie de travail est modifiée)."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--', 'scripts'], cwd=BASE_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+def max_rss_bytes() -> Optional[int]:
+    """Pic de mémoire résidente du processus (None si non mesurable)."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+def run_stages(workspace: str, stages: List[str], jobs: int, trace_memory: bool) -> Dict[str, Any]:
+    """Exécute les étapes du build dans workspace (processus de mesure) et retourne les mesures."""
+    sys.path.insert(0, os.path.join(workspace, 'scripts'))
+    import build
+
+    state = build.BuildState(reproducible=True, jobs=jobs)
+    measures = {}
+    if trace_memory:
+        tracemalloc.start()
+    total_start = time.perf_counter()
+    for name in build.parse_stages(','.join(stages)):
+        if trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        build.STAGE_FUNCTIONS[name](state)
+        measures[name] = {'seconds': round(time.perf_counter() - start, 4)}
+        if trace_memory:
+            measures[name]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    total = time.perf_counter() - total_start
+    if trace_memory:
+        tracemalloc.stop()
+
+    return {
+        'stages': measures,
+        'total_seconds': round(total, 4),
+        'max_rss_bytes': max_rss_bytes(),
+        'counts': dict(state.stats),
+    }
+
+def measure(workspace: str, stages: List[str], jobs: int, trace_memory: bool) -> Dict[str, Any]:
+    """Lance run_stages dans un processus neuf (imports et mémoire propres à la mesure)."""
+    result_path = os.path.join(workspace, 'benchmark_result.json')
+    log_path = os.path.join(workspace, 'benchmark.log')
+    command = [sys.executable, SCRIPT_PATH, '--worker', workspace, '--stages', ','.join(stages), '--jobs', str(jobs)]
+    if not trace_memory:
+        command.append('--no-memory')
+    with open(log_path, 'w', encoding='utf-8') as log:
+        completed = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+    if completed.returncode != 0:
+        with open(log_path, 'r', encoding='utf-8') as log:
+            print(log.read()[-4000:])
+        raise RuntimeError(f"le build a échoué (code {completed.returncode}), voir {log_path}")
+    with open(result_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def run_preset(name: str, size: Dict[str, int], stages: List[str], jobs: int, trace_memory: bool,
+               warm: bool, keep: bool) -> Dict[str, Any]:
+    """Génère un corpus, mesure un build à froid (et à chaud avec warm) et retourne les résultats."""
+    workspace = tempfile.mkdtemp(prefix=f"anki-bench-{name}-")
+    try:
+        print(f"📦 Corpus {name} : {size['decks']} CSV, {size['cards']} cartes, {size['images']} images")
+        shutil.copytree(SCRIPTS_DIR, os.path.join(workspace, 'scripts'),
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        start = time.perf_counter()
+        corpus = generate_corpus(workspace, **size)
+        corpus['generation_seconds'] = round(time.perf_counter() - start, 2)
+
+        run = {'preset': name, 'corpus': corpus, 'jobs': jobs, 'tracemalloc': trace_memory}
+        run['cold'] = measure(workspace, stages, jobs, trace_memory)
+        print_measures('à froid', run['cold'])
+        if warm:
+            # Same tree again: build cache, catalog and media cache are all hot
+            run['warm'] = measure(workspace, stages, jobs, trace_memory)
+            print_measures('à chaud', run['warm'])
+        return run
+    finally:
+        if keep:
+            print(f"   📁 Corpus gardé : {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+def print_measures(label: str, measures: Dict[str, Any]) -> None:
+    """Affiche la durée (et le pic mémoire) de chaque étape."""
+    print(f"   ⏱️ Build {label} : {measures['total_seconds']:.2f} s")
+    for stage, values in measures['stages'].items():
+        peak = f", pic {values['peak_bytes'] / 1024 / 1024:.1f} Mo" if 'peak_bytes' in values else ""
+        print(f"      {stage:<10} {values['seconds']:8.2f} s{peak}")
+
+def compare_results(previous: Dict[str, Any], current: Dict[str, Any]) -> None:
+    """Affiche l'évolution des durées par étape entre deux fichiers de résultats."""
+    print()
+    print(f"📊 Comparaison avec {previous.get('commit') or '?'} ({previous.get('created', '?')})")
+    previous_runs = {run['preset']: run for run in previous.get('runs', [])}
+    for run in current['runs']:
+        before = previous_runs.get(run['preset'])
+        if not before:
+            print(f"   {run['preset']} : absent des anciens résultats")
+            continue
+        for phase in ('cold', 'warm'):
+            if phase not in run or phase not in before:
+                continue
+            print(f"   {run['preset']} ({phase})")
+            for stage, values in run[phase]['stages'].items():
+                old = before[phase]['stages'].get(stage)
+                if not old or not old['seconds']:
+                    continue
+                ratio = values['seconds'] / old['seconds']
+                print(f"      {stage:<10} {old['seconds']:8.2f} s → {values['seconds']:8.2f} s  (×{ratio:.2f})")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks du build sur des corpus synthétiques.")
+    parser.add_argument("--preset", action="append", choices=sorted(PRESETS),
+                        help="Taille de corpus (répétable, small par défaut)")
+    parser.add_argument("--decks", type=int, help="Corpus sur mesure : nombre de CSV")
+    parser.add_argument("--cards", type=int, default=1000, help="Corpus sur mesure : nombre total de cartes")
+    parser.add_argument("--images", type=int, default=100, help="Corpus sur mesure : nombre d'images")
+    parser.add_argument("--stages", default=','.join(DEFAULT_STAGES),
+                        help=f"Étapes mesurées, séparées par des virgules ({','.join(DEFAULT_STAGES)} par défaut)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Processus de génération des paquets")
+    parser.add_argument("--warm", action="store_true", help="Mesure aussi un second build, caches chauds")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Sans tracemalloc : durées plus justes, sans pic mémoire par étape")
+    parser.add_argument("--output", help="Fichier de résultats (benchmarks/results/<date>-<commit>.json par défaut)")
+    parser.add_argument("--compare", metavar="JSON", help="Résultats précédents à comparer")
+    parser.add_argument("--keep", action="store_true", help="Garde les corpus générés")
+    parser.add_argument("--worker", metavar="WORKSPACE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    if args.worker:
+        # Measurement process: the build output goes to the log, the measures to a file
+        measures = run_stages(args.worker, stages, args.jobs, not args.no_memory)
+        with open(os.path.join(args.worker, 'benchmark_result.json'), 'w', encoding='utf-8') as f:
+            json.dump(measures, f)
+        return
+
+    corpora = {name: PRESETS[name] for name in (args.preset or [])}
+    if args.decks:
+        corpora['custom'] = {'decks': args.decks, 'cards': args.cards, 'images': args.images}
+    if not corpora:
+        corpora['small'] = PRESETS['small']
+
+    commit = git_commit()
+    created = datetime.datetime.now(datetime.timezone.utc)
+    results = {
+        'version': RESULTS_VERSION,
+        'created': created.isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'stages': stages,
+        'runs': [],
+    }
+
+    print("="*60)
+    print(f"🏁 BENCHMARKS ({commit or 'hors git'})")
+    print("="*60)
+    for name, size in corpora.items():
+        results['runs'].append(run_preset(name, size, stages, args.jobs, not args.no_memory, args.warm, args.keep))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{created:%Y%m%d-%H%M%S}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print()
+    print(f"💾 Résultats : {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(json.load(f), results)
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        main()
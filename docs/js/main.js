@@ -17,10 +17,24 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Full-text index of the cards, built by generate_index.py (absent on older pages)
+    const searchIndexUrl = searchInput ? searchInput.getAttribute('data-search-index') : null;
+    let searchMeta = null;
+    const shardCache = new Map();
+    // Incremented on each keystroke so that late answers of older queries are ignored
+    let searchToken = 0;
+
     if (searchInput) {
         searchInput.addEventListener('input', (e) => {
             const query = e.target.value.trim();
-            filterDecks(query);
+            // Titles first, then decks whose cards match once the needed shards are loaded
+            filterDecks(query, null);
+            if (!query || !searchIndexUrl) return;
+
+            const token = ++searchToken;
+            searchCards(query).then(counts => {
+                if (token === searchToken) filterDecks(query, counts);
+            }).catch(err => console.error("Search index error: ", err));
         });
     }
 
@@ -29,12 +43,88 @@ document.addEventListener('DOMContentLoaded', () => {
         return text.normalize("NFD").replace(/[\u0300-\u036f]/g, "").toLowerCase();
     }
 
-    function filterDecks(query) {
+    // Same folding as utils.fold_accents on the Python side
+    function foldAccents(text) {
+        return text.normalize("NFKD").replace(/[^\x00-\x7f]/g, "").toLowerCase();
+    }
+
+    function loadJson(url) {
+        return fetch(url).then(response => {
+            if (!response.ok) throw new Error(`Not found: ${url}`);
+            return response.json();
+        });
+    }
+
+    function getSearchMeta() {
+        if (!searchMeta) {
+            const metaUrl = new URL(searchIndexUrl, window.location.href);
+            searchMeta = loadJson(metaUrl).then(meta => ({ meta, metaUrl, stopwords: new Set(meta.stopwords) }));
+            searchMeta.catch(() => { searchMeta = null; });
+        }
+        return searchMeta;
+    }
+
+    function loadShard(prefix, meta, metaUrl) {
+        if (!shardCache.has(prefix)) {
+            const shard = loadJson(new URL(meta.shards[prefix], metaUrl));
+            shardCache.set(prefix, shard);
+            shard.catch(() => shardCache.delete(prefix));
+        }
+        return shardCache.get(prefix);
+    }
+
+    // Number of matching cards per deck id: every query word must start a word of the card
+    async function searchCards(query) {
+        const { meta, metaUrl, stopwords } = await getSearchMeta();
+        const tokens = (foldAccents(query).match(/[a-z0-9]+/g) || [])
+            .filter(token => token.length >= meta.min_token && !stopwords.has(token));
+        const counts = new Map();
+        if (tokens.length === 0) return counts;
+
+        // Only the shards of the query words are downloaded, in parallel
+        const shards = await Promise.all(tokens.map(token => {
+            const prefix = token.slice(0, meta.prefix);
+            return meta.shards[prefix] ? loadShard(prefix, meta, metaUrl) : {};
+        }));
+
+        let matches = null;
+        tokens.forEach((token, i) => {
+            const cards = new Set();
+            for (const [word, ids] of Object.entries(shards[i])) {
+                if (word.startsWith(token)) ids.forEach(id => cards.add(id));
+            }
+            matches = matches === null ? cards : new Set([...matches].filter(id => cards.has(id)));
+        });
+
+        for (const id of matches) {
+            // Deck i holds cards offsets[i] to offsets[i + 1] - 1
+            let low = 0, high = meta.decks.length - 1;
+            while (low < high) {
+                const mid = (low + high + 1) >> 1;
+                if (meta.offsets[mid] <= id) low = mid; else high = mid - 1;
+            }
+            const deckId = meta.decks[low];
+            counts.set(deckId, (counts.get(deckId) || 0) + 1);
+        }
+        return counts;
+    }
+
+    function showSearchHits(card, count) {
+        const hits = card.querySelector('.deck-search-hits');
+        if (!hits) return;
+        hits.textContent = count ? `${count} carte${count > 1 ? 's' : ''} trouvée${count > 1 ? 's' : ''}` : '';
+        hits.classList.toggle('hidden', !count);
+    }
+
+    function filterDecks(query, contentCounts) {
         let visibleCount = 0;
 
         // resets if query is empty
         if (!query) {
-            deckCards.forEach(card => card.classList.remove('hidden'));
+            deckCards.forEach(card => {
+                card.classList.remove('hidden');
+                showSearchHits(card, 0);
+            });
             subjectSections.forEach(section => section.classList.remove('hidden'));
             if (noResultsMessage) noResultsMessage.style.display = 'none';
             return;
@@ -54,7 +144,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 const searchableContent = subject + " " + title;
 
                 // Check if ALL words/tokens from the query are found in the content (AND logic)
-                const isMatch = queryTokens.every(token => searchableContent.includes(token));
+                const hitCount = contentCounts ? (contentCounts.get(card.id) || 0) : 0;
+                const isMatch = queryTokens.every(token => searchableContent.includes(token)) || hitCount > 0;
+                showSearchHits(card, hitCount);
 
                 if (isMatch) {
                     card.classList.remove('hidden');
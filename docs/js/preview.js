@@ -51,8 +51,11 @@ document.addEventListener('DOMContentLoaded', () => {
     const totalCardsEl = document.getElementById('total-cards-count');
 
     let currentCards = [];
+    let totalCards = 0;
     let currentIndex = 0;
     let isFlipped = false;
+    // Incremented on each open/close so that pages of a previous deck are ignored
+    let loadToken = 0;
 
     function openModal() {
         modal.classList.remove('hidden');
@@ -62,7 +65,9 @@ document.addEventListener('DOMContentLoaded', () => {
     function closeModal() {
         modal.classList.add('hidden');
         document.body.style.overflow = '';
+        loadToken++;
         currentCards = [];
+        totalCards = 0;
         resetCard();
     }
 
@@ -88,10 +93,34 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         currentIdxEl.textContent = currentIndex + 1;
-        totalCardsEl.textContent = currentCards.length;
+        updateNavButtons();
+    }
 
+    function updateNavButtons() {
+        totalCardsEl.textContent = totalCards;
         prevBtn.disabled = currentIndex === 0;
-        nextBtn.disabled = currentIndex === currentCards.length - 1;
+        // The next card may still be in a page being downloaded
+        nextBtn.disabled = currentIndex >= currentCards.length - 1;
+    }
+
+    async function fetchJson(url, options) {
+        const response = await fetch(url, options);
+        if (!response.ok) throw new Error(`Preview not found: ${url}`);
+        return response.json();
+    }
+
+    // Downloads the remaining pages in parallel and appends them in order
+    async function loadRemainingPages(pageUrls, token) {
+        const pages = pageUrls.map(url => fetchJson(url).catch(err => {
+            console.error(err);
+            return null;
+        }));
+        for (const page of pages) {
+            const cards = await page;
+            if (token !== loadToken || !cards) return;
+            currentCards.push(...cards);
+            updateNavButtons();
+        }
     }
 
     previewBtns.forEach(btn => {
@@ -110,18 +139,30 @@ document.addEventListener('DOMContentLoaded', () => {
             resetCard();
 
             openModal();
+            const token = ++loadToken;
 
             try {
-                const response = await fetch(`${previewUrl}?t=${new Date().getTime()}`);
-                if (!response.ok) throw new Error("Preview not found");
-
-                const cards = await response.json();
+                const manifestUrl = new URL(previewUrl, window.location.href);
+                // decks.html embeds the current page URLs: no manifest request, and the
+                // content-hashed pages can be served from the browser cache
+                const inlinePages = btn.getAttribute('data-preview-pages');
+                const manifest = inlinePages
+                    ? { cards: parseInt(btn.getAttribute('data-preview-cards'), 10), pages: JSON.parse(inlinePages) }
+                    // Fixed-name manifest: revalidated, a stale copy would point at pruned pages
+                    : await fetchJson(manifestUrl.href, { cache: 'no-cache' });
+
+                // Previews written before pagination are a plain array of cards
+                const pageUrls = Array.isArray(manifest) ? [] : manifest.pages.map(page => new URL(page, manifestUrl).href);
+                const cards = Array.isArray(manifest) ? manifest : (pageUrls.length ? await fetchJson(pageUrls[0]) : []);
+                if (token !== loadToken) return;
 
                 if (cards && cards.length > 0) {
                     currentCards = cards;
+                    totalCards = Array.isArray(manifest) ? cards.length : manifest.cards;
                     currentIndex = 0;
                     titleEl.textContent = deckTitle;
                     updateCardDisplay();
+                    loadRemainingPages(pageUrls.slice(1), token);
                 } else {
                     titleEl.textContent = "Deck invalide";
                     flashcardFront.innerHTML = "Aucune carte trouvée pour ce deck.";
@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Build complet du site en un seul processus : parse → package → previews → index → sitemap.
+Les étapes se transmettent les decks en mémoire ; genanki et Jinja2 ne sont importés
+que par les étapes qui en ont besoin.
+
+Usage :
+    python3 scripts/build.py
+    python3 scripts/build.py --stages previews,index
+    python3 scripts/build.py --since origin/main
+    python3 scripts/build.py --watch --serve
+
+Avec --watch, le build complet est suivi d'une surveillance de decks/, media/ et
+scripts/templates/ : chaque modification ne reconstruit que le paquet et l'aperçu des
+decks concernés, puis met à jour apkg_meta.json, l'index, decks.json et decks.html.
+"""
+
+import argparse
+import contextlib
+import functools
+import http.server
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from utils import build_media_index
+import catalog
+import generate_apkg
+import generate_index
+import instrumentation
+import media_optimizer
+
+# Last built .apkg and preview of every deck, restored by --since for untouched decks
+ARTIFACTS_DIR = os.path.join(generate_apkg.CACHE_DIR, "artifacts")
+ARTIFACTS_MANIFEST_PATH = os.path.join(ARTIFACTS_DIR, "manifest.json")
+# Bump when the layout of the artifacts manifest changes
+ARTIFACTS_MANIFEST_VERSION = 2
+# Sources the artifacts are built from: uncommitted changes there leave them without a commit
+SOURCE_PATHS = ['decks', 'media', 'scripts', 'requirements.txt']
+
+STAGES = ['parse', 'package', 'previews', 'index', 'sitemap']
+# Stages that need the decks read by 'parse'
+NEEDS_PARSE = {'package', 'previews'}
+
+# Folders watched by --watch, relative to the repository root
+WATCHED_DIRS = ['decks', 'media', 'scripts/templates']
+# Seconds between two scans of the watched folders
+WATCH_INTERVAL = 0.3
+# A change is rebuilt once the files stay untouched this long (editors save in several writes)
+WATCH_DEBOUNCE = 0.2
+DEFAULT_SERVE_PORT = 8000
+
+class BuildState:
+    """État partagé par les étapes d'un build."""
+
+    def __init__(self, force: bool = False, reproducible: bool = False, jobs: int = 1,
+                 since: Optional[str] = None, optimize_media: bool = False):
+        self.force = force
+        self.reproducible = reproducible
+        self.jobs = jobs
+        self.since = since
+        self.optimize_media = optimize_media
+        self.media_index: Dict[str, List[str]] = {}
+        self.decks: List[generate_apkg.ParsedDeck] = []
+        # Decks left untouched since the --since ref: output filename -> card count
+        self.restored: Dict[str, int] = {}
+        # Images of the restored decks, copied to docs/media with their previews
+        self.restored_media: Dict[str, List[str]] = {}
+        # Card count of each .apkg, as written to apkg_meta.json (None: not built in this run)
+        self.apkg_meta = None
+        # Preview manifest of each deck written in this run, by output filename
+        self.previews: Dict[str, Dict[str, Any]] = {}
+        self.decks_info = None
+        self.search_index_url: Optional[str] = None
+        self.stats = Counter()
+
+def git_changed_files(ref: str) -> Optional[List[str]]:
+    """
+    Fichiers modifiés depuis ref (commits, copie de travail et fichiers non suivis),
+    chemins relatifs à la racine du dépôt. None si git ne peut pas répondre.
+    """
+    commands = [
+        ['git', 'diff', '--name-only', '--no-renames', '-z', ref, '--'],
+        ['git', 'ls-files', '--others', '--exclude-standard', '-z'],
+    ]
+    changed = []
+    try:
+        for command in commands:
+            result = subprocess.run(command, cwd=generate_apkg.BASE_DIR, capture_output=True,
+                                    text=True, encoding='utf-8', check=True)
+            changed.extend(path for path in result.stdout.split('\0') if path)
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = e.stderr.strip() if isinstance(e, subprocess.CalledProcessError) else e
+        print(f"⚠️ git diff depuis {ref} impossible, build complet : {detail}")
+        return None
+    return changed
+
+def git_output(*args: str) -> Optional[str]:
+    """Sortie d'une commande git dans le dépôt, None si elle échoue."""
+    try:
+        result = subprocess.run(['git', *args], cwd=generate_apkg.BASE_DIR, capture_output=True,
+                                text=True, encoding='utf-8', check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout
+
+def source_commit() -> Optional[str]:
+    """
+    Commit dont les sources donnent les artefacts de ce build : HEAD, sauf si decks/, media/
+    ou scripts/ ont des modifications non commitées (None, comme hors git).
+    """
+    head = git_output('rev-parse', 'HEAD')
+    status = git_output('status', '--porcelain', '--', *SOURCE_PATHS)
+    if head is None or status is None or status.strip():
+        return None
+    return head.strip()
+
+def is_ancestor(commit: str) -> bool:
+    """Vérifie que commit est connu et fait partie de l'historique de HEAD."""
+    return git_output('merge-base', '--is-ancestor', commit, 'HEAD') is not None
+
+def affected_csv_paths(changed: List[str], conn) -> Optional[Set[str]]:
+    """
+    CSV (relatifs à decks/) concernés par des fichiers modifiés : les CSV eux-mêmes
+    et ceux qui référencent une image modifiée. None si tout doit être reconstruit.
+    """
+    affected = set()
+    for path in changed:
+        # Generation code or dependencies changed: every deck may differ
+        if path == 'requirements.txt' or (path.startswith('scripts/') and path.endswith('.py')):
+            return None
+        if path.startswith('decks/') and path.endswith('.csv'):
+            affected.add(path[len('decks/'):])
+        elif path.startswith('media/'):
+            affected.update(catalog.decks_using_media(conn, path))
+    return affected
+
+def load_artifacts_manifest() -> Dict[str, Any]:
+    """
+    Charge la liste des artefacts : commit des sources ('commit') et nombre de cartes de
+    chaque .apkg archivé ('decks'). Vide si elle est absente, illisible ou d'une autre version.
+    """
+    try:
+        with open(ARTIFACTS_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or manifest.get('version') != ARTIFACTS_MANIFEST_VERSION:
+        return {}
+    return manifest
+
+def save_artifacts_manifest(decks: Dict[str, Dict[str, Any]], commit: Optional[str]) -> None:
+    """Enregistre la liste des artefacts et le commit dont ils sont issus (None : inconnu)."""
+    os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+    with open(ARTIFACTS_MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump({'version': ARTIFACTS_MANIFEST_VERSION, 'commit': commit, 'decks': decks},
+                  f, ensure_ascii=False, indent=2)
+
+def artifact_paths(output_filename: str) -> List[Tuple[str, str]]:
+    """(artefact, chemin dans docs/) pour le .apkg, le manifeste d'aperçu et ses pages."""
+    preview_manifest, preview_pages = generate_apkg.get_preview_paths(output_filename)
+    artifact_manifest, artifact_pages = generate_apkg.get_preview_paths(output_filename,
+                                                                         os.path.join(ARTIFACTS_DIR, 'previews'))
+    return [
+        (os.path.join(ARTIFACTS_DIR, output_filename), os.path.join(generate_apkg.OUTPUT_DIR, output_filename)),
+        (artifact_manifest, preview_manifest),
+        (artifact_pages, preview_pages),
+    ]
+
+def has_artifacts(output_filename: str) -> bool:
+    """Vérifie que le .apkg et l'aperçu d'un deck sont archivés."""
+    return all(os.path.exists(artifact) for artifact, _ in artifact_paths(output_filename))
+
+def copy_artifact(source: str, destination: str, changed: bool = False) -> None:
+    """
+    Copie un fichier ou un dossier de pages d'aperçu, vers ou depuis les artefacts, sans relire
+    ce qui n'a pas changé. Un fichier écrit par ce build (changed) est toujours copié, un autre
+    seulement si sa taille ou sa date diffère (copy2 garde la date). Les pages, nommées d'après
+    leur contenu, ne sont copiées que si elles manquent ; celles en trop sont supprimées.
+    """
+    if os.path.isdir(source):
+        os.makedirs(destination, exist_ok=True)
+        names = set(os.listdir(source))
+        existing = set(os.listdir(destination))
+        for name in existing - names:
+            os.remove(os.path.join(destination, name))
+        for name in sorted(names - existing):
+            shutil.copy2(os.path.join(source, name), os.path.join(destination, name))
+        return
+    if not changed and os.path.exists(destination):
+        src_stat, dest_stat = os.stat(source), os.stat(destination)
+        if src_stat.st_size == dest_stat.st_size and int(src_stat.st_mtime) == int(dest_stat.st_mtime):
+            return
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    shutil.copy2(source, destination)
+
+def stage_parse(state: BuildState) -> None:
+    """Met le catalogue à jour et lit tous les CSV."""
+    conn = catalog.connect()
+    catalog_stats = catalog.update_catalog(conn, generate_apkg.DECKS_DIR)
+    print(f"📇 Catalogue : {catalog_stats['indexed']} deck(s) réindexé(s), {catalog_stats['removed']} supprimé(s)")
+
+    state.media_index = build_media_index(generate_apkg.MEDIA_DIR)
+    generate_apkg.report_ambiguous_media(state.media_index)
+
+    affected = None
+    manifest: Dict[str, Dict[str, Any]] = {}
+    if state.since:
+        # The restored cache may come from an older build than state.since (failed or cancelled
+        # runs are not cached): diff against the commit the artifacts were built from
+        artifacts = load_artifacts_manifest()
+        base = artifacts.get('commit')
+        if not base or not is_ancestor(base):
+            print("⚠️ Artefacts sans commit connu dans l'historique : build complet")
+        else:
+            if base != (git_output('rev-parse', state.since) or '').strip():
+                print(f"ℹ️ Artefacts construits au commit {base[:12]} : comparaison depuis ce commit")
+            changed = git_changed_files(base)
+            if changed is not None:
+                affected = affected_csv_paths(changed, conn)
+                if affected is None:
+                    print("⚠️ Scripts de génération modifiés : build complet")
+                else:
+                    manifest = artifacts['decks']
+
+    for subject_folder, csv_path in generate_apkg.collect_csv_files():
+        if affected is not None:
+            rel_path = os.path.relpath(csv_path, generate_apkg.DECKS_DIR).replace(os.sep, '/')
+            _, output_filename, media_subfolder = generate_apkg.get_deck_names(csv_path, subject_folder)
+            if rel_path not in affected and output_filename in manifest and has_artifacts(output_filename):
+                state.restored[output_filename] = manifest[output_filename]['cards']
+                # Artifacts hold no images: resolved from the catalog, without reading the CSV
+                media_files = generate_apkg.find_media_files(catalog.deck_media(conn, rel_path), media_subfolder,
+                                                             state.media_index)
+                if state.optimize_media:
+                    media_files = media_optimizer.optimize_media_files(media_files)
+                state.restored_media[output_filename] = media_files
+                continue
+        with instrumentation.deck(os.path.relpath(csv_path, generate_apkg.DECKS_DIR).replace(os.sep, '/')):
+            deck = generate_apkg.parse_deck(csv_path, subject_folder, state.media_index, state.optimize_media)
+        if not deck.notes:
+            print(f"   ❌ Aucune carte : {os.path.relpath(csv_path, generate_apkg.DECKS_DIR)}")
+            state.stats['errors'] += 1
+            continue
+        state.decks.append(deck)
+    conn.close()
+    print(f"✅ {len(state.decks)} deck(s), {sum(len(d.notes) for d in state.decks)} cartes")
+    if affected is not None:
+        print(f"🎯 Depuis {state.since} : {len(state.decks)} deck(s) à reconstruire, "
+              f"{len(state.restored)} repris des artefacts")
+
+def stage_package(state: BuildState) -> None:
+    """Écrit les .apkg (decks inchangés repris du cache), puis apkg_meta.json."""
+    os.makedirs(generate_apkg.OUTPUT_DIR, exist_ok=True)
+    os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+    build_cache = {} if state.force else generate_apkg.load_build_cache()
+    capture_output = state.jobs > 1
+    tasks = [generate_apkg.DeckTask(deck.csv_path, deck.subject_folder, build_cache.get(deck.output_filename),
+                                    state.reproducible, capture_output, parsed=deck, previews=False,
+                                    instrument=instrumentation.is_enabled())
+             for deck in state.decks]
+
+    apkg_meta = {}
+    for result in generate_apkg.run_deck_builds(tasks, state.jobs, state.media_index):
+        print(result['log'], end='')
+        out_name = result['output_filename']
+        instrumentation.merge(result['metrics'], deck=out_name)
+        if result['success']:
+            apkg_meta[out_name] = {'cards': result['cards']}
+            build_cache[out_name] = result['cache_entry']
+            state.stats['cached' if result['cached'] else 'built'] += 1
+            instrumentation.count('build_cache_hits' if result['cached'] else 'build_cache_misses')
+            apkg_artifact, apkg_path = artifact_paths(out_name)[0]
+            # Only rebuilt packages are copied, unchanged ones are checked by size and date
+            copy_artifact(apkg_path, apkg_artifact, changed=not result['cached'])
+        else:
+            state.stats['errors'] += 1
+
+    for out_name, card_count in state.restored.items():
+        copy_artifact(*artifact_paths(out_name)[0])
+        apkg_meta[out_name] = {'cards': card_count}
+        state.stats['restored'] += 1
+
+    # No commit until the previews stage has archived the previews too
+    save_artifacts_manifest(apkg_meta, None)
+    # Restored decks keep their entry: a later full build can still skip them
+    generate_apkg.save_build_cache({name: entry for name, entry in build_cache.items() if name in apkg_meta})
+    # Still written for generate_index.py run on its own
+    with open(os.path.join(generate_apkg.OUTPUT_DIR, 'apkg_meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(apkg_meta, f, ensure_ascii=False, indent=2)
+    state.apkg_meta = apkg_meta
+
+def stage_previews(state: BuildState) -> None:
+    """Écrit les aperçus JSON et copie leurs images dans docs/media."""
+    os.makedirs(generate_apkg.PREVIEWS_DIR, exist_ok=True)
+    os.makedirs(generate_apkg.OUT_MEDIA_DIR, exist_ok=True)
+    for deck in state.decks:
+        with instrumentation.deck(deck.output_filename):
+            manifest = generate_apkg.write_preview(deck)
+        if manifest:
+            state.previews[deck.output_filename] = manifest
+        for artifact_path, output_path in artifact_paths(deck.output_filename)[1:]:
+            copy_artifact(output_path, artifact_path, changed=True)
+    for out_name in state.restored:
+        for artifact_path, output_path in artifact_paths(out_name)[1:]:
+            copy_artifact(artifact_path, output_path)
+        # Same images (or preview variants) as when the pages were written
+        generate_apkg.copy_preview_media(state.restored_media.get(out_name, []))
+    print(f"✅ {len(state.decks)} aperçu(s) générés, {len(state.restored)} repris des artefacts")
+    if state.apkg_meta is not None:
+        # Packages and previews archived: a later --since build can diff from this commit
+        save_artifacts_manifest(state.apkg_meta, source_commit())
+    removed = generate_apkg.prune_previews({deck.output_filename for deck in state.decks} | set(state.restored))
+    if removed:
+        print(f"🧹 {removed} aperçu(s) de decks supprimés effacé(s)")
+
+def stage_index(state: BuildState) -> None:
+    """Génère l'index de recherche, decks.json et decks.html."""
+    with instrumentation.stage('collect'):
+        state.decks_info = generate_index.collect_decks_info(state.apkg_meta, state.previews)
+    with instrumentation.stage('search'):
+        state.search_index_url = generate_index.save_search_index(state.decks_info)
+    with instrumentation.stage('json'):
+        generate_index.save_json(state.decks_info)
+    with instrumentation.stage('html'):
+        generate_index.save_html(state.decks_info, state.search_index_url)
+
+def stage_sitemap(state: BuildState) -> None:
+    """Génère sitemap.xml."""
+    if state.decks_info is None:
+        state.decks_info = generate_index.collect_decks_info(state.apkg_meta, state.previews)
+    generate_index.save_sitemap(state.decks_info)
+
+STAGE_FUNCTIONS: Dict[str, Callable[[BuildState], None]] = {
+    'parse': stage_parse,
+    'package': stage_package,
+    'previews': stage_previews,
+    'index': stage_index,
+    'sitemap': stage_sitemap,
+}
+
+def parse_stages(value: str) -> List[str]:
+    """Étapes demandées, dans l'ordre du pipeline ('parse' ajouté si nécessaire)."""
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(STAGES)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"étape(s) inconnue(s) : {', '.join(sorted(unknown))} "
+                                         f"(possibles : {', '.join(STAGES)})")
+    if requested & NEEDS_PARSE:
+        requested.add('parse')
+    return [name for name in STAGES if name in requested]
+
+def run_build(stages: List[str], state: BuildState) -> Dict[str, Any]:
+    """Exécute les étapes demandées dans l'ordre."""
+    for name in stages:
+        print()
+        print(f"▶️ Étape : {name}")
+        with instrumentation.stage(name):
+            STAGE_FUNCTIONS[name](state)
+    return dict(state.stats)
+
+def snapshot_files(base_dir: str = generate_apkg.BASE_DIR,
+                   folders: List[str] = WATCHED_DIRS) -> Dict[str, Tuple[int, int]]:
+    """(date, taille) de chaque fichier surveillé, par chemin relatif à base_dir."""
+    snapshot = {}
+    for folder in folders:
+        for root, dirs, files in os.walk(os.path.join(base_dir, folder)):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in files:
+                # Editor swap and backup files
+                if name.startswith('.') or name.endswith('~'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[os.path.relpath(path, base_dir).replace(os.sep, '/')] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+def changed_files(before: Dict[str, Tuple[int, int]], after: Dict[str, Tuple[int, int]]) -> List[str]:
+    """Fichiers ajoutés, supprimés ou modifiés entre deux relevés."""
+    return sorted(path for path in before.keys() | after.keys() if before.get(path) != after.get(path))
+
+def wait_for_changes(snapshot: Dict[str, Tuple[int, int]]) -> Tuple[List[str], Dict[str, Tuple[int, int]]]:
+    """Attend une modification des dossiers surveillés, puis qu'elle se stabilise (fichiers, nouveau relevé)."""
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        current = snapshot_files()
+        if current == snapshot:
+            continue
+        while True:
+            time.sleep(WATCH_DEBOUNCE)
+            latest = snapshot_files()
+            if latest == current:
+                break
+            current = latest
+        changed = changed_files(snapshot, current)
+        if changed:
+            return changed, current
+
+def rebuild_changed(state: BuildState, changed: List[str]) -> int:
+    """
+    Reconstruit le paquet et l'aperçu des seuls decks touchés par des fichiers modifiés,
+    puis met à jour sur place apkg_meta.json, l'index de recherche, decks.json et decks.html.
+    Retourne le nombre de decks reconstruits ou retirés.
+    """
+    conn = catalog.connect()
+    # Before and after the update: a card may stop or start using a changed image
+    affected = affected_csv_paths(changed, conn) or set()
+    catalog.update_catalog(conn, generate_apkg.DECKS_DIR)
+    affected |= affected_csv_paths(changed, conn) or set()
+    conn.close()
+    if any(path.startswith('media/') for path in changed):
+        state.media_index = build_media_index(generate_apkg.MEDIA_DIR)
+    templates_changed = any(path.startswith('scripts/templates/') for path in changed)
+
+    build_cache = {} if state.force else generate_apkg.load_build_cache()
+    published = set(state.apkg_meta)
+    for rel_path in sorted(affected):
+        csv_path = os.path.join(generate_apkg.DECKS_DIR, *rel_path.split('/'))
+        subject_folder = rel_path.split('/')[0] if '/' in rel_path else 'Divers'
+        _, out_name, _ = generate_apkg.get_deck_names(csv_path, subject_folder)
+        state.decks = [deck for deck in state.decks if deck.output_filename != out_name]
+        deck = None
+        if os.path.exists(csv_path):
+            deck = generate_apkg.parse_deck(csv_path, subject_folder, state.media_index, state.optimize_media)
+            if not deck.notes:
+                print(f"   ❌ Aucune carte : {rel_path}")
+
+        result = None
+        if deck is not None and deck.notes:
+            task = generate_apkg.DeckTask(csv_path, subject_folder, build_cache.get(out_name), state.reproducible,
+                                          False, parsed=deck, previews=False)
+            result = next(generate_apkg.run_deck_builds([task], 1, state.media_index))
+        if result is None or not result['success']:
+            state.apkg_meta.pop(out_name, None)
+            state.previews.pop(out_name, None)
+            build_cache.pop(out_name, None)
+            if deck is None:
+                # CSV removed: its package goes too
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(generate_apkg.OUTPUT_DIR, out_name))
+                print(f"🗑️ Deck retiré : {out_name}")
+            generate_index.update_deck_info(state.decks_info, out_name, None)
+            continue
+
+        state.decks.append(deck)
+        state.apkg_meta[out_name] = {'cards': result['cards']}
+        build_cache[out_name] = result['cache_entry']
+        manifest = generate_apkg.write_preview(deck)
+        if manifest:
+            state.previews[out_name] = manifest
+            for artifact_path, output_path in artifact_paths(out_name):
+                copy_artifact(output_path, artifact_path, changed=True)
+        generate_index.update_deck_info(state.decks_info, out_name, result['cards'], manifest)
+
+    if affected:
+        generate_apkg.prune_previews(set(state.apkg_meta))
+        generate_apkg.save_build_cache({name: entry for name, entry in build_cache.items() if name in state.apkg_meta})
+        with open(os.path.join(generate_apkg.OUTPUT_DIR, 'apkg_meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(state.apkg_meta, f, ensure_ascii=False, indent=2)
+        # Built from uncommitted edits: the next --since build starts from scratch
+        save_artifacts_manifest(state.apkg_meta, None)
+        state.search_index_url = generate_index.save_search_index(state.decks_info)
+        generate_index.save_json(state.decks_info)
+    if affected or templates_changed:
+        generate_index.save_html(state.decks_info, state.search_index_url)
+    if set(state.apkg_meta) != published:
+        generate_index.save_sitemap(state.decks_info)
+    return len(affected)
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """Sert docs/ sans journal des requêtes, qui noierait celui des reconstructions."""
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+def serve_docs(port: int) -> http.server.ThreadingHTTPServer:
+    """Sert docs/ en local dans un thread, jusqu'à server.shutdown()."""
+    handler = functools.partial(QuietHandler, directory=generate_apkg.OUTPUT_DIR)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🌐 Site servi sur http://127.0.0.1:{port}/decks.html")
+    return server
+
+def watch(state: BuildState, serve_port: Optional[int] = None) -> None:
+    """Reconstruit les decks modifiés à chaque changement des dossiers surveillés, jusqu'à Ctrl+C."""
+    server = serve_docs(serve_port) if serve_port is not None else None
+    snapshot = snapshot_files()
+    print()
+    print(f"👀 Surveillance de {', '.join(f'{folder}/' for folder in WATCHED_DIRS)} (Ctrl+C pour arrêter)")
+    try:
+        while True:
+            changed, snapshot = wait_for_changes(snapshot)
+            print()
+            print(f"🔄 {len(changed)} fichier(s) modifié(s) : {', '.join(changed[:5])}"
+                  f"{' ...' if len(changed) > 5 else ''}")
+            start = time.perf_counter()
+            try:
+                count = rebuild_changed(state, changed)
+            except Exception as e:
+                print(f"❌ Erreur de reconstruction : {e}")
+                continue
+            print(f"⚡ {count} deck(s) mis à jour en {time.perf_counter() - start:.2f} s")
+    except KeyboardInterrupt:
+        print()
+        print("👋 Surveillance arrêtée")
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build complet du site : paquets, aperçus, index et sitemap.")
+    parser.add_argument("--stages", type=parse_stages, default=list(STAGES),
+                        help=f"Étapes à exécuter, séparées par des virgules ({','.join(STAGES)})")
+    parser.add_argument("--force", action="store_true",
+                        help="Ignore le cache de build et régénère tous les decks")
+    parser.add_argument("--reproducible", action="store_true",
+                        help="Build reproductible (activé si SOURCE_DATE_EPOCH est défini)")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Nombre de processus de génération en parallèle (0 = nombre de cœurs)")
+    parser.add_argument("--optimize-media", action="store_true",
+                        help="Réduit et recompresse les images (.apkg et site), nécessite Pillow")
+    parser.add_argument("--since", metavar="REF",
+                        help="Ne reconstruit que les decks touchés depuis ce commit git, les autres sont "
+                             "repris de .cache/artifacts (comparaison depuis le commit des artefacts "
+                             "s'il diffère, build complet s'il est inconnu)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Après le build, surveille decks/, media/ et scripts/templates/ "
+                             "et ne reconstruit que les decks modifiés")
+    parser.add_argument("--serve", type=int, nargs='?', const=DEFAULT_SERVE_PORT, metavar="PORT",
+                        help=f"Avec --watch, sert docs/ en local (port {DEFAULT_SERVE_PORT} par défaut)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if args.watch and args.stages != STAGES:
+        parser.error("--watch exécute toujours toutes les étapes, sans --stages")
+    if args.serve is not None and not args.watch:
+        parser.error("--serve s'utilise avec --watch")
+
+    state = BuildState(force=args.force,
+                       reproducible=args.reproducible or 'SOURCE_DATE_EPOCH' in os.environ,
+                       jobs=args.jobs if args.jobs > 0 else (os.cpu_count() or 1),
+                       since=args.since,
+                       optimize_media=args.optimize_media and media_optimizer.is_available())
+
+    print("="*60)
+    print(f"🚀 BUILD : {' → '.join(args.stages)}")
+    if args.optimize_media and not state.optimize_media:
+        print("⚠️ Pillow n'est pas installé : images utilisées telles quelles (pip install Pillow)")
+    print("="*60)
+
+    with instrumentation.session("build", args):
+        stats = run_build(args.stages, state)
+
+        print()
+        print("="*60)
+        if 'package' in args.stages:
+            print(f"✅ Paquets : {stats.get('built', 0)} générés, {stats.get('cached', 0)} depuis le cache, "
+                  f"{stats.get('restored', 0)} repris des artefacts")
+        print(f"❌ Erreurs : {stats.get('errors', 0)}")
+
+    if args.watch:
+        watch(state, args.serve)
+
+if __name__ == "__main__":
+    main()
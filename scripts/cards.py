@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Lecture et écriture des CSV de cartes (decks/), partagées par tous les scripts.
+Format : recto;verso[;tags], encodage UTF-8 avec BOM.
+"""
+
+import contextlib
+import csv
+import os
+import re
+from typing import Any, Iterable, Iterator, List, NamedTuple
+import instrumentation
+
+CSV_DELIMITER = ';'
+CSV_ENCODING = 'utf-8-sig'
+
+# src="..." or src='...' (group 1: quote, group 2: value)
+SRC_PATTERN = re.compile(r'src=(["\'])(.*?)\1')
+# src pointing into a folder, e.g. src="../media/si/photo.jpg" (group 2: folder, group 3: file name)
+DIR_SRC_PATTERN = re.compile(r'src=(["\'])(?!https?:|data:)([^"\']*/)([^"\'/]+)\1')
+# Image files referenced by a field in Anki, by bare file name (group 2)
+IMAGE_SRC_PATTERN = re.compile(r'src=(["\'])([^"\']+\.(?:jpg|jpeg|png|gif|svg))\1', re.IGNORECASE)
+EXTERNAL_SRC_PREFIXES = ('http://', 'https://', 'data:')
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+class Card(NamedTuple):
+    """Une carte lue dans un CSV."""
+    front: str
+    back: str
+    tags: List[str]
+    # Raw src values of local images, before clean_media_paths
+    media_refs: List[str]
+    # 1-based line of the record in the CSV
+    row: int
+
+def clean_field(value: str) -> str:
+    """Nettoie un champ : guillemets doublés par un export précédent et guillemets englobants."""
+    return value.replace('""', '"').strip('"')
+
+def extract_media_refs(text: str) -> List[str]:
+    """Extrait les références d'images locales src="..." ou src='...'."""
+    return [m.group(2) for m in SRC_PATTERN.finditer(text)
+            if m.group(2) and not m.group(2).startswith(EXTERNAL_SRC_PREFIXES)]
+
+def clean_media_paths(text: str) -> str:
+    """Nettoie les chemins d'images pour Anki : src="../media/si/photo.jpg" devient src="photo.jpg"."""
+    return DIR_SRC_PATTERN.sub(r'src=\1\3\1', text)
+
+@contextlib.contextmanager
+def open_reader(csv_path: str) -> Iterator[Any]:
+    """Ouvre un CSV de cartes et donne son lecteur csv (line_num : ligne de l'enregistrement lu)."""
+    with open(csv_path, 'r', encoding=CSV_ENCODING, newline='') as f:
+        instrumentation.add_bytes(read=os.fstat(f.fileno()).st_size)
+        yield csv.reader(f, delimiter=CSV_DELIMITER, quoting=csv.QUOTE_MINIMAL)
+
+def iter_rows(csv_path: str) -> Iterator[List[str]]:
+    """Lit les lignes brutes d'un CSV de cartes, une à une."""
+    with open_reader(csv_path) as reader:
+        yield from reader
+
+def iter_cards(csv_path: str) -> Iterator[Card]:
+    """
+    Lit un CSV de cartes en flux : une carte à la fois, quelle que soit la taille du fichier.
+    Les lignes de moins de deux colonnes et les cartes vides sont ignorées.
+    """
+    with open_reader(csv_path) as reader:
+        for row in reader:
+            if len(row) < 2:
+                continue
+            front, back = clean_field(row[0]), clean_field(row[1])
+            if not front and not back:
+                continue
+            tags = row[2].split() if len(row) > 2 else []
+            yield Card(front, back, tags, extract_media_refs(front) + extract_media_refs(back), reader.line_num)
+
+def card_row(fields: Iterable[str], tags: Iterable[str]) -> List[str]:
+    """Construit la ligne CSV d'une carte : ses champs puis ses tags séparés par des espaces."""
+    return list(fields) + [" ".join(tags)]
+
+def write_rows(csv_path: str, rows: Iterable[List[str]]) -> None:
+    """
+    Écrit les lignes d'un CSV de cartes au fur et à mesure qu'elles arrivent.
+    Le fichier n'est remplacé qu'une fois complet : une erreur en cours de route garde l'ancien CSV.
+    """
+    tmp_path = f"{csv_path}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding=CSV_ENCODING, newline='') as f:
+            writer = csv.writer(f, delimiter=CSV_DELIMITER)
+            for row in rows:
+                writer.writerow(row)
+        instrumentation.add_bytes(written=os.path.getsize(tmp_path))
+        os.replace(tmp_path, csv_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
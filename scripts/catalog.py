@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Catalogue SQLite de toutes les cartes de decks/ : deck source, ligne, empreinte, tags et images.
+Mis à jour de façon incrémentale (date et taille des CSV, puis empreinte), il répond sans
+relire les CSV à des questions comme « quels decks utilisent cette image ? ».
+
+Usage :
+    python3 scripts/catalog.py update
+    python3 scripts/catalog.py stats
+    python3 scripts/catalog.py media <image>
+    python3 scripts/catalog.py tag <tag>
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, Iterator, List, Optional, Tuple
+from utils import file_sha256
+from cards import iter_cards
+
+# --- CONFIGURATION ---
+SCRIPT_PATH = os.path.realpath(__file__)
+SCRIPT_DIR = os.path.dirname(SCRIPT_PATH)
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+
+DECKS_DIR = os.path.join(BASE_DIR, "decks")
+CATALOG_PATH = os.path.join(BASE_DIR, ".cache", "catalog.sqlite")
+
+# Bump when the schema or the card parsing changes: the catalog is then rebuilt
+CATALOG_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decks (
+    csv_path TEXT PRIMARY KEY,
+    subject TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    card_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cards (
+    id INTEGER PRIMARY KEY,
+    csv_path TEXT NOT NULL REFERENCES decks(csv_path) ON DELETE CASCADE,
+    row INTEGER NOT NULL,
+    front TEXT NOT NULL,
+    back TEXT NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS card_tags (
+    card_id INTEGER NOT NULL REFERENCES cards(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS card_media (
+    card_id INTEGER NOT NULL REFERENCES cards(id) ON DELETE CASCADE,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cards_deck ON cards(csv_path);
+CREATE INDEX IF NOT EXISTS idx_cards_hash ON cards(content_hash);
+CREATE INDEX IF NOT EXISTS idx_tags_tag ON card_tags(tag);
+CREATE INDEX IF NOT EXISTS idx_media_name ON card_media(name);
+"""
+
+def card_hash(front: str, back: str) -> str:
+    """Empreinte du contenu d'une carte."""
+    return hashlib.sha256(json.dumps([front, back], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def connect(catalog_path: str = CATALOG_PATH) -> sqlite3.Connection:
+    """Ouvre le catalogue (créé au besoin, reconstruit si sa version a changé)."""
+    os.makedirs(os.path.dirname(catalog_path), exist_ok=True)
+    conn = sqlite3.connect(catalog_path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+        conn.executescript("""
+            DROP TABLE IF EXISTS card_media;
+            DROP TABLE IF EXISTS card_tags;
+            DROP TABLE IF EXISTS cards;
+            DROP TABLE IF EXISTS decks;
+        """)
+        conn.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+    conn.executescript(SCHEMA)
+    return conn
+
+def list_csv_files(decks_dir: str = DECKS_DIR) -> List[Tuple[str, str]]:
+    """Liste les CSV de decks/ : (chemin relatif avec des /, chemin absolu), triés."""
+    csv_files = []
+    for root, dirs, files in os.walk(decks_dir):
+        dirs.sort()
+        for name in sorted(f for f in files if f.endswith('.csv')):
+            path = os.path.join(root, name)
+            csv_files.append((os.path.relpath(path, decks_dir).replace(os.sep, '/'), path))
+    return csv_files
+
+def index_deck(conn: sqlite3.Connection, rel_path: str, csv_path: str, st: os.stat_result, sha256: str) -> int:
+    """(Ré)indexe toutes les cartes d'un CSV et retourne leur nombre."""
+    conn.execute("DELETE FROM decks WHERE csv_path = ?", (rel_path,))
+    subject = rel_path.split('/')[0] if '/' in rel_path else 'Divers'
+    conn.execute("INSERT INTO decks VALUES (?, ?, ?, ?, ?, 0)",
+                 (rel_path, subject, st.st_mtime_ns, st.st_size, sha256))
+
+    count = 0
+    for card in iter_cards(csv_path):
+        cursor = conn.execute(
+            "INSERT INTO cards (csv_path, row, front, back, content_hash) VALUES (?, ?, ?, ?, ?)",
+            (rel_path, card.row, card.front, card.back, card_hash(card.front, card.back)))
+        card_id = cursor.lastrowid
+        conn.executemany("INSERT INTO card_tags VALUES (?, ?)", [(card_id, tag) for tag in card.tags])
+        names = dict.fromkeys(os.path.basename(ref) for ref in card.media_refs)
+        conn.executemany("INSERT INTO card_media VALUES (?, ?)", [(card_id, name) for name in names])
+        count += 1
+
+    conn.execute("UPDATE decks SET card_count = ? WHERE csv_path = ?", (count, rel_path))
+    return count
+
+def update_catalog(conn: sqlite3.Connection, decks_dir: str = DECKS_DIR) -> Dict[str, int]:
+    """
+    Met le catalogue à jour : seuls les CSV dont la date ou la taille a changé sont relus,
+    et seulement si leur empreinte a changé. Retourne le nombre de decks par statut.
+    """
+    stats = {'indexed': 0, 'unchanged': 0, 'removed': 0}
+    known = {row[0]: row[1:] for row in conn.execute("SELECT csv_path, mtime_ns, size, sha256 FROM decks")}
+
+    with conn:
+        seen = set()
+        for rel_path, csv_path in list_csv_files(decks_dir):
+            seen.add(rel_path)
+            st = os.stat(csv_path)
+            previous = known.get(rel_path)
+            if previous and previous[0] == st.st_mtime_ns and previous[1] == st.st_size:
+                stats['unchanged'] += 1
+                continue
+
+            sha256 = file_sha256(csv_path)
+            if previous and previous[2] == sha256:
+                # Touched but identical (e.g. git checkout): only remember the new stat
+                conn.execute("UPDATE decks SET mtime_ns = ?, size = ? WHERE csv_path = ?",
+                             (st.st_mtime_ns, st.st_size, rel_path))
+                stats['unchanged'] += 1
+                continue
+
+            index_deck(conn, rel_path, csv_path, st, sha256)
+            stats['indexed'] += 1
+
+        for rel_path in set(known) - seen:
+            conn.execute("DELETE FROM decks WHERE csv_path = ?", (rel_path,))
+            stats['removed'] += 1
+
+    return stats
+
+def open_catalog(catalog_path: str = CATALOG_PATH, decks_dir: str = DECKS_DIR) -> sqlite3.Connection:
+    """Ouvre le catalogue à jour, prêt pour les requêtes."""
+    conn = connect(catalog_path)
+    update_catalog(conn, decks_dir)
+    return conn
+
+# --- QUERIES ---
+
+def deck_card_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Nombre de cartes par CSV."""
+    return dict(conn.execute("SELECT csv_path, card_count FROM decks ORDER BY csv_path"))
+
+def deck_subjects(conn: sqlite3.Connection) -> Dict[str, str]:
+    """Matière (dossier de decks/) de chaque CSV."""
+    return dict(conn.execute("SELECT csv_path, subject FROM decks ORDER BY csv_path"))
+
+def decks_using_media(conn: sqlite3.Connection, name: str) -> List[str]:
+    """CSV qui référencent une image (par nom de fichier)."""
+    rows = conn.execute("""
+        SELECT DISTINCT c.csv_path FROM card_media m JOIN cards c ON c.id = m.card_id
+        WHERE m.name = ? ORDER BY c.csv_path
+    """, (os.path.basename(name),))
+    return [row[0] for row in rows]
+
+def deck_media(conn: sqlite3.Connection, csv_path: str) -> List[str]:
+    """Noms des images référencées par un CSV, sans doublons, dans l'ordre des cartes."""
+    rows = conn.execute("""
+        SELECT m.name FROM card_media m JOIN cards c ON c.id = m.card_id
+        WHERE c.csv_path = ? ORDER BY c.row, m.rowid
+    """, (csv_path,))
+    return list(dict.fromkeys(row[0] for row in rows))
+
+def count_cards_with_tag(conn: sqlite3.Connection, tag: str) -> int:
+    """Nombre de cartes portant un tag."""
+    return conn.execute("SELECT COUNT(DISTINCT card_id) FROM card_tags WHERE tag = ?", (tag,)).fetchone()[0]
+
+def iter_catalog_cards(conn: sqlite3.Connection,
+                       csv_path: Optional[str] = None) -> Iterator[Tuple[str, int, str, str]]:
+    """Cartes du catalogue (csv_path, row, front, back), éventuellement d'un seul CSV."""
+    if csv_path is None:
+        return conn.execute("SELECT csv_path, row, front, back FROM cards ORDER BY csv_path, row")
+    return conn.execute("SELECT csv_path, row, front, back FROM cards WHERE csv_path = ? ORDER BY row",
+                        (csv_path,))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Catalogue SQLite des cartes de decks/.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("update", help="Met le catalogue à jour")
+    subparsers.add_parser("stats", help="Nombre de cartes par deck")
+    media_parser = subparsers.add_parser("media", help="Decks qui utilisent une image")
+    media_parser.add_argument("name")
+    tag_parser = subparsers.add_parser("tag", help="Nombre de cartes portant un tag")
+    tag_parser.add_argument("tag")
+    args = parser.parse_args()
+
+    conn = connect()
+    stats = update_catalog(conn)
+
+    if args.command == "update":
+        print(f"✅ Catalogue : {stats['indexed']} deck(s) indexé(s), {stats['unchanged']} inchangé(s), "
+              f"{stats['removed']} supprimé(s)")
+    elif args.command == "stats":
+        counts = deck_card_counts(conn)
+        for csv_path, count in counts.items():
+            print(f"{count:6d}  {csv_path}")
+        print(f"{sum(counts.values()):6d}  cartes dans {len(counts)} deck(s)")
+    elif args.command == "media":
+        decks = decks_using_media(conn, args.name)
+        if not decks:
+            print(f"⚠️ Aucun deck n'utilise {args.name}")
+        for csv_path in decks:
+            print(csv_path)
+    elif args.command == "tag":
+        print(count_cards_with_tag(conn, args.tag))
+
+    conn.close()
+
+if __name__ == "__main__":
+    main()
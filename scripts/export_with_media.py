@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import contextlib
 import csv
+import io
+import json
+import math
 import os
 import shutil
 import html
 import re
+import sys
+import threading
+import time
 import argparse
-from typing import List, Optional, Dict, Any
-from utils import slugify, anki_connect_request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, List, Optional, Dict, Any, Tuple
+from utils import slugify, AnkiConnectClient, AnkiConnectError, build_media_index, file_sha256
+from cards import IMAGE_SRC_PATTERN, card_row, iter_rows, write_rows
+import instrumentation
 
 # --- CONFIGURATION ---
 SCRIPT_PATH = os.path.realpath(__file__)
@@ -18,58 +29,148 @@ BASE_DIR = os.path.dirname(SCRIPT_DIR)
 OUTPUT_DIR = os.path.join(BASE_DIR, "decks")
 MEDIA_REPO_DIR = os.path.join(BASE_DIR, "media")
 
+# Per-deck state of the last export (local to each contributor, ignored by git)
+EXPORT_STATE_DIR = os.path.join(BASE_DIR, ".cache", "export")
+
+# Notes fetched per notesInfo request: bounds memory and AnkiConnect response size
+NOTES_INFO_CHUNK_SIZE = 500
+
 # Paths specific to the user's Anki installation
 DEFAULT_ANKI_USER_PROFILE = "Utilisateur 1"
 
 def get_anki_media_path(profile: str) -> str:
     return os.path.expanduser(f"~/Library/Application Support/Anki2/{profile}/collection.media")
 
-def copy_media_files(source_text: str, media_subfolder: str, anki_media_path: str) -> str:
+class MediaCopier:
     """
-    Cherche les références aux médias dans le texte.
-    Les copie du dossier Anki vers le repo.
-    Retourne le texte modifié avec les nouveaux chemins relatifs.
+    Copie les médias référencés du dossier Anki vers media/<sous-dossier>.
+    Un fichier déjà identique dans le repo n'est pas recopié (taille et date d'abord,
+    empreinte seulement si besoin) et une même image déjà présente dans un autre
+    sous-dossier est signalée, ou liée en dur avec link.
+    Partagé par les threads d'export : les images d'un même nom sont traitées une à la fois.
     """
-    target_dir = os.path.join(MEDIA_REPO_DIR, media_subfolder)
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-    
-    modified_text = source_text
-    
-    # Regex pour trouver les images (src="nomfichier.ext")
-    image_pattern = r'src=["\']([^"\']+\.(jpg|jpeg|png|gif|svg))["\']'
-    matches = re.findall(image_pattern, source_text, re.IGNORECASE)
-    
-    for match in matches:
-        filename = match[0]
-        anki_file_path = os.path.join(anki_media_path, filename)
+
+    def __init__(self, anki_media_path: str, media_index: Optional[Dict[str, List[str]]] = None,
+                 link: bool = False) -> None:
+        self.anki_media_path = anki_media_path
+        self.media_index = media_index if media_index is not None else build_media_index(MEDIA_REPO_DIR)
+        self.link = link
+        self.stats: Counter = Counter()
+        self._synced: Dict[Tuple[str, str], bool] = {}
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        # Guards the dictionaries and stats above
+        self._lock = threading.Lock()
+        # One lock per file name: a copy, its duplicate lookup and its link touch only files of that name
+        self._file_locks: Dict[str, threading.Lock] = {}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def _sha256(self, path: str) -> str:
+        """Empreinte d'un fichier, mémorisée tant que sa taille et sa date ne changent pas."""
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._hashes.get(key)
+        if digest is None:
+            digest = file_sha256(path)
+            with self._lock:
+                self._hashes[key] = digest
+        return digest
+
+    def _is_identical(self, source: str, target: str) -> bool:
+        """Compare deux fichiers : taille, puis date (copy2 la conserve), puis empreinte."""
+        if not os.path.exists(target):
+            return False
+        source_st, target_st = os.stat(source), os.stat(target)
+        if source_st.st_size != target_st.st_size:
+            return False
+        if source_st.st_mtime_ns == target_st.st_mtime_ns:
+            return True
+        return self._sha256(source) == self._sha256(target)
+
+    def _find_duplicate(self, source: str, target: str) -> Optional[str]:
+        """Cherche la même image (même nom, même contenu) dans un autre sous-dossier de media/."""
+        for path in self.media_index.get(os.path.basename(target), []):
+            if path != target and self._is_identical(source, path):
+                return path
+        return None
+
+    def sync_file(self, filename: str, media_subfolder: str) -> bool:
+        """Place une image dans media/<sous-dossier>, retourne False si elle est introuvable dans Anki."""
+        key = (filename, media_subfolder)
+        with self._lock:
+            if key in self._synced:
+                return self._synced[key]
+            file_lock = self._file_locks.setdefault(filename, threading.Lock())
         
-        if os.path.exists(anki_file_path):
-            # Copier le fichier
-            repo_file_path = os.path.join(target_dir, filename)
-            try:
-                shutil.copy2(anki_file_path, repo_file_path)
-                print(f"  📸 Copié : {filename}")
-                
-                # Update path in text to be relative for the repo
-                # ../media/subfolder/image.jpg
-                new_relative_path = f"../media/{media_subfolder}/{filename}"
-                
-                # Replace with both quote types to be safe
-                modified_text = modified_text.replace(f'src="{filename}"', f'src="{new_relative_path}"')
-                modified_text = modified_text.replace(f"src='{filename}'", f"src='{new_relative_path}'")
-                
-            except Exception as e:
-                print(f"  ⚠️  Erreur copie {filename}: {e}")
-        else:
+        with file_lock:
+            # Another thread may have placed it while this one waited
+            with self._lock:
+                if key in self._synced:
+                    return self._synced[key]
+            synced = self._place_file(filename, media_subfolder)
+            with self._lock:
+                self._synced[key] = synced
+        return synced
+
+    def _place_file(self, filename: str, media_subfolder: str) -> bool:
+        """Copie (ou lie) une image dans media/<sous-dossier> ; appelé sous le verrou de son nom."""
+        anki_file_path = os.path.join(self.anki_media_path, filename)
+        if not os.path.exists(anki_file_path):
             print(f"  ⚠️  Média introuvable : {filename}")
+            return False
+            
+        target_dir = os.path.join(MEDIA_REPO_DIR, media_subfolder)
+        os.makedirs(target_dir, exist_ok=True)
+        repo_file_path = os.path.join(target_dir, filename)
+        
+        try:
+            if self._is_identical(anki_file_path, repo_file_path):
+                self._count('unchanged')
+            else:
+                duplicate = self._find_duplicate(anki_file_path, repo_file_path)
+                if duplicate and self.link:
+                    if os.path.exists(repo_file_path):
+                        os.remove(repo_file_path)
+                    os.link(duplicate, repo_file_path)
+                    self._count('linked')
+                    print(f"  🔗 Lié : {filename} (-> {os.path.relpath(duplicate, MEDIA_REPO_DIR)})")
+                else:
+                    shutil.copy2(anki_file_path, repo_file_path)
+                    self._count('copied')
+                    instrumentation.add_bytes(written=os.path.getsize(repo_file_path))
+                    print(f"  📸 Copié : {filename}")
+                    if duplicate:
+                        print(f"  ♊ Déjà présent dans media/{os.path.relpath(duplicate, MEDIA_REPO_DIR)} (--link pour lier)")
+                with self._lock:
+                    paths = self.media_index.setdefault(filename, [])
+                    if repo_file_path not in paths:
+                        paths.append(repo_file_path)
+        except Exception as e:
+            print(f"  ⚠️  Erreur copie {filename}: {e}")
+            return False
             
-    return modified_text
+        return True
 
-def export_deck(deck_name: str, anki_media_path: str) -> None:
-    """Exporte un deck spécifique en CSV + média."""
-    print(f"📦 Export de '{deck_name}'...")
-    
+    def copy_media_files(self, source_text: str, media_subfolder: str) -> str:
+        """
+        Cherche les références aux médias dans le texte.
+        Les copie du dossier Anki vers le repo.
+        Retourne le texte modifié avec les nouveaux chemins relatifs, en une seule passe.
+        """
+        def replace(match: "re.Match[str]") -> str:
+            quote, filename = match.group(1), match.group(2)
+            if not self.sync_file(filename, media_subfolder):
+                return match.group(0)
+            # ../media/subfolder/image.jpg
+            return f"src={quote}../media/{media_subfolder}/{filename}{quote}"
+        
+        return IMAGE_SRC_PATTERN.sub(replace, source_text)
+
+def get_export_paths(deck_name: str) -> Tuple[str, str, str]:
+    """Retourne le sous-dossier média, le chemin du CSV et celui du fichier d'état d'un deck."""
     # 1. Determine media subfolder
     # Ex: "PTSI::Maths" -> "maths"
     # Ex: "Vocabulaire" -> "vocabulaire"
@@ -84,58 +185,247 @@ def export_deck(deck_name: str, anki_media_path: str) -> None:
         subject = slugify(parts[0])
         safe_filename = "_".join([slugify(p) for p in parts[1:]])
         
-    subject_dir = os.path.join(OUTPUT_DIR, subject)
-    if not os.path.exists(subject_dir):
-        os.makedirs(subject_dir)
+    csv_filename = os.path.join(OUTPUT_DIR, subject, f"{safe_filename}.csv")
+    state_filename = os.path.join(EXPORT_STATE_DIR, subject, f"{safe_filename}.json")
+    return media_subfolder, csv_filename, state_filename
+
+def note_to_row(note: Dict[str, Any], media_subfolder: str, media_copier: MediaCopier) -> List[str]:
+    """Convertit une note AnkiConnect en ligne CSV (champs puis tags), en copiant ses médias."""
+    fields_values = []
+    
+    # Process fields
+    for f_obj in note["fields"].values():
+        raw_value = f_obj["value"]
+        clean_value = html.unescape(raw_value)
         
-    csv_filename = os.path.join(subject_dir, f"{safe_filename}.csv")
+        # Copy media and update paths
+        minified_value = media_copier.copy_media_files(clean_value, media_subfolder)
+        fields_values.append(minified_value)
+    
+    return card_row(fields_values, note["tags"])
+
+def load_export_state(state_filename: str, csv_filename: str) -> Optional[Dict[str, Any]]:
+    """
+    Charge l'état du dernier export d'un deck.
+    Retourne None si l'état est absent ou ne correspond plus au CSV (modifié à la main).
+    """
+    if not os.path.exists(state_filename) or not os.path.exists(csv_filename):
+        return None
+    try:
+        with open(state_filename, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        rows = list(iter_rows(csv_filename))
+    except (OSError, ValueError, csv.Error):
+        return None
+    if len(rows) != len(state.get("notes", [])):
+        return None
+    state["rows"] = rows
+    return state
+
+def save_export_state(state_filename: str, deck_name: str, export_time: float,
+                      notes: List[Tuple[int, int]]) -> None:
+    """Enregistre la date d'export et les (id, mod) des notes, dans l'ordre des lignes du CSV."""
+    os.makedirs(os.path.dirname(state_filename), exist_ok=True)
+    with open(state_filename, "w", encoding="utf-8") as f:
+        json.dump({"deck": deck_name, "last_export": export_time, "notes": notes}, f)
+
+def iter_notes_info(client: AnkiConnectClient, note_ids: List[int],
+                    chunk_size: int = NOTES_INFO_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Récupère les notes par paquets de chunk_size et les renvoie une à une,
+    sans jamais garder plus d'un paquet en mémoire. Lève AnkiConnectError si un paquet échoue.
+    """
+    total = len(note_ids)
+    for start in range(0, total, chunk_size):
+        chunk = note_ids[start:start + chunk_size]
+        yield from client.invoke("notesInfo", notes=chunk)
+        if total > chunk_size:
+            print(f"  ⏳ {min(start + chunk_size, total)}/{total} notes")
+
+def export_deck_incremental(client: AnkiConnectClient, deck_name: str, media_copier: MediaCopier,
+                            note_ids: List[int], state: Dict[str, Any], export_time: float,
+                            chunk_size: int = NOTES_INFO_CHUNK_SIZE) -> Optional[int]:
+    """
+    Ne récupère que les notes ajoutées ou modifiées depuis le dernier export et les fusionne
+    dans le CSV existant : les lignes inchangées gardent leur place, les nouvelles sont ajoutées à la fin.
+    """
+    media_subfolder, csv_filename, state_filename = get_export_paths(deck_name)
+    
+    previous_mods = {note_id: mod for note_id, mod in state["notes"]}
+    rows_by_id = {note_id: row for (note_id, _), row in zip(state["notes"], state["rows"])}
+    
+    # edited:N works in days, mod times then give the exact set of changed notes
+    days = max(1, math.ceil((export_time - state["last_export"]) / 86400) + 1)
+    edited = client.request("findNotes", query=f'"deck:{deck_name}" edited:{days}')
+    if edited is None:
+        return None
+    current_ids = set(note_ids)
+    candidates = sorted((set(edited["result"]) & current_ids) | (current_ids - set(previous_mods)))
+    
+    mods = dict(previous_mods)
+    changed_count = 0
+    try:
+        for note in iter_notes_info(client, candidates, chunk_size):
+            if previous_mods.get(note["noteId"]) == note.get("mod"):
+                continue
+            rows_by_id[note["noteId"]] = note_to_row(note, media_subfolder, media_copier)
+            mods[note["noteId"]] = note.get("mod", 0)
+            changed_count += 1
+    except (AnkiConnectError, ValueError) as e:
+        print(f"❌ ERREUR AnkiConnect : {e}\n")
+        return None
+        
+    new_ids = sorted(current_ids - set(previous_mods))
+    order = [note_id for note_id, _ in state["notes"] if note_id in current_ids]
+    order.extend(new_ids)
+    deleted = len(previous_mods) - (len(order) - len(new_ids))
+    modified = changed_count - len(new_ids)
+    
+    try:
+        if changed_count or deleted:
+            write_rows(csv_filename, (rows_by_id[note_id] for note_id in order))
+        save_export_state(state_filename, deck_name, export_time, [(i, mods[i]) for i in order])
+        print(f"✅ OK ({len(order)} cartes : +{len(new_ids)} ajoutée(s), ~{modified} modifiée(s), -{deleted} supprimée(s))\n")
+        return len(order)
+    except Exception as e:
+        print(f"❌ ERREUR écriture CSV : {e}\n")
+        return None
+
+def export_deck(client: AnkiConnectClient, deck_name: str, media_copier: MediaCopier,
+                incremental: bool = False, chunk_size: int = NOTES_INFO_CHUNK_SIZE) -> Optional[int]:
+    """
+    Exporte un deck spécifique en CSV + média (seulement les notes modifiées avec incremental).
+    Retourne le nombre de cartes du CSV, ou None en cas d'erreur.
+    """
+    print(f"📦 Export de '{deck_name}'...")
+    export_time = time.time()
+    
+    media_subfolder, csv_filename, state_filename = get_export_paths(deck_name)
+    os.makedirs(os.path.dirname(csv_filename), exist_ok=True)
     
     # 3. Fetch notes from Anki
-    find_notes = anki_connect_request("findNotes", query=f'"deck:{deck_name}"')
+    with instrumentation.stage('find_notes'):
+        find_notes = client.request("findNotes", query=f'"deck:{deck_name}"')
     if not find_notes:
-        return
+        return None
         
-    notes_info = anki_connect_request("notesInfo", notes=find_notes["result"])
-    if not notes_info:
-        return
+    if incremental:
+        state = load_export_state(state_filename, csv_filename)
+        if state is not None:
+            with instrumentation.stage('notes'):
+                return export_deck_incremental(client, deck_name, media_copier, find_notes["result"], state,
+                                               export_time, chunk_size)
+        print("  ℹ️  Pas d'état d'export valide, export complet.")
+        
+    # 4. Stream notes to CSV, one notesInfo chunk at a time
+    exported_notes: List[Tuple[int, int]] = []
+
+    def rows() -> Iterator[List[str]]:
+        for note in iter_notes_info(client, find_notes["result"], chunk_size):
+            exported_notes.append((note["noteId"], note.get("mod", 0)))
+            yield note_to_row(note, media_subfolder, media_copier)
 
-    # 4. Write to CSV
     try:
-        with open(csv_filename, "w", encoding="utf-8-sig", newline="") as f:
-            writer = csv.writer(f, delimiter=";")
-            count = 0
-            
-            for note in notes_info["result"]:
-                fields_values = []
-                
-                # Process fields
-                for f_obj in note["fields"].values():
-                    raw_value = f_obj["value"]
-                    clean_value = html.unescape(raw_value)
-                    
-                    # Copy media and update paths
-                    minified_value = copy_media_files(clean_value, media_subfolder, anki_media_path)
-                    fields_values.append(minified_value)
-                
-                # Process tags
-                tags = " ".join(note["tags"])
-                fields_values.append(tags)
-                
-                writer.writerow(fields_values)
-                count += 1
-                
-        print(f"✅ OK ({count} cartes)\n")
+        with instrumentation.stage('notes'):
+            write_rows(csv_filename, rows())
+        save_export_state(state_filename, deck_name, export_time, exported_notes)
+        print(f"✅ OK ({len(exported_notes)} cartes)\n")
+        return len(exported_notes)
         
+    except (AnkiConnectError, ValueError) as e:
+        print(f"❌ ERREUR AnkiConnect : {e}\n")
     except Exception as e:
         print(f"❌ ERREUR écriture CSV : {e}\n")
+    return None
 
-def main() -> None:
-    parser = argparse.ArgumentParser(description="Export Anki decks to CSV and extract media.")
-    parser.add_argument("--profile", type=str, default=DEFAULT_ANKI_USER_PROFILE,
-                        help="Anki user profile name (default: Utilisateur 1)")
-    args = parser.parse_args()
+class ThreadOutput(io.TextIOBase):
+    """
+    Remplace sys.stdout pendant un export parallèle : chaque thread écrit dans son propre tampon,
+    affiché d'un bloc à la fin de son deck pour ne pas mélanger les journaux.
+    """
+
+    def __init__(self, stream: Any) -> None:
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self.local, "buffer", None)
+        (buffer if buffer is not None else self.stream).write(text)
+        return len(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+    @contextlib.contextmanager
+    def capture(self) -> Iterator[io.StringIO]:
+        self.local.buffer = io.StringIO()
+        try:
+            yield self.local.buffer
+        finally:
+            self.local.buffer = None
+
+def export_decks(deck_names: List[str], media_copier: MediaCopier, make_client: Callable[[], AnkiConnectClient],
+                 jobs: int = 1, incremental: bool = False,
+                 chunk_size: int = NOTES_INFO_CHUNK_SIZE) -> Dict[str, Optional[int]]:
+    """
+    Exporte plusieurs decks, jusqu'à jobs à la fois : les requêtes AnkiConnect d'un deck
+    se superposent à l'écriture du CSV et à la copie des médias d'un autre.
+    Chaque thread a son propre client (une connexion HTTP ne se partage pas entre threads) ;
+    media_copier est partagé, y compris pour les images communes à plusieurs decks.
+    """
+    results: Dict[str, Optional[int]] = {}
+    
+    if jobs <= 1:
+        with make_client() as client:
+            for deck in deck_names:
+                with instrumentation.deck(deck):
+                    results[deck] = export_deck(client, deck, media_copier, incremental, chunk_size)
+        return results
+    
+    local = threading.local()
+    clients: List[AnkiConnectClient] = []
+    output = ThreadOutput(sys.stdout)
     
+    def run(deck: str) -> Tuple[Optional[int], str]:
+        if not hasattr(local, "client"):
+            local.client = make_client()
+            clients.append(local.client)
+        with output.capture() as buffer, instrumentation.deck(deck):
+            count = export_deck(local.client, deck, media_copier, incremental, chunk_size)
+        return count, buffer.getvalue()
+    
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(run, deck): deck for deck in deck_names}
+            for future in as_completed(futures):
+                count, log = future.result()
+                results[futures[future]] = count
+                output.stream.write(log)
+    finally:
+        sys.stdout = output.stream
+        for client in clients:
+            client.close()
+    
+    return results
+
+def print_summary(results: Dict[str, Optional[int]], deck_names: List[str]) -> None:
+    """Affiche le récapitulatif de l'export, deck par deck."""
+    print("="*60)
+    print("✨ RÉSUMÉ")
+    print("="*60)
+    for deck in deck_names:
+        count = results.get(deck)
+        if count is None:
+            print(f"❌ {deck}")
+        else:
+            print(f"✅ {deck} : {count} cartes")
+    print()
+
+def run_export(args: argparse.Namespace) -> None:
+    """Exporte les decks choisis interactivement, avec leurs médias."""
     anki_media_path = get_anki_media_path(args.profile)
+    client = AnkiConnectClient(timeout=args.timeout)
 
     print("="*60)
     print("📤 EXPORT DECKS + MÉDIAS")
@@ -143,7 +433,7 @@ def main() -> None:
     print("="*60)
     
     # Get deck list
-    response = anki_connect_request("deckNames")
+    response = client.request("deckNames")
     if not response:
         return
         
@@ -171,11 +461,39 @@ def main() -> None:
         
     print(f"\nDébut de l'export pour {len(target_decks)} deck(s)...\n")
     
-    for deck in target_decks:
-        export_deck(deck, anki_media_path)
+    client.close()
+    
+    with instrumentation.stage('export'):
+        media_copier = MediaCopier(anki_media_path, link=args.link)
+        results = export_decks(target_decks, media_copier, lambda: AnkiConnectClient(timeout=args.timeout),
+                               args.jobs, args.incremental, args.chunk_size)
+    print_summary(results, target_decks)
+    stats = media_copier.stats
+    for name, value in stats.items():
+        instrumentation.count(f"media_{name}", value)
+    print(f"🖼️  Médias : {stats['copied']} copié(s), {stats['linked']} lié(s), {stats['unchanged']} inchangé(s)")
         
     print("="*60)
     print("Terminé ! N'oublie pas : git add . && git commit && git push")
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export Anki decks to CSV and extract media.")
+    parser.add_argument("--profile", type=str, default=DEFAULT_ANKI_USER_PROFILE,
+                        help="Anki user profile name (default: Utilisateur 1)")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="AnkiConnect request timeout in seconds (default: 30)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only fetch notes edited since the last export and merge them into the CSV")
+    parser.add_argument("--chunk-size", type=int, default=NOTES_INFO_CHUNK_SIZE,
+                        help=f"Notes fetched per notesInfo request (default: {NOTES_INFO_CHUNK_SIZE})")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of decks exported concurrently (default: 1)")
+    parser.add_argument("--link", action="store_true",
+                        help="Hardlink images already stored identically in another media/ subfolder instead of copying")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session("export_with_media", args):
+        run_export(args)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Faux serveur AnkiConnect : une collection en mémoire qui répond aux actions utilisées par
+imports_decks.py et export_with_media.py, sans Anki. Une latence par requête et des pannes
+(connexion coupée ou erreur AnkiConnect) peuvent être injectées pour mesurer ou tester
+le comportement des scripts.
+
+Usage :
+    python3 scripts/fake_anki_connect.py --latency 0.02 --failure-rate 0.05
+    python3 scripts/imports_decks.py   # dans un autre terminal, sur http://localhost:8765
+"""
+
+import argparse
+import base64
+import fnmatch
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from utils import ANKI_CONNECT_VERSION
+
+# Models of the fake collection and their fields, in order
+MODELS = {"Basic": ["Front", "Back"]}
+DEFAULT_DECK = "Default"
+
+FAILURE_MODES = ('drop', 'error')
+
+# "deck:Name" (quoted or not) and edited:N in a findNotes query
+DECK_QUERY_PATTERN = re.compile(r'"deck:([^"]*)"|deck:(\S+)')
+EDITED_QUERY_PATTERN = re.compile(r'\bedited:(\d+)')
+
+class FakeAnkiError(Exception):
+    """Erreur renvoyée dans le champ "error" de la réponse, comme AnkiConnect."""
+
+class FakeCollection:
+    """Collection Anki minimale : decks, notes (champs, tags, date de modification) et médias."""
+
+    def __init__(self, media_dir: Optional[str] = None) -> None:
+        self.decks: Dict[str, int] = {DEFAULT_DECK: 1}
+        self.notes: Dict[int, Dict[str, Any]] = {}
+        # Media are written to media_dir when given (export_with_media.py reads them there)
+        self.media_dir = media_dir
+        self.media: Dict[str, bytes] = {}
+        # (deck, first field) of every note, for the duplicate check of addNotes
+        self._first_fields: Counter = Counter()
+        self._next_id = 1_700_000_000_000
+        self._lock = threading.Lock()
+
+    def new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def create_deck(self, deck: str) -> int:
+        if deck not in self.decks:
+            self.decks[deck] = self.new_id()
+        return self.decks[deck]
+
+    def add_note(self, note: Dict[str, Any]) -> Optional[int]:
+        """Ajoute une note ; None si c'est un doublon (même premier champ dans le deck)."""
+        model = note.get("modelName")
+        if model not in MODELS:
+            raise FakeAnkiError(f"model was not found: {model}")
+        deck = note.get("deckName")
+        if deck not in self.decks:
+            raise FakeAnkiError(f"deck was not found: {deck}")
+        values = [note["fields"].get(name, "") for name in MODELS[model]]
+        options = note.get("options", {})
+        if not options.get("allowDuplicate", False):
+            if self._first_fields[(deck, values[0])]:
+                return None
+        note_id = self.new_id()
+        self._first_fields[(deck, values[0])] += 1
+        self.notes[note_id] = {"deckName": deck, "modelName": model, "values": values,
+                               "tags": list(note.get("tags", [])), "mod": int(time.time())}
+        return note_id
+
+    def find_notes(self, query: str) -> List[int]:
+        """Notes d'un deck (et de ses sous-decks), éventuellement modifiées depuis N jours."""
+        deck_match = DECK_QUERY_PATTERN.search(query)
+        deck = (deck_match.group(1) or deck_match.group(2)).casefold() if deck_match else None
+        edited = EDITED_QUERY_PATTERN.search(query)
+        since = time.time() - int(edited.group(1)) * 86400 if edited else None
+        found = []
+        for note_id, note in self.notes.items():
+            name = note["deckName"].casefold()
+            if deck is not None and name != deck and not name.startswith(f"{deck}::"):
+                continue
+            if since is not None and note["mod"] < since:
+                continue
+            found.append(note_id)
+        return found
+
+    def note_info(self, note_id: int) -> Dict[str, Any]:
+        note = self.notes.get(note_id)
+        if note is None:
+            return {}
+        fields = MODELS[note["modelName"]]
+        return {
+            "noteId": note_id,
+            "modelName": note["modelName"],
+            "tags": list(note["tags"]),
+            "fields": {name: {"value": value, "order": i} for i, (name, value) in enumerate(zip(fields, note["values"]))},
+            "mod": note["mod"],
+            "cards": [],
+        }
+
+    def update_note_fields(self, note: Dict[str, Any]) -> None:
+        current = self.notes.get(note.get("id"))
+        if current is None:
+            raise FakeAnkiError(f"note was not found: {note.get('id')}")
+        fields = MODELS[current["modelName"]]
+        self._first_fields[(current["deckName"], current["values"][0])] -= 1
+        for name, value in note.get("fields", {}).items():
+            if name in fields:
+                current["values"][fields.index(name)] = value
+        self._first_fields[(current["deckName"], current["values"][0])] += 1
+        current["mod"] = int(time.time())
+
+    def update_note_tags(self, note_id: int, tags: List[str]) -> None:
+        current = self.notes.get(note_id)
+        if current is None:
+            raise FakeAnkiError(f"note was not found: {note_id}")
+        current["tags"] = list(tags)
+        current["mod"] = int(time.time())
+
+    def delete_note(self, note_id: int) -> None:
+        note = self.notes.pop(note_id, None)
+        if note is not None:
+            self._first_fields[(note["deckName"], note["values"][0])] -= 1
+
+    def store_media(self, filename: str, data: Optional[str] = None, path: Optional[str] = None) -> str:
+        """Enregistre un média envoyé en base64 (data) ou par chemin local (path)."""
+        if data is not None:
+            content = base64.b64decode(data)
+        elif path is not None:
+            try:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            except OSError as e:
+                raise FakeAnkiError(str(e))
+        else:
+            raise FakeAnkiError("storeMediaFile needs data or path")
+        name = os.path.basename(filename)
+        if self.media_dir is None:
+            self.media[name] = content
+        else:
+            os.makedirs(self.media_dir, exist_ok=True)
+            with open(os.path.join(self.media_dir, name), 'wb') as f:
+                f.write(content)
+        return name
+
+    def media_names(self, pattern: str = "*") -> List[str]:
+        names = os.listdir(self.media_dir) if self.media_dir and os.path.isdir(self.media_dir) else list(self.media)
+        return sorted(name for name in names if fnmatch.fnmatch(name, pattern))
+
+    def run(self, action: str, params: Dict[str, Any]) -> Any:
+        """Exécute une action AnkiConnect (hors multi) et retourne son résultat."""
+        with self._lock:
+            if action == "version":
+                return ANKI_CONNECT_VERSION
+            if action == "deckNames":
+                return sorted(self.decks)
+            if action == "createDeck":
+                return self.create_deck(params["deck"])
+            if action == "modelNames":
+                return list(MODELS)
+            if action == "modelFieldNames":
+                if params.get("modelName") not in MODELS:
+                    raise FakeAnkiError(f"model was not found: {params.get('modelName')}")
+                return list(MODELS[params["modelName"]])
+            if action == "addNotes":
+                results = [self.add_note(note) for note in params["notes"]]
+                if results and all(result is None for result in results):
+                    raise FakeAnkiError("cannot create note because it is a duplicate")
+                return results
+            if action == "findNotes":
+                return self.find_notes(params.get("query", ""))
+            if action == "notesInfo":
+                return [self.note_info(note_id) for note_id in params["notes"]]
+            if action == "updateNoteFields":
+                return self.update_note_fields(params["note"])
+            if action == "updateNoteTags":
+                return self.update_note_tags(params["note"], params["tags"])
+            if action == "deleteNotes":
+                for note_id in params["notes"]:
+                    self.delete_note(note_id)
+                return None
+            if action == "storeMediaFile":
+                return self.store_media(params["filename"], params.get("data"), params.get("path"))
+            if action == "getMediaFilesNames":
+                return self.media_names(params.get("pattern", "*"))
+        raise FakeAnkiError(f"unsupported action: {action}")
+
+class FakeAnkiConnect:
+    """
+    Serveur HTTP AnkiConnect autour d'une FakeCollection, lancé dans un thread.
+    latency (+ jusqu'à jitter) est attendue à chaque requête HTTP ; une part failure_rate
+    des requêtes échoue : connexion coupée sans réponse ('drop') ou erreur AnkiConnect ('error').
+    Avec idle_timeout, les connexions persistantes inactives depuis ce délai sont fermées par le serveur.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 failure_rate: float = 0.0, failure_mode: str = 'drop', seed: int = 0,
+                 media_dir: Optional[str] = None, idle_timeout: Optional[float] = None) -> None:
+        if failure_mode not in FAILURE_MODES:
+            raise ValueError(f"failure_mode inconnu : {failure_mode}")
+        self.collection = FakeCollection(media_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.idle_timeout = idle_timeout
+        self.stats: Counter = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeAnkiConnect":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "FakeAnkiConnect":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats.clear()
+
+    def _next_request(self) -> bool:
+        """Compte une requête et tire au sort si elle doit échouer."""
+        with self._lock:
+            self.stats['requests'] += 1
+            failed = self.failure_rate > 0 and self._random.random() < self.failure_rate
+            if failed:
+                self.stats['failures'] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        return failed
+
+    def _count_action(self, action: str) -> None:
+        with self._lock:
+            self.stats['actions'] += 1
+            self.stats[f"action:{action}"] += 1
+
+    def handle(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Réponse à une requête AnkiConnect ({"result", "error"}), multi compris."""
+        action = payload.get("action")
+        params = payload.get("params") or {}
+        try:
+            if action == "multi":
+                self._count_action(action)
+                return {"result": [self.handle(sub) for sub in params.get("actions", [])], "error": None}
+            self._count_action(action)
+            return {"result": self.collection.run(action, params), "error": None}
+        except FakeAnkiError as e:
+            return {"result": None, "error": str(e)}
+        except (KeyError, TypeError) as e:
+            return {"result": None, "error": f"invalid parameters for {action}: {e}"}
+
+    def _make_handler(self) -> type:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, as AnkiConnectClient reuses its connection
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately: without this, Nagle + delayed ACK add ~40 ms
+            disable_nagle_algorithm = True
+            # Idle keep-alive connections are closed after this delay (None: kept open)
+            timeout = fake.idle_timeout
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if fake._next_request():
+                    if fake.failure_mode == 'drop':
+                        # No response at all: the client sees a reset connection and retries
+                        self.close_connection = True
+                        return
+                    response = {"result": None, "error": "injected failure"}
+                else:
+                    try:
+                        response = fake.handle(json.loads(body))
+                    except ValueError:
+                        response = {"result": None, "error": "invalid JSON"}
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Faux serveur AnkiConnect (collection en mémoire).")
+    parser.add_argument("--host", default="127.0.0.1", help="Adresse d'écoute")
+    parser.add_argument("--port", type=int, default=8765, help="Port d'écoute (8765 comme AnkiConnect)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latence ajoutée à chaque requête, en secondes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latence aléatoire supplémentaire maximale")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Part des requêtes qui échouent (0 à 1)")
+    parser.add_argument("--failure-mode", choices=FAILURE_MODES, default='drop',
+                        help="drop : connexion coupée, error : erreur AnkiConnect")
+    parser.add_argument("--media-dir", help="Dossier des médias reçus (en mémoire sinon)")
+    args = parser.parse_args()
+
+    fake = FakeAnkiConnect(args.host, args.port, args.latency, args.jitter, args.failure_rate,
+                           args.failure_mode, media_dir=args.media_dir)
+    print(f"🧪 Faux AnkiConnect sur {fake.url} (latence {args.latency * 1000:.0f} ms, "
+          f"pannes {args.failure_rate:.0%}, Ctrl+C pour arrêter)")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+        print(f"📊 {fake.stats['requests']} requête(s), {fake.stats['actions']} action(s), "
+              f"{fake.stats['failures']} panne(s) injectée(s)")
+
+if __name__ == "__main__":
+    main()
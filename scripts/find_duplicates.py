@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Détection des cartes quasi identiques dans tous les decks de decks/, par exemple le même
+DL dans un chapitre de Maths et dans le deck des développements limités usuels.
+
+Le texte de chaque carte est normalisé (sans HTML, sans espacement LaTeX, sans accents),
+découpé en n-grammes de caractères et résumé par une signature MinHash. Seules les cartes
+qui partagent une bande de leur signature (LSH) sont comparées, puis regroupées si la
+similarité de Jaccard de leurs n-grammes atteint le seuil : pas de comparaison de toutes
+les paires, même avec des centaines de milliers de cartes.
+
+Usage :
+    python3 scripts/find_duplicates.py
+    python3 scripts/find_duplicates.py --threshold 0.7 --cross-deck
+    python3 scripts/find_duplicates.py --json doublons.json
+"""
+
+import argparse
+import functools
+import html
+import itertools
+import json
+import operator
+import os
+import re
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Set, Tuple
+from utils import fold_accents
+from cards import HTML_TAG_PATTERN
+import catalog
+import instrumentation
+
+# Characters per shingle
+SHINGLE_SIZE = 5
+# Signature = BANDS bands of ROWS values: two cards with Jaccard similarity s share
+# at least one band with probability 1 - (1 - s**ROWS)**BANDS (98% at 0.8, 40% at 0.5)
+BANDS = 8
+ROWS = 4
+SIGNATURE_SIZE = BANDS * ROWS
+DEFAULT_THRESHOLD = 0.8
+# Shorter normalized cards ("Oui", "x = 0") are too generic to be reported
+MIN_LENGTH = 20
+# Candidates whose estimated similarity is this far below the threshold are not verified
+ESTIMATE_MARGIN = 0.15
+# Buckets bigger than this (boilerplate text) are only compared with their first card
+MAX_BUCKET_SIZE = 50
+# Cards per batch sent to a worker process with --jobs
+SIGNATURE_BATCH_SIZE = 5000
+# Offset added to a value borrowed by an empty slot, per slot of distance (golden ratio, 32 bits)
+DENSIFY_STEP = 0x9E3779B1
+
+# LaTeX that only changes the layout of a formula: spacing, sizing and math delimiters
+LATEX_LAYOUT_PATTERN = re.compile(r'\\[,;:! ]|\\q?quad\b|\\(?:left|right|displaystyle)\b|\\[()\[\]]|\$')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+class CatalogCard(NamedTuple):
+    """Une carte du catalogue : CSV (relatif à decks/), ligne, recto et verso."""
+    csv_path: str
+    row: int
+    front: str
+    back: str
+
+def normalize_card(front: str, back: str) -> str:
+    """
+    Texte comparable d'une carte : sans balises HTML ni entités, sans mise en page LaTeX,
+    sans accents (comme utils.slugify), en minuscules et sans aucun espace.
+    """
+    text = html.unescape(HTML_TAG_PATTERN.sub(' ', f"{front}\n|\n{back}"))
+    text = LATEX_LAYOUT_PATTERN.sub('', text)
+    return WHITESPACE_PATTERN.sub('', fold_accents(text))
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> Set[int]:
+    """Empreintes (CRC32) des n-grammes de caractères d'un texte normalisé."""
+    data = text.encode('ascii')
+    if len(data) <= size:
+        return {zlib.crc32(data)}
+    return set(map(zlib.crc32, [data[i:i + size] for i in range(len(data) - size + 1)]))
+
+def minhash_signature(hashes: Set[int], size: int = SIGNATURE_SIZE) -> array:
+    """
+    Signature MinHash en un seul passage (one-permutation hashing) : chaque empreinte
+    tombe dans une case selon son reste modulo size et chaque case garde son minimum.
+    Une case vide reprend la valeur de la suivante non vide, décalée selon la distance.
+    """
+    # Descending order: the smallest hash of each slot is assigned last
+    slots = {h % size: h for h in sorted(hashes, reverse=True)}
+    signature = array('I', bytes(4 * size))
+    for i in range(size):
+        distance = 0
+        while (i + distance) % size not in slots:
+            distance += 1
+        signature[i] = (slots[(i + distance) % size] + distance * DENSIFY_STEP) & 0xFFFFFFFF
+    return signature
+
+def estimate_similarity(a: array, b: array) -> float:
+    """Similarité de Jaccard estimée par la part de cases égales des deux signatures."""
+    return sum(map(operator.eq, a, b)) / len(a)
+
+def compute_signatures(texts: List[str]) -> List[array]:
+    """Signatures MinHash d'une série de textes normalisés (dans un processus de travail avec jobs)."""
+    return [minhash_signature(shingle_hashes(text)) for text in texts]
+
+def iter_signatures(texts: List[str], jobs: int = 1) -> Iterator[array]:
+    """Signatures des textes, dans l'ordre, calculées par jobs processus si jobs > 1."""
+    if jobs <= 1:
+        yield from compute_signatures(texts)
+        return
+    batches = [texts[start:start + SIGNATURE_BATCH_SIZE] for start in range(0, len(texts), SIGNATURE_BATCH_SIZE)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for signatures in executor.map(compute_signatures, batches):
+            yield from signatures
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    """Similarité de Jaccard de deux ensembles d'empreintes."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def find_clusters(cards: Iterable[CatalogCard], threshold: float = DEFAULT_THRESHOLD,
+                  min_length: int = MIN_LENGTH, jobs: int = 1) -> List[List[CatalogCard]]:
+    """
+    Groupes de cartes quasi identiques (au moins deux cartes), triés par taille décroissante.
+    Les cartes au texte normalisé identique forment d'emblée un groupe ; un seul représentant
+    de chacun passe par le LSH. Les paires candidates sont filtrées sur leur signature,
+    puis vérifiées sur leurs n-grammes. Avec jobs > 1, les signatures sont calculées en parallèle.
+    """
+    # Identical normalized text: grouped directly
+    groups: Dict[str, List[CatalogCard]] = {}
+    with instrumentation.stage('normalize'):
+        for card in cards:
+            text = normalize_card(card.front, card.back)
+            if len(text) >= min_length:
+                groups.setdefault(text, []).append(card)
+    texts = list(groups)
+
+    signatures: List[array] = []
+    buckets: Dict[Tuple[int, bytes], List[int]] = {}
+    with instrumentation.stage('signatures'):
+        for index, signature in enumerate(iter_signatures(texts, jobs)):
+            signatures.append(signature)
+            for band in range(BANDS):
+                key = (band, signature[band * ROWS:(band + 1) * ROWS].tobytes())
+                buckets.setdefault(key, []).append(index)
+
+    # Union-find over the groups whose shingles are similar enough
+    parent = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    @functools.lru_cache(maxsize=4096)
+    def shingles(index: int) -> Set[int]:
+        return shingle_hashes(texts[index])
+
+    with instrumentation.stage('verify'):
+        checked: Set[Tuple[int, int]] = set()
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            if len(members) > MAX_BUCKET_SIZE:
+                pairs: Iterable[Tuple[int, int]] = ((members[0], other) for other in members[1:])
+            else:
+                pairs = itertools.combinations(members, 2)
+            for first, second in pairs:
+                root_first, root_second = find(first), find(second)
+                # Already in the same cluster, or compared through another band
+                if root_first == root_second or (first, second) in checked:
+                    continue
+                checked.add((first, second))
+                if estimate_similarity(signatures[first], signatures[second]) < threshold - ESTIMATE_MARGIN:
+                    continue
+                instrumentation.count('duplicate_verifications')
+                if jaccard(shingles(first), shingles(second)) >= threshold:
+                    parent[root_second] = root_first
+        instrumentation.count('duplicate_candidates', len(checked))
+
+    clusters: Dict[int, List[CatalogCard]] = {}
+    for index, text in enumerate(texts):
+        clusters.setdefault(find(index), []).extend(groups[text])
+    result = [sorted(cluster) for cluster in clusters.values() if len(cluster) > 1]
+    result.sort(key=lambda cluster: (-len(cluster), cluster[0]))
+    return result
+
+def excerpt(text: str, length: int = 80) -> str:
+    """Début lisible d'un champ (sans HTML), pour le rapport."""
+    text = WHITESPACE_PATTERN.sub(' ', html.unescape(HTML_TAG_PATTERN.sub(' ', text))).strip()
+    return text if len(text) <= length else f"{text[:length - 1]}…"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Détecte les cartes quasi identiques dans tous les decks.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Similarité minimale des cartes regroupées, de 0 à 1 (défaut : {DEFAULT_THRESHOLD})")
+    parser.add_argument("--min-length", type=int, default=MIN_LENGTH,
+                        help=f"Ignore les cartes plus courtes, une fois normalisées (défaut : {MIN_LENGTH} caractères)")
+    parser.add_argument("--cross-deck", action="store_true",
+                        help="Ne signale que les groupes répartis sur plusieurs decks")
+    parser.add_argument("--json", metavar="FICHIER", help="Enregistre aussi les groupes en JSON")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Nombre de processus de calcul des signatures (0 = nombre de cœurs)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumentation.session("find_duplicates", args):
+        with instrumentation.stage('catalog'):
+            conn = catalog.open_catalog()
+            cards = [CatalogCard(*row) for row in catalog.iter_catalog_cards(conn)]
+            conn.close()
+        jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+        clusters = find_clusters(cards, args.threshold, args.min_length, jobs)
+        if args.cross_deck:
+            clusters = [cluster for cluster in clusters if len({card.csv_path for card in cluster}) > 1]
+
+        for cluster in clusters:
+            print(f"♊ {len(cluster)} cartes : {excerpt(cluster[0].front)}")
+            for card in cluster:
+                print(f"   {card.csv_path}:{card.row}  {excerpt(card.back, 60)}")
+        print()
+        print(f"🔍 {len(cards)} cartes comparées : {len(clusters)} groupe(s) de cartes quasi identiques, "
+              f"{sum(len(cluster) for cluster in clusters)} cartes")
+
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump([[card._asdict() for card in cluster] for cluster in clusters], f,
+                          ensure_ascii=False, indent=2)
+            print(f"💾 Groupes : {args.json}")
+
+if __name__ == "__main__":
+    main()
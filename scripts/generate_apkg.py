@@ -1,15 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import csv
+import argparse
+import contextlib
+import copy
+import hashlib
+import io
 import os
 import re
 import sys
 import shutil
-import genanki
+import tempfile
+import zipfile
 import json
-from typing import List, Tuple
-from utils import slugify
+from collections import Counter
+from urllib.parse import quote
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+from utils import slugify, file_sha256, build_media_index, resolve_media, find_ambiguous_media
+from cards import iter_cards, clean_media_paths, SRC_PATTERN, EXTERNAL_SRC_PREFIXES
+import instrumentation
+import media_optimizer
 
 # --- CONFIGURATION ---
 SCRIPT_PATH = os.path.realpath(__file__)
@@ -22,22 +33,108 @@ OUTPUT_DIR = os.path.join(BASE_DIR, "docs")
 PREVIEWS_DIR = os.path.join(OUTPUT_DIR, "previews")
 OUT_MEDIA_DIR = os.path.join(OUTPUT_DIR, "media")
 
+# Cards per preview page: the site shows the first page while the others load
+PREVIEW_PAGE_SIZE = 20
+# Hex digits of the content hash in page file names
+PREVIEW_HASH_LENGTH = 12
+# Displayed width of preview images (.flashcard is at most 600px wide), for srcset
+PREVIEW_IMAGE_SIZES = "(max-width: 640px) 90vw, 600px"
+IMG_TAG_PATTERN = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+
+# Persistent build cache (ignored by git, restored by the CI cache)
+CACHE_DIR = os.path.join(BASE_DIR, ".cache")
+BUILD_CACHE_PATH = os.path.join(CACHE_DIR, "build_cache.json")
+# Bump when the generation logic changes so that every deck is rebuilt
+BUILD_CACHE_VERSION = 5
+
+# Reproducible builds: fixed date used when SOURCE_DATE_EPOCH is not set (2024-01-01)
+DEFAULT_SOURCE_DATE_EPOCH = 1704067200
+# Oldest date a zip entry can hold
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
 # --- ANKI MODEL ---
+# Plain data so that the model fingerprint does not need genanki (imported only to write packages)
 MODEL_ID = 1607392319
-PTSI_MODEL = genanki.Model(
-    MODEL_ID,
-    'PTSI Modele Simple',
-    fields=[{'name': 'Question'}, {'name': 'Reponse'}],
-    templates=[{
-        'name': 'Carte 1',
-        'qfmt': '{{Question}}',
-        'afmt': '{{FrontSide}}<hr id="answer">{{Reponse}}',
-    }]
-)
+MODEL_NAME = 'PTSI Modele Simple'
+MODEL_FIELDS = [{'name': 'Question'}, {'name': 'Reponse'}]
+MODEL_TEMPLATES = [{
+    'name': 'Carte 1',
+    'qfmt': '{{Question}}',
+    'afmt': '{{FrontSide}}<hr id="answer">{{Reponse}}',
+}]
+MODEL_CSS = ''
+MODEL_TYPE = 0  # genanki.Model.FRONT_BACK
+
+def get_model_fingerprint() -> str:
+    """Empreinte de la définition du modèle (un changement invalide tout le cache)."""
+    model_definition = {
+        'id': MODEL_ID,
+        'name': MODEL_NAME,
+        'fields': MODEL_FIELDS,
+        'templates': MODEL_TEMPLATES,
+        'css': MODEL_CSS,
+        'type': MODEL_TYPE,
+    }
+    encoded = json.dumps(model_definition, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+MODEL_FINGERPRINT = get_model_fingerprint()
+
+_model = None
+
+def get_model():
+    """Modèle genanki des cartes PTSI, créé au premier paquet écrit."""
+    global _model
+    if _model is None:
+        import genanki
+        # genanki mutates the field and template dicts while writing: give it copies
+        _model = genanki.Model(MODEL_ID, MODEL_NAME, fields=copy.deepcopy(MODEL_FIELDS),
+                               templates=copy.deepcopy(MODEL_TEMPLATES), css=MODEL_CSS,
+                               model_type=MODEL_TYPE)
+    return _model
 
 def get_unique_deck_id(deck_name: str) -> int:
-    """Génère un ID unique pour le deck basé sur son nom."""
-    return abs(hash(deck_name)) % (10 ** 8)
+    """Génère un ID unique et stable (d'un build à l'autre) pour le deck basé sur son nom."""
+    # hash() is salted per process, sha256 gives the same ID on every build
+    digest = hashlib.sha256(deck_name.encode('utf-8')).hexdigest()
+    return int(digest, 16) % (10 ** 8)
+
+def get_source_date_epoch() -> int:
+    """Date de référence des builds reproductibles (variable SOURCE_DATE_EPOCH si définie)."""
+    try:
+        return int(os.environ.get('SOURCE_DATE_EPOCH', DEFAULT_SOURCE_DATE_EPOCH))
+    except ValueError:
+        return DEFAULT_SOURCE_DATE_EPOCH
+
+def get_deck_timestamp(deck_name: str) -> float:
+    """
+    Horodatage fixe d'un deck pour un build reproductible.
+    genanki dérive les IDs des notes et cartes de l'horodatage : un décalage propre
+    à chaque deck évite que deux decks partagent les mêmes IDs.
+    """
+    return float(get_source_date_epoch() + get_unique_deck_id(deck_name) % (10 ** 6))
+
+def normalize_zip(path: str) -> None:
+    """Réécrit une archive avec des dates et permissions fixes pour un contenu identique octet par octet."""
+    with zipfile.ZipFile(path, 'r') as source:
+        entries = [(info, source.read(info.filename)) for info in source.infolist()]
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.apkg.tmp')
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp_path, 'w') as target:
+            for info, data in entries:
+                fixed_info = zipfile.ZipInfo(info.filename, date_time=ZIP_EPOCH)
+                fixed_info.compress_type = info.compress_type
+                fixed_info.external_attr = 0o644 << 16
+                fixed_info.create_system = 3  # Unix, whatever the build machine
+                target.writestr(fixed_info, data)
+        # mkstemp creates the file as 0600: keep packages readable by the web server
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
 
 def clean_deck_name(base_name: str, subject_folder: str) -> str:
     """Nettoie le nom du fichier pour obtenir le nom du titre."""
@@ -52,41 +149,30 @@ def clean_deck_name(base_name: str, subject_folder: str) -> str:
     
     return base_name
 
-def extract_media_refs(text: str) -> List[str]:
-    """Extrait les références d'images src="..."."""
-    return re.findall(r'src="([^"]+)"', text)
-
-def clean_media_paths(text: str) -> str:
-    """Nettoie les chemins d'images pour Anki."""
-    # Transforme <img src="../media/si/photo.jpg"> en <img src="photo.jpg">
-    return re.sub(r'src="[^"]*/([^"/]+)"', r'src="\1"', text)
+def get_deck_names(csv_path: str, subject_folder: str) -> Tuple[str, str, str]:
+    """Retourne le nom du deck Anki, le nom du .apkg et le sous-dossier média d'un CSV."""
+    base_name = os.path.basename(csv_path).replace('.csv', '')
+    
+    clean_name = clean_deck_name(base_name, subject_folder)
+    deck_name = f"{subject_folder}::{clean_name.replace('_', ' ')}"
+    output_filename = f"{subject_folder}-{clean_name}.apkg"
+    
+    # Media subfolder relies on the last part of the deck name
+    media_subfolder = slugify(deck_name.split('::')[-1])
+    return deck_name, output_filename, media_subfolder
 
-def process_csv_rows(csv_path: str) -> Tuple[List[genanki.Note], List[str]]:
-    """Lit un fichier CSV et génère des notes."""
+def process_csv_rows(csv_path: str) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """Lit un fichier CSV et retourne les champs (recto, verso) des notes et les images référencées."""
     notes = []
     media_refs = []
     
     try:
-        with open(csv_path, 'r', encoding='utf-8-sig') as f:
-            reader = csv.reader(f, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-            for row in reader:
-                if len(row) < 2:
-                    continue
-                
-                front, back = row[0], row[1]
-                # Clean quoted quotes
-                front = front.replace('""', '"').strip('"')
-                back = back.replace('""', '"').strip('"')
-                
-                # Collect media references BEFORE cleaning paths
-                media_refs.extend(extract_media_refs(front + back))
-                
-                # Clean paths for Anki
-                front = clean_media_paths(front)
-                back = clean_media_paths(back)
-                
-                note = genanki.Note(model=PTSI_MODEL, fields=[front, back])
-                notes.append(note)
+        for card in iter_cards(csv_path):
+            # Collect media references BEFORE cleaning paths
+            media_refs.extend(card.media_refs)
+            
+            # Clean paths for Anki
+            notes.append((clean_media_paths(card.front), clean_media_paths(card.back)))
                 
     except Exception as e:
         print(f"   ❌ Erreur lecture CSV {os.path.basename(csv_path)}: {e}")
@@ -94,97 +180,422 @@ def process_csv_rows(csv_path: str) -> Tuple[List[genanki.Note], List[str]]:
         
     return notes, media_refs
 
-def find_media_files(media_refs: List[str], media_subfolder: str) -> List[str]:
-    """Trouve les fichiers images correspondants dans media/."""
-    create_package_media = []
+def find_media_files(media_refs: List[str], media_subfolder: str,
+                     media_index: Optional[Dict[str, List[str]]] = None) -> List[str]:
+    """Trouve les fichiers images correspondants dans media/ grâce à l'index des médias."""
+    if media_index is None:
+        media_index = build_media_index(MEDIA_DIR)
+    subfolder_dir = os.path.join(MEDIA_DIR, media_subfolder)
+    
+    # dict keeps insertion order and gives O(1) dedup
+    create_package_media: Dict[str, None] = {}
+    missing = set()
     
     for img_ref in media_refs:
         img_name = os.path.basename(img_ref)
-        full_img_path = os.path.join(MEDIA_DIR, media_subfolder, img_name)
+        found_path = resolve_media(media_index, img_name, subfolder_dir)
         
-        if os.path.exists(full_img_path):
-            if full_img_path not in create_package_media:
-                create_package_media.append(full_img_path)
-        else:
-            # Fallback direct search in media/
-            found_path = None
-            for root, _, files in os.walk(MEDIA_DIR):
-                if img_name in files:
-                    found_path = os.path.join(root, img_name)
-                    break
-            
-            if found_path:
-                if found_path not in create_package_media:
-                    create_package_media.append(found_path)
-            else:
-                print(f"      ⚠️ Image manquante : {img_name} (introuvable dans media/)")
+        if found_path:
+            create_package_media[found_path] = None
+        elif img_name not in missing:
+            missing.add(img_name)
+            print(f"      ⚠️ Image manquante : {img_name} (introuvable dans media/)")
                 
-    return create_package_media
+    return list(create_package_media)
 
-def generate_deck_package(csv_path: str, subject_folder: str) -> Tuple[bool, int, str]:
-    """Génère un paquet .apkg à partir d'un fichier CSV."""
-    filename = os.path.basename(csv_path)
-    base_name = filename.replace('.csv', '')
-    
-    clean_name = clean_deck_name(base_name, subject_folder)
-    deck_name = f"{subject_folder}::{clean_name.replace('_', ' ')}"
-    output_filename = f"{subject_folder}-{clean_name}.apkg"
-    
-    # Media subfolder relies on the last part of the deck name
-    last_part = deck_name.split('::')[-1]
-    media_subfolder = slugify(last_part)
-    
-    print(f"🔨 Traitement : {filename}")
-    print(f"   📦 Deck Anki : {deck_name}")
-    
-    notes, media_refs = process_csv_rows(csv_path)
-    if not notes:
-        return False, 0, output_filename
+def report_ambiguous_media(media_index: Dict[str, List[str]]) -> None:
+    """Signale les images présentes sous le même nom dans plusieurs sous-dossiers."""
+    for name, paths in sorted(find_ambiguous_media(media_index).items()):
+        identical = len({file_sha256(path) for path in paths}) == 1
+        status = "contenu identique" if identical else "contenus différents"
+        folders = ", ".join(os.path.relpath(os.path.dirname(path), MEDIA_DIR) for path in paths)
+        print(f"⚠️ Image ambiguë : {name} ({status}) dans {folders}")
 
-    deck = genanki.Deck(get_unique_deck_id(deck_name), deck_name)
-    for note in notes:
-        deck.add_note(note)
-        
-    media_files = find_media_files(media_refs, media_subfolder)
-    
-    # Copy media files to docs/media for previews
+def compute_deck_key(csv_path: str, media_files: List[str], reproducible: bool = False) -> str:
+    """
+    Clé de cache d'un deck : contenu du CSV, des médias référencés et du modèle, et réglages
+    de l'optimiseur d'images (avec ou sans Pillow, l'aperçu n'a pas les mêmes variantes).
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{BUILD_CACHE_VERSION}\n".encode('utf-8'))
+    digest.update(f"pillow:{media_optimizer.is_available()}:{media_optimizer.OPTIMIZER_VERSION}:"
+                  f"{media_optimizer.MAX_DIMENSION}:{media_optimizer.JPEG_QUALITY}:"
+                  f"{media_optimizer.PREVIEW_WIDTHS}\n".encode('utf-8'))
+    if reproducible:
+        digest.update(f"reproducible:{get_source_date_epoch()}\n".encode('utf-8'))
+    digest.update(MODEL_FINGERPRINT.encode('utf-8'))
+    digest.update(file_sha256(csv_path).encode('utf-8'))
+    for m_file in sorted(media_files, key=os.path.basename):
+        digest.update(os.path.basename(m_file).encode('utf-8'))
+        digest.update(file_sha256(m_file).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_build_cache() -> Dict[str, Dict[str, Any]]:
+    """Charge le cache de build (vide s'il est absent, corrompu ou d'une autre version)."""
+    if not os.path.exists(BUILD_CACHE_PATH):
+        return {}
+    try:
+        with open(BUILD_CACHE_PATH, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Cache de build illisible, reconstruction complète : {e}")
+        return {}
+    if cache.get('version') != BUILD_CACHE_VERSION:
+        return {}
+    return cache.get('decks', {})
+
+def save_build_cache(decks_cache: Dict[str, Dict[str, Any]]) -> None:
+    """Sauvegarde le cache de build."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    try:
+        with open(BUILD_CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'version': BUILD_CACHE_VERSION, 'decks': decks_cache}, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"⚠️ Erreur sauvegarde cache : {e}")
+
+def is_cache_hit(entry: Optional[Dict[str, Any]], deck_key: str, output_filename: str,
+                 require_preview: bool = True) -> bool:
+    """Vérifie que le deck est inchangé et que ses artefacts sont toujours présents."""
+    if not entry or entry.get('key') != deck_key:
+        return False
+    output_path = os.path.join(OUTPUT_DIR, output_filename)
+    preview_path, _ = get_preview_paths(output_filename)
+    return os.path.exists(output_path) and (not require_preview or os.path.exists(preview_path))
+
+def sync_file(src: str, dest: str) -> None:
+    """Copie un fichier s'il est absent de la destination ou différent."""
+    if os.path.exists(dest):
+        src_stat, dest_stat = os.stat(src), os.stat(dest)
+        # copy2 keeps the mtime: same size and mtime means the same file was copied before
+        if src_stat.st_size == dest_stat.st_size and int(src_stat.st_mtime) == int(dest_stat.st_mtime):
+            return
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.copy2(src, dest)
+    instrumentation.add_bytes(written=os.path.getsize(dest))
+
+def copy_preview_media(media_files: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Copie dans docs/media les images des aperçus : leurs variantes réduites (docs/media/preview/<largeur>/)
+    quand Pillow peut les produire, l'image entière sinon. Retourne les variantes par nom d'image.
+    """
+    variants_by_name = {}
     for m_file in media_files:
-        dest = os.path.join(OUT_MEDIA_DIR, os.path.basename(m_file))
-        if not os.path.exists(dest):
-            shutil.copy2(m_file, dest)
+        name = os.path.basename(m_file)
+        variants = media_optimizer.preview_variants(m_file)
+        if variants:
+            # Full resolution stays in the .apkg only
+            for variant in variants:
+                sync_file(variant['path'], os.path.join(OUT_MEDIA_DIR, 'preview', str(variant['width']), name))
+            variants_by_name[name] = variants
+        else:
+            sync_file(m_file, os.path.join(OUT_MEDIA_DIR, name))
+    return variants_by_name
+
+def rewrite_preview_images(html: str, variants_by_name: Dict[str, List[Dict[str, Any]]]) -> str:
+    """
+    Adapte les balises <img> d'un champ au site : src vers docs/media, srcset des variantes
+    avec leurs dimensions, chargement différé.
+    """
+    def rewrite(match: re.Match) -> str:
+        tag = match.group(0)
+        src = SRC_PATTERN.search(tag)
+        if not src or src.group(2).startswith(EXTERNAL_SRC_PREFIXES):
+            return tag
+        name = src.group(2)
+        variants = variants_by_name.get(name)
+        if variants:
+            largest = variants[-1]
+            srcset = ", ".join(f"media/preview/{v['width']}/{name} {v['width']}w" for v in variants)
+            new_src = (f'src="media/preview/{largest["width"]}/{name}" srcset="{srcset}" '
+                       f'sizes="{PREVIEW_IMAGE_SIZES}"')
+            # Reserve the space before the image arrives (CSS keeps it responsive)
+            if not re.search(r'\s(width|height)=', tag, re.IGNORECASE):
+                new_src += f' width="{largest["width"]}" height="{largest["height"]}"'
+        else:
+            new_src = f'src={src.group(1)}media/{name}{src.group(1)}'
+        tag = tag[:src.start()] + new_src + tag[src.end():]
+        if 'loading=' not in tag.lower():
+            end = len(tag) - (2 if tag.endswith('/>') else 1)
+            body = tag[:end].rstrip()
+            tag = f'{body} loading="lazy" decoding="async"{tag[len(body):]}'
+        return tag
+
+    return IMG_TAG_PATTERN.sub(rewrite, html)
+
+class ParsedDeck(NamedTuple):
+    """Un deck lu depuis son CSV, prêt à être empaqueté ou prévisualisé."""
+    csv_path: str
+    subject_folder: str
+    deck_name: str
+    output_filename: str
+    # (front, back) with media paths cleaned for Anki
+    notes: List[Tuple[str, str]]
+    media_files: List[str]
+
+def parse_deck(csv_path: str, subject_folder: str,
+               media_index: Optional[Dict[str, List[str]]] = None,
+               optimize_media: bool = False) -> ParsedDeck:
+    """
+    Lit un CSV et résout ses images (sans genanki).
+    Avec optimize_media, les images retenues sont leurs versions optimisées (.apkg et site).
+    """
+    deck_name, output_filename, media_subfolder = get_deck_names(csv_path, subject_folder)
+    with instrumentation.stage('csv'):
+        notes, media_refs = process_csv_rows(csv_path)
+    with instrumentation.stage('media_lookup'):
+        media_files = find_media_files(media_refs, media_subfolder, media_index) if notes else []
+    if optimize_media:
+        with instrumentation.stage('optimize_media'):
+            media_files = media_optimizer.optimize_media_files(media_files)
+    return ParsedDeck(csv_path, subject_folder, deck_name, output_filename, notes, media_files)
+
+def get_preview_paths(output_filename: str, previews_dir: Optional[str] = None) -> Tuple[str, str]:
+    """Chemins de l'aperçu d'un deck (dans docs/previews par défaut) : manifeste JSON et dossier de ses pages."""
+    previews_dir = previews_dir or PREVIEWS_DIR
+    stem = output_filename[:-len('.apkg')]
+    return os.path.join(previews_dir, f"{stem}.json"), os.path.join(previews_dir, stem)
+
+def write_preview(deck: ParsedDeck) -> Optional[Dict[str, Any]]:
+    """
+    Écrit l'aperçu d'un deck, copie ses images (ou leurs variantes réduites) dans docs/media
+    et retourne son manifeste.
+    Les cartes sont découpées en pages de PREVIEW_PAGE_SIZE, nommées d'après leur contenu :
+    une page inchangée garde son URL et reste dans le cache du navigateur. Le manifeste
+    (nom fixe) donne le nombre de cartes et l'URL actuelle des pages.
+    """
+    # Copy media files (or their preview-sized variants) to docs/media
+    variants_by_name = copy_preview_media(deck.media_files)
             
     # Generate JSON preview data
     preview_notes = []
-    for note in notes:
-        # replace src="img.jpg" with src="media/img.jpg" for the web preview
-        front_html = note.fields[0].replace('src="', 'src="media/').replace("src='", "src='media/")
-        back_html = note.fields[1].replace('src="', 'src="media/').replace("src='", "src='media/")
-        preview_notes.append({"front": front_html, "back": back_html})
+    for front, back in deck.notes:
+        preview_notes.append({"front": rewrite_preview_images(front, variants_by_name),
+                              "back": rewrite_preview_images(back, variants_by_name)})
         
-    preview_path = os.path.join(PREVIEWS_DIR, output_filename.replace('.apkg', '.json'))
+    manifest_path, pages_dir = get_preview_paths(deck.output_filename)
+    pages_dir_name = os.path.basename(pages_dir)
     try:
-        with open(preview_path, 'w', encoding='utf-8') as f:
-            json.dump(preview_notes, f, ensure_ascii=False)
+        os.makedirs(pages_dir, exist_ok=True)
+        page_names = []
+        for start in range(0, len(preview_notes), PREVIEW_PAGE_SIZE):
+            content = json.dumps(preview_notes[start:start + PREVIEW_PAGE_SIZE], ensure_ascii=False).encode('utf-8')
+            page_name = f"{hashlib.sha256(content).hexdigest()[:PREVIEW_HASH_LENGTH]}.json"
+            page_path = os.path.join(pages_dir, page_name)
+            if not os.path.exists(page_path):
+                with open(page_path, 'wb') as f:
+                    f.write(content)
+                instrumentation.add_bytes(written=len(content))
+            page_names.append(page_name)
+        # Pages of previous versions of the deck
+        for name in set(os.listdir(pages_dir)) - set(page_names):
+            os.remove(os.path.join(pages_dir, name))
+        
+        manifest = {
+            'cards': len(preview_notes),
+            'page_size': PREVIEW_PAGE_SIZE,
+            # Relative to the manifest URL
+            'pages': [quote(f"{pages_dir_name}/{name}") for name in page_names],
+        }
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+            instrumentation.add_bytes(written=f.tell())
+        return manifest
     except Exception as e:
         print(f"   ⚠️ Erreur sauvegarde preview : {e}")
+        return None
+
+def prune_previews(output_filenames: Set[str]) -> int:
+    """Supprime les aperçus (manifeste et pages) des decks qui n'existent plus, et retourne leur nombre."""
+    if not os.path.isdir(PREVIEWS_DIR):
+        return 0
+    keep = set()
+    for output_filename in output_filenames:
+        keep.update(os.path.basename(path) for path in get_preview_paths(output_filename))
+    removed = 0
+    for name in sorted(set(os.listdir(PREVIEWS_DIR)) - keep):
+        path = os.path.join(PREVIEWS_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif name.endswith('.json'):
+            os.remove(path)
+            removed += 1
+    return removed
+
+def write_package(deck: ParsedDeck, reproducible: bool = False) -> None:
+    """Écrit le paquet .apkg d'un deck."""
+    import genanki
     
-    # Save package
-    output_path = os.path.join(OUTPUT_DIR, output_filename)
-    package = genanki.Package(deck)
-    package.media_files = media_files
+    model = get_model()
+    anki_deck = genanki.Deck(get_unique_deck_id(deck.deck_name), deck.deck_name)
+    for front, back in deck.notes:
+        # GUID derived from the fields only, so a rebuild never creates duplicates
+        anki_deck.add_note(genanki.Note(model=model, fields=[front, back], guid=genanki.guid_for(front, back)))
     
-    try:
+    output_path = os.path.join(OUTPUT_DIR, deck.output_filename)
+    package = genanki.Package(anki_deck)
+    package.media_files = deck.media_files
+    
+    if reproducible:
+        package.write_to_file(output_path, timestamp=get_deck_timestamp(deck.deck_name))
+        normalize_zip(output_path)
+    else:
         package.write_to_file(output_path)
-        print(f"   ✅ Créé : {len(notes)} cartes, {len(media_files)} images, 1 preview")
+    instrumentation.add_bytes(written=os.path.getsize(output_path))
+
+def generate_deck_package(csv_path: str, subject_folder: str,
+                          build_cache: Optional[Dict[str, Dict[str, Any]]] = None,
+                          reproducible: bool = False,
+                          media_index: Optional[Dict[str, List[str]]] = None,
+                          parsed: Optional[ParsedDeck] = None,
+                          previews: bool = True,
+                          optimize_media: bool = False) -> Tuple[bool, int, str]:
+    """
+    Génère un paquet .apkg à partir d'un fichier CSV.
+    Si build_cache est fourni, un deck inchangé depuis le dernier build est ignoré
+    et son entrée de cache est mise à jour après une génération réussie.
+    En mode reproductible, des entrées identiques donnent un .apkg identique octet par octet.
+    Un deck déjà lu (parsed) n'est pas relu ; sans previews, l'aperçu est laissé à l'appelant.
+    Avec optimize_media, le paquet et l'aperçu utilisent les images optimisées.
+    """
+    filename = os.path.basename(csv_path)
+    deck_name, output_filename, _ = get_deck_names(csv_path, subject_folder)
+    
+    print(f"🔨 Traitement : {filename}")
+    print(f"   📦 Deck Anki : {deck_name}")
+    
+    deck = parsed
+    if deck is None:
+        with instrumentation.stage('parse'):
+            deck = parse_deck(csv_path, subject_folder, media_index, optimize_media)
+    if not deck.notes:
+        return False, 0, output_filename
+    card_count = len(deck.notes)
+    
+    deck_key = None
+    if build_cache is not None:
+        with instrumentation.stage('cache_key'):
+            deck_key = compute_deck_key(csv_path, deck.media_files, reproducible)
+        entry = build_cache.get(output_filename)
+        if is_cache_hit(entry, deck_key, output_filename, require_preview=previews):
+            if previews:
+                with instrumentation.stage('preview'):
+                    copy_preview_media(deck.media_files)
+            print(f"   ♻️ Inchangé : {entry['cards']} cartes (cache)")
+            print()
+            return True, entry['cards'], output_filename
+
+    if previews:
+        with instrumentation.stage('preview'):
+            write_preview(deck)
+    
+    try:
+        with instrumentation.stage('genanki'):
+            write_package(deck, reproducible)
+        if build_cache is not None:
+            build_cache[output_filename] = {'key': deck_key, 'cards': card_count}
+        preview_note = ", 1 preview" if previews else ""
+        print(f"   ✅ Créé : {card_count} cartes, {len(deck.media_files)} images{preview_note}")
         print()
-        return True, len(notes), output_filename
+        return True, card_count, output_filename
     except Exception as e:
         print(f"   ❌ Erreur écriture .apkg : {e}")
         return False, 0, output_filename
 
-def main() -> None:
+def collect_csv_files() -> List[Tuple[str, str]]:
+    """Liste les CSV de decks/ (matière, chemin) dans un ordre stable."""
+    csv_files = []
+    for root, dirs, files in os.walk(DECKS_DIR):
+        dirs.sort()
+        relative_path = os.path.relpath(root, DECKS_DIR)
+        
+        if relative_path == '.':
+            subject_folder = 'Divers'
+        else:
+            subject_folder = relative_path.split(os.sep)[0]
+            
+        for csv_file in sorted(f for f in files if f.endswith('.csv')):
+            csv_files.append((subject_folder, os.path.join(root, csv_file)))
+    return csv_files
+
+# Media index shared by every deck of a run (set in each worker process)
+_media_index: Optional[Dict[str, List[str]]] = None
+
+def init_worker(media_index: Dict[str, List[str]]) -> None:
+    """Initialise un processus de travail avec l'index des médias, transmis une seule fois."""
+    global _media_index
+    _media_index = media_index
+
+class DeckTask(NamedTuple):
+    """Construction d'un deck, transmise à un processus de travail."""
+    csv_path: str
+    subject_folder: str
+    cache_entry: Optional[Dict[str, Any]]
+    reproducible: bool
+    capture_output: bool
+    parsed: Optional[ParsedDeck] = None
+    previews: bool = True
+    optimize_media: bool = False
+    # Measure the deck for the parent's report (see instrumentation.collect)
+    instrument: bool = False
+
+def build_deck(task: DeckTask) -> Dict[str, Any]:
+    """
+    Construit un deck (éventuellement dans un processus de travail).
+    Avec capture_output, le journal du deck est renvoyé au lieu d'être affiché,
+    pour ne pas mélanger les sorties des decks construits en parallèle.
+    """
+    _, output_filename, _ = get_deck_names(task.csv_path, task.subject_folder)
+    cache_entry = task.cache_entry
+    deck_cache = {output_filename: cache_entry} if cache_entry else {}
+    
+    log = io.StringIO()
+    with contextlib.ExitStack() as stack:
+        if task.capture_output:
+            stack.enter_context(contextlib.redirect_stdout(log))
+            stack.enter_context(contextlib.redirect_stderr(log))
+        metrics = stack.enter_context(instrumentation.collect(task.instrument))
+        success, card_count, out_name = generate_deck_package(task.csv_path, task.subject_folder, deck_cache,
+                                                              task.reproducible, _media_index,
+                                                              task.parsed, task.previews, task.optimize_media)
+    
+    entry = deck_cache.get(out_name) if success else None
+    return {
+        'success': success,
+        'cards': card_count,
+        'output_filename': out_name,
+        'cache_entry': entry,
+        # A rebuilt deck gets a fresh entry, a skipped one keeps the previous object
+        'cached': entry is not None and entry is cache_entry,
+        'log': log.getvalue(),
+        'metrics': metrics,
+    }
+
+def run_deck_builds(tasks: List[DeckTask],
+                    jobs: int, media_index: Dict[str, List[str]]) -> Iterator[Dict[str, Any]]:
+    """Construit les decks, en parallèle si jobs > 1, et renvoie les résultats dans l'ordre des tâches."""
+    if jobs <= 1:
+        init_worker(media_index)
+        yield from map(build_deck, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(media_index,)) as executor:
+        yield from executor.map(build_deck, tasks)
+
+def generate_all(args: argparse.Namespace) -> None:
+    """Génère les paquets et les aperçus de tous les decks de decks/."""
+    reproducible = args.reproducible or 'SOURCE_DATE_EPOCH' in os.environ
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    optimize_media = args.optimize_media and media_optimizer.is_available()
+
     print("="*60)
     print("🚀 GÉNÉRATION DES PAQUETS ANKI (.apkg)")
+    if reproducible:
+        print(f"🔒 Build reproductible (SOURCE_DATE_EPOCH={get_source_date_epoch()})")
+    if jobs > 1:
+        print(f"⚙️ {jobs} processus en parallèle")
+    if args.optimize_media and not optimize_media:
+        print("⚠️ Pillow n'est pas installé : images utilisées telles quelles (pip install Pillow)")
+    elif optimize_media:
+        print(f"🖼️ Images optimisées (max {media_optimizer.MAX_DIMENSION} px, qualité JPEG {media_optimizer.JPEG_QUALITY})")
     print("="*60)
     print()
     
@@ -195,48 +606,90 @@ def main() -> None:
     if not os.path.exists(OUT_MEDIA_DIR):
         os.makedirs(OUT_MEDIA_DIR)
         
-    stats = {'processed': 0, 'success': 0, 'errors': 0}
+    stats = {'processed': 0, 'success': 0, 'errors': 0, 'cached': 0}
     apkg_meta = {}
+    build_cache = {} if args.force else load_build_cache()
     
-    for root, _, files in os.walk(DECKS_DIR):
-        relative_path = os.path.relpath(root, DECKS_DIR)
-        
-        if relative_path == '.':
-            subject_folder = 'Divers'
-        else:
-            subject_folder = relative_path.split(os.sep)[0]
+    with instrumentation.stage('media_index'):
+        media_index = build_media_index(MEDIA_DIR)
+        report_ambiguous_media(media_index)
+    
+    csv_files = collect_csv_files()
+    files_per_subject = Counter(subject for subject, _ in csv_files)
+    capture_output = jobs > 1
+    tasks = []
+    for subject_folder, csv_path in csv_files:
+        _, out_name, _ = get_deck_names(csv_path, subject_folder)
+        tasks.append(DeckTask(csv_path, subject_folder, build_cache.get(out_name), reproducible, capture_output,
+                              optimize_media=optimize_media, instrument=instrumentation.is_enabled()))
+    
+    with instrumentation.stage('decks'):
+        results = run_deck_builds(tasks, jobs, media_index)
+        current_subject = None
+        for subject_folder, _ in csv_files:
+            if subject_folder != current_subject:
+                current_subject = subject_folder
+                print(f"📁 Matière : {subject_folder} ({files_per_subject[subject_folder]} fichier(s))")
+                print()
             
-        csv_files = [f for f in files if f.endswith('.csv')]
-        
-        if csv_files:
-            print(f"📁 Matière : {subject_folder} ({len(csv_files)} fichier(s))")
-            print()
+            result = next(results)
+            # Logs of parallel builds are printed as a block, in a stable order
+            print(result['log'], end='')
             
-            for csv_file in csv_files:
-                stats['processed'] += 1
-                csv_path = os.path.join(root, csv_file)
-                
-                success, card_count, out_name = generate_deck_package(csv_path, subject_folder)
-                if success:
-                    stats['success'] += 1
-                    apkg_meta[out_name] = {'cards': card_count}
-                else:
-                    stats['errors'] += 1
+            stats['processed'] += 1
+            out_name = result['output_filename']
+            instrumentation.merge(result['metrics'], deck=out_name)
+            if result['success']:
+                stats['success'] += 1
+                apkg_meta[out_name] = {'cards': result['cards']}
+                build_cache[out_name] = result['cache_entry']
+                instrumentation.count('build_cache_hits' if result['cached'] else 'build_cache_misses')
+                if result['cached']:
+                    stats['cached'] += 1
+            else:
+                stats['errors'] += 1
                     
-    # Save meta json
-    with open(os.path.join(OUTPUT_DIR, 'apkg_meta.json'), 'w', encoding='utf-8') as f:
-        json.dump(apkg_meta, f, ensure_ascii=False, indent=2)
+    with instrumentation.stage('prune'):
+        removed_previews = prune_previews({get_deck_names(csv_path, subject)[1] for subject, csv_path in csv_files})
+    if removed_previews:
+        print(f"🧹 {removed_previews} aperçu(s) de decks supprimés effacé(s)")
+        print()
+
+    with instrumentation.stage('save'):
+        # Drop cache entries of decks that no longer exist or failed
+        build_cache = {name: entry for name, entry in build_cache.items() if name in apkg_meta}
+        save_build_cache(build_cache)
+
+        # Save meta json
+        with open(os.path.join(OUTPUT_DIR, 'apkg_meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(apkg_meta, f, ensure_ascii=False, indent=2)
                     
     print("="*60)
     print(f"✨ RÉSUMÉ")
     print("="*60)
     print(f"📊 Fichiers traités : {stats['processed']}")
-    print(f"✅ Succès : {stats['success']}")
+    print(f"✅ Succès : {stats['success']} (dont {stats['cached']} depuis le cache)")
     print(f"❌ Erreurs : {stats['errors']}")
     print()
     
     if stats['success'] == 0 and stats['processed'] > 0:
         print("⚠️ Aucun paquet généré.")
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Génère les paquets .apkg et les aperçus du site.")
+    parser.add_argument("--force", action="store_true",
+                        help="Ignore le cache de build et régénère tous les decks")
+    parser.add_argument("--reproducible", action="store_true",
+                        help="Build reproductible : .apkg identiques pour des entrées identiques "
+                             "(activé si SOURCE_DATE_EPOCH est défini)")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Nombre de processus de génération en parallèle (0 = nombre de cœurs)")
+    parser.add_argument("--optimize-media", action="store_true",
+                        help="Réduit et recompresse les images (.apkg et site), nécessite Pillow")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session("generate_apkg", args):
+        generate_all(args)
+
 if __name__ == "__main__":
     main()
@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
+import hashlib
+import html
 import json
 import os
+import re
+from collections import defaultdict
 from datetime import date
 from urllib.parse import quote
 from pathlib import Path
-from typing import Dict, List, Any
-from jinja2 import Environment, FileSystemLoader
+from typing import Dict, Iterable, List, Any, Optional, Tuple
+from utils import fold_accents
+from cards import HTML_TAG_PATTERN
+import catalog
+import generate_apkg
+import instrumentation
 
 # --- CONFIGURATION ---
 SCRIPT_PATH = Path(__file__).resolve()
@@ -16,68 +25,217 @@ OUTPUT_DIR = BASE_DIR / "docs"
 
 BASE_URL = "https://cermp.github.io/anki-ptsi/"
 
-def get_file_size_str(filepath: Path) -> str:
-    """Retourne la taille du fichier formatée (KB/MB)."""
-    size_bytes = filepath.stat().st_size
+# --- SEARCH INDEX ---
+SEARCH_DIR = OUTPUT_DIR / "search"
+# Tokens are grouped in shards by their first characters: a query only loads the shards it needs
+SEARCH_SHARD_PREFIX = 2
+SEARCH_MIN_TOKEN = 2
+# Hex digits of the content hash in search file names
+SEARCH_HASH_LENGTH = 12
+SEARCH_STOPWORDS = frozenset("""
+    au aux avec ce ces cette dans de des du elle en est et il ils la le les leur lui mais ne ni
+    on ou par pas pour qu que qui sa se ses si son sont sur ta te tes ton tu un une vos votre
+    the of and to in is are for on with by an as at be it or
+""".split())
+# LaTeX commands that only lay out a formula (others, like \sin or \ln, stay searchable)
+LATEX_NOISE = frozenset("""
+    left right frac dfrac tfrac displaystyle textstyle text textbf textit mathrm mathbf mathit
+    mathbb mathcal operatorname quad qquad cdot cdots ldots dots times begin end limits big bigg
+    hline array vec overrightarrow hat bar tilde underbrace overbrace sqrt mathbin
+""".split())
+LATEX_COMMAND_PATTERN = re.compile(r'\\([a-zA-Z]+)')
+SEARCH_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+def get_file_size_str(size_bytes: int) -> str:
+    """Retourne la taille formatée (KB/MB)."""
     if size_bytes < 1024 * 1024:
         return f"{size_bytes / 1024:.1f} KB"
     return f"{size_bytes / (1024 * 1024):.1f} MB"
 
-def collect_decks_info() -> Dict[str, List[Dict[str, str]]]:
-    """Parcourt le dossier docs/ pour trouver les fichiers .apkg."""
+def load_apkg_meta() -> Dict[str, Dict[str, Any]]:
+    """Charge apkg_meta.json (nombre de cartes de chaque .apkg)."""
+    meta_path = OUTPUT_DIR / 'apkg_meta.json'
+    if not meta_path.exists():
+        return {}
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def load_preview_manifest(filename: str) -> Optional[Dict[str, Any]]:
+    """Manifeste de l'aperçu d'un .apkg (None s'il est absent ou au format d'avant la pagination)."""
+    manifest_path = OUTPUT_DIR / 'previews' / filename.replace('.apkg', '.json')
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+def build_deck_info(filepath: Path, card_count: int,
+                    preview: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, Any]]:
+    """(matière, entrée de decks.json) d'un fichier .apkg de docs/."""
+    base_name = filepath.stem
+    
+    # Parse subject from filename "Subject-Title.apkg"
+    if '-' in base_name:
+        parts = base_name.split('-', 1)
+        subject = parts[0].capitalize()
+        title = parts[1].replace('_', ' ')
+    else:
+        subject = "Autres"
+        title = base_name.replace('_', ' ')
+    
+    file_stat = filepath.stat()
+    return subject, {
+        'name': title,
+        'filename': filepath.name,
+        'size': get_file_size_str(file_stat.st_size),
+        'date': date.fromtimestamp(file_stat.st_mtime).strftime("%d/%m/%Y"),
+        'url': quote(filepath.name),
+        'cards': card_count,
+        # Current (content-hashed) preview pages, embedded in decks.html
+        'preview': preview or load_preview_manifest(filepath.name)
+    }
+
+def collect_decks_info(apkg_meta: Optional[Dict[str, Dict[str, Any]]] = None,
+                       previews: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Liste les fichiers .apkg de docs/ par matière.
+    Avec apkg_meta (transmis en mémoire par le build), seuls ses paquets sont listés
+    et ni docs/ ni apkg_meta.json ne sont relus ; de même pour les manifestes d'aperçu de previews.
+    """
+    previews = previews or {}
     decks_by_subject = {}
     
     if not OUTPUT_DIR.exists():
         print(f"❌ Dossier introuvable : {OUTPUT_DIR}")
         return {}
 
-    meta_path = OUTPUT_DIR / 'apkg_meta.json'
-    apkg_meta = {}
-    if meta_path.exists():
-        with open(meta_path, 'r', encoding='utf-8') as f:
-            apkg_meta = json.load(f)
-
-    apkg_files = sorted(OUTPUT_DIR.glob("*.apkg"))
+    if apkg_meta is None:
+        apkg_meta = load_apkg_meta()
+        apkg_files = sorted(OUTPUT_DIR.glob("*.apkg"))
+    else:
+        apkg_files = sorted(OUTPUT_DIR / filename for filename in apkg_meta)
     print(f"🔍 Fichiers .apkg trouvés : {len(apkg_files)}")
     
     for filepath in apkg_files:
-        filename = filepath.name
-        base_name = filepath.stem
-        
-        # Parse subject from filename "Subject-Title.apkg"
-        if '-' in base_name:
-            parts = base_name.split('-', 1)
-            subject = parts[0].capitalize()
-            title = parts[1].replace('_', ' ')
-        else:
-            subject = "Autres"
-            title = base_name.replace('_', ' ')
-            
-        if subject not in decks_by_subject:
-            decks_by_subject[subject] = []
-            
-        card_count = apkg_meta.get(filename, {}).get('cards', 0)
-        
-        deck_info = {
-            'name': title,
-            'filename': filename,
-            'size': get_file_size_str(filepath),
-            'date': date.fromtimestamp(filepath.stat().st_mtime).strftime("%d/%m/%Y"),
-            'url': quote(filename),
-            'cards': card_count
-        }
-        
-        decks_by_subject[subject].append(deck_info)
-        print(f"   ✅ {subject} : {title} ({deck_info['size']}, {card_count} cartes)")
+        card_count = apkg_meta.get(filepath.name, {}).get('cards', 0)
+        subject, deck_info = build_deck_info(filepath, card_count, previews.get(filepath.name))
+        decks_by_subject.setdefault(subject, []).append(deck_info)
+        print(f"   ✅ {subject} : {deck_info['name']} ({deck_info['size']}, {card_count} cartes)")
         
     return decks_by_subject
 
+def update_deck_info(data: Dict[str, List[Dict[str, Any]]], filename: str, card_count: Optional[int],
+                     preview: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Remplace sur place l'entrée d'un .apkg dans data (decks par matière, comme collect_decks_info),
+    sans relire les autres paquets. Sans card_count, l'entrée est retirée (deck supprimé).
+    """
+    for subject in list(data):
+        data[subject] = [deck for deck in data[subject] if deck['filename'] != filename]
+        if not data[subject]:
+            del data[subject]
+    if card_count is not None:
+        subject, deck_info = build_deck_info(OUTPUT_DIR / filename, card_count, preview)
+        data.setdefault(subject, []).append(deck_info)
+        data[subject].sort(key=lambda deck: deck['filename'])
+    # Same order as collect_decks_info: subjects by their first file name
+    ordered = sorted(data.items(), key=lambda item: item[1][0]['filename'])
+    data.clear()
+    data.update(ordered)
+
+def search_tokens(text: str) -> List[str]:
+    """Mots indexés d'un champ : sans HTML ni mise en forme LaTeX, sans accents, sans mots vides."""
+    text = html.unescape(HTML_TAG_PATTERN.sub(' ', text))
+    text = LATEX_COMMAND_PATTERN.sub(lambda m: ' ' if m.group(1) in LATEX_NOISE else f' {m.group(1)} ', text)
+    return [token for token in SEARCH_TOKEN_PATTERN.findall(fold_accents(text))
+            if len(token) >= SEARCH_MIN_TOKEN and token not in SEARCH_STOPWORDS]
+
+def build_search_index(decks: Iterable[Tuple[str, Iterable[Tuple[str, str]]]]) -> Tuple[Dict[str, Any], Dict[str, Dict[str, List[int]]]]:
+    """
+    Index inversé des cartes : (méta-données, shards).
+    Les cartes sont numérotées à la suite, deck après deck, dans l'ordre des aperçus ;
+    chaque shard associe les mots d'un même préfixe aux numéros triés des cartes qui les contiennent.
+    """
+    deck_ids = []
+    offsets = [0]
+    postings: Dict[str, Dict[str, List[int]]] = defaultdict(dict)
+    card_id = 0
+    for deck_id, cards in decks:
+        for front, back in cards:
+            for token in set(search_tokens(front) + search_tokens(back)):
+                postings[token[:SEARCH_SHARD_PREFIX]].setdefault(token, []).append(card_id)
+            card_id += 1
+        deck_ids.append(deck_id)
+        offsets.append(card_id)
+
+    meta = {
+        'decks': deck_ids,
+        # Cards of deck i are numbered offsets[i] to offsets[i + 1] - 1
+        'offsets': offsets,
+        'prefix': SEARCH_SHARD_PREFIX,
+        'min_token': SEARCH_MIN_TOKEN,
+        'stopwords': sorted(SEARCH_STOPWORDS),
+    }
+    shards = {prefix: dict(sorted(tokens.items())) for prefix, tokens in sorted(postings.items())}
+    return meta, shards
+
+def write_hashed_json(directory: Path, stem: str, data: Any) -> str:
+    """Écrit un JSON sous un nom dérivé de son contenu et retourne ce nom."""
+    content = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    name = f"{stem}.{hashlib.sha256(content).hexdigest()[:SEARCH_HASH_LENGTH]}.json"
+    path = directory / name
+    if not path.exists():
+        path.write_bytes(content)
+        instrumentation.add_bytes(written=len(content))
+    return name
+
+def save_search_index(data: Dict[str, List[Dict[str, str]]]) -> Optional[str]:
+    """
+    Génère l'index de recherche plein texte des decks publiés (docs/search) à partir du
+    catalogue des cartes, et retourne l'URL de ses méta-données (relative à docs/).
+    """
+    conn = catalog.open_catalog()
+    csv_by_filename = {}
+    for csv_path, subject in catalog.deck_subjects(conn).items():
+        _, output_filename, _ = generate_apkg.get_deck_names(os.path.join(catalog.DECKS_DIR, csv_path), subject)
+        csv_by_filename[output_filename] = csv_path
+
+    decks = []
+    for deck_list in data.values():
+        for deck in deck_list:
+            csv_path = csv_by_filename.get(deck['filename'])
+            if csv_path is None:
+                continue
+            cards = [(front, back) for _, _, front, back in catalog.iter_catalog_cards(conn, csv_path)]
+            # Same id as the deck card in decks.html
+            decks.append((f"deck-{deck['url'].replace('.apkg', '')}", cards))
+    meta, shards = build_search_index(decks)
+    conn.close()
+
+    try:
+        SEARCH_DIR.mkdir(parents=True, exist_ok=True)
+        meta['shards'] = {prefix: write_hashed_json(SEARCH_DIR, prefix, shard) for prefix, shard in shards.items()}
+        meta_name = write_hashed_json(SEARCH_DIR, 'meta', meta)
+        # Files of previous builds
+        current = set(meta['shards'].values()) | {meta_name}
+        for path in SEARCH_DIR.glob('*.json'):
+            if path.name not in current:
+                path.unlink()
+    except Exception as e:
+        print(f"❌ Erreur index de recherche : {e}")
+        return None
+    token_count = sum(len(shard) for shard in shards.values())
+    print(f"✅ Index de recherche créé : {meta['offsets'][-1]} cartes, {token_count} mots, {len(shards)} shards")
+    return f"search/{meta_name}"
+
 def save_json(data: Dict[str, List[Dict[str, str]]]) -> None:
     """Sauvegarde les données dans decks.json."""
     json_path = OUTPUT_DIR / 'decks.json'
     try:
         with open(json_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+            instrumentation.add_bytes(written=f.tell())
         print(f"✅ JSON créé : {json_path.name}")
     except Exception as e:
         print(f"❌ Erreur JSON : {e}")
@@ -117,16 +275,20 @@ def save_sitemap(data: Dict[str, List[Dict[str, str]]]) -> None:
     try:
         with open(sitemap_path, 'w', encoding='utf-8') as f:
             f.write('\n'.join(xml_lines))
+            instrumentation.add_bytes(written=f.tell())
         print(f"✅ Sitemap créé : {sitemap_path.name}")
     except Exception as e:
         print(f"❌ Erreur Sitemap : {e}")
 
-def save_html(data: Dict[str, List[Dict[str, str]]]) -> None:
+def save_html(data: Dict[str, List[Dict[str, str]]], search_index_url: Optional[str] = None) -> None:
     """Génère et sauvegarde le fichier decks.html via Jinja2."""
     total_decks = sum(len(d) for d in data.values()) if data else 0
     total_subjects = len(data) if data else 0
     total_cards = sum(deck.get('cards', 0) for d in data.values() for deck in d) if data else 0
     
+    # Imported here: only this stage of the build needs Jinja2
+    from jinja2 import Environment, FileSystemLoader
+    
     env = Environment(loader=FileSystemLoader(str(SCRIPT_PATH.parent / 'templates')))
     template = env.get_template('decks_template.html')
     
@@ -134,18 +296,21 @@ def save_html(data: Dict[str, List[Dict[str, str]]]) -> None:
         data=data,
         total_decks=total_decks,
         total_subjects=total_subjects,
-        total_cards=total_cards
+        total_cards=total_cards,
+        search_index_url=search_index_url
     )
     
     html_path = OUTPUT_DIR / 'decks.html'
     try:
         with open(html_path, 'w', encoding='utf-8') as f:
             f.write(html_content)
+            instrumentation.add_bytes(written=f.tell())
         print(f"✅ HTML créé : {html_path.name}")
     except Exception as e:
         print(f"❌ Erreur HTML : {e}")
 
-def main() -> None:
+def generate_all() -> None:
+    """Génère l'index de recherche, decks.json, decks.html et sitemap.xml."""
     print("="*60)
     print("📊 GÉNÉRATION INDEX DECKS")
     print("="*60)
@@ -153,14 +318,27 @@ def main() -> None:
     if not OUTPUT_DIR.exists():
         OUTPUT_DIR.mkdir(parents=True)
         
-    decks = collect_decks_info()
+    with instrumentation.stage('collect'):
+        decks = collect_decks_info()
     
-    save_json(decks)
-    save_html(decks)
-    save_sitemap(decks)
+    with instrumentation.stage('search'):
+        search_index_url = save_search_index(decks)
+    with instrumentation.stage('json'):
+        save_json(decks)
+    with instrumentation.stage('html'):
+        save_html(decks, search_index_url)
+    with instrumentation.stage('sitemap'):
+        save_sitemap(decks)
     
     print("\n" + "="*60)
     print("Terminé.")
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Met à jour l'index du site : recherche, decks.json, decks.html et sitemap.")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session("generate_index", args):
+        generate_all()
+
 if __name__ == "__main__":
     main()
@@ -1,13 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import csv
+import argparse
+import json
 import os
-import re
-import sys
 import base64
-from typing import List, Dict, Any, Optional
-from utils import anki_connect_request
+from typing import Callable, List, Dict, Any, Optional, Tuple
+from utils import AnkiConnectClient, AnkiConnectError, build_media_index, resolve_media, file_sha256
+from cards import iter_cards, clean_media_paths
+from catalog import open_catalog, deck_card_counts
+import instrumentation
 
 # --- CONFIGURATION ---
 SCRIPT_PATH = os.path.realpath(__file__)
@@ -16,10 +18,12 @@ BASE_DIR = os.path.dirname(SCRIPT_DIR)
 
 DECKS_DIR = os.path.join(BASE_DIR, "decks")
 MEDIA_DIR = os.path.join(BASE_DIR, "media")
+# Content of the media sent to Anki (name -> sha256): an image edited under the same name is sent again
+UPLOADED_MEDIA_PATH = os.path.join(BASE_DIR, ".cache", "anki_media.json")
 
-def get_anki_model() -> Optional[str]:
+def get_anki_model(client: AnkiConnectClient) -> Optional[str]:
     """Récupère le premier modèle disponible."""
-    response = anki_connect_request("modelNames")
+    response = client.request("modelNames")
     if not response:
         return None
         
@@ -33,9 +37,9 @@ def get_anki_model() -> Optional[str]:
     print(f"  📋 Utilisation du modèle : {chosen}")
     return chosen
 
-def get_model_fields(model_name: str) -> Optional[List[str]]:
+def get_model_fields(client: AnkiConnectClient, model_name: str) -> Optional[List[str]]:
     """Récupère les champs du modèle."""
-    response = anki_connect_request("modelFieldNames", modelName=model_name)
+    response = client.request("modelFieldNames", modelName=model_name)
     if not response:
         return None
         
@@ -47,124 +51,316 @@ def get_model_fields(model_name: str) -> Optional[List[str]]:
     print(f"  ❌ Impossible de récupérer les champs de {model_name}")
     return None
 
-def store_media_file(filename: str, subfolder: str) -> bool:
-    """Envoie un fichier média à Anki."""
-    # Check in subfolder first, then root
-    filepath = os.path.join(MEDIA_DIR, subfolder, filename)
-    if not os.path.exists(filepath):
-        filepath = os.path.join(MEDIA_DIR, filename)
-        if not os.path.exists(filepath):
-            return False
-            
+def load_uploaded_media() -> Dict[str, str]:
+    """Charge l'empreinte des médias déjà envoyés à Anki (vide si le fichier est absent ou illisible)."""
+    try:
+        with open(UPLOADED_MEDIA_PATH, 'r', encoding='utf-8') as f:
+            uploaded = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return uploaded if isinstance(uploaded, dict) else {}
+
+def save_uploaded_media(known_media: Dict[str, str]) -> None:
+    """Enregistre l'empreinte des médias présents dans Anki, pour le prochain import."""
+    try:
+        os.makedirs(os.path.dirname(UPLOADED_MEDIA_PATH), exist_ok=True)
+        with open(UPLOADED_MEDIA_PATH, 'w', encoding='utf-8') as f:
+            json.dump(known_media, f, ensure_ascii=False, indent=2, sort_keys=True)
+    except OSError as e:
+        print(f"  ⚠️  Erreur sauvegarde de la liste des médias envoyés : {e}")
+
+def get_existing_media(client: AnkiConnectClient) -> Dict[str, str]:
+    """
+    Récupère en une requête les médias déjà présents dans la collection Anki, avec l'empreinte
+    du fichier envoyé par un import précédent. Un média présent dont le contenu est inconnu est omis
+    (il sera renvoyé, comme un média absent).
+    """
+    try:
+        names = set(client.invoke("getMediaFilesNames", pattern="*"))
+    except (AnkiConnectError, ValueError) as e:
+        print(f"  ⚠️  Liste des médias Anki indisponible, envoi de toutes les images : {e}")
+        return {}
+    return {name: digest for name, digest in load_uploaded_media().items() if name in names}
+
+def store_media_action(filepath: str, send_path: bool) -> Optional[Dict[str, Any]]:
+    """
+    Prépare l'envoi d'un fichier média à Anki (action storeMediaFile).
+    Anki tourne sur la même machine : on lui donne le chemin du fichier,
+    sans le lire ni l'encoder en base64 en mémoire.
+    """
+    filename = os.path.basename(filepath)
+    if send_path:
+        return AnkiConnectClient.make_action("storeMediaFile", filename=filename, path=os.path.abspath(filepath))
+        
     try:
         with open(filepath, 'rb') as f:
             data = base64.b64encode(f.read()).decode('utf-8')
-            
-        anki_connect_request("storeMediaFile", filename=filename, data=data)
-        return True
-    except Exception:
-        return False
+    except OSError:
+        return None
+        
+    return AnkiConnectClient.make_action("storeMediaFile", filename=filename, data=data)
 
-def process_text_images(text: str, subfolder: str) -> str:
+def media_upload_actions(client: AnkiConnectClient, media_names: List[str], subfolder: str,
+                         media_index: Dict[str, List[str]],
+                         known_media: Dict[str, str]) -> Tuple[List[Tuple[str, str]], List[Dict[str, Any]]]:
     """
-    1. Trouve les images src="..." dans le texte.
-    2. Les envoie à Anki.
-    3. Retroune le texte avec les chemins corrigés pour Anki (src="image.jpg").
+    Prépare l'envoi des images absentes de la collection Anki ou modifiées depuis leur envoi :
+    ((nom, sha256), actions storeMediaFile).
+    known_media n'est complété qu'après l'envoi (record_stored_media) : une image dont l'envoi
+    échoue sera proposée de nouveau par le deck suivant.
     """
-    # Clean quotes
-    text = text.replace('""', '"')
+    send_path = client.host in ("localhost", "127.0.0.1", "::1")
+    subfolder_dir = os.path.join(MEDIA_DIR, subfolder)
+    sent = []
+    actions = []
     
-    # Extract images
-    # Supports <img src="../media/sub/image.jpg"> and src="image.jpg"
-    matches = re.findall(r'src="([^"]+)"', text)
-    
-    for match in matches:
-        if match.startswith('http'):
+    for media_name in media_names:
+        filepath = resolve_media(media_index, media_name, subfolder_dir)
+        if not filepath:
+            print(f"   ⚠️  Image manquante : {media_name} (introuvable dans media/)")
+            continue
+        digest = file_sha256(filepath)
+        if known_media.get(media_name) == digest:
+            instrumentation.count('media_already_in_anki')
             continue
+        action = store_media_action(filepath, send_path)
+        if action:
+            sent.append((media_name, digest))
+            actions.append(action)
             
-        filename = os.path.basename(match)
-        store_media_file(filename, subfolder)
-        
-    # Fix paths for Anki: src="../media/sub/image.jpg" -> src="image.jpg"
-    text = re.sub(r'src="[^"]*/([^"/]+)"', r'src="\1"', text)
-    
-    return text
+    return sent, actions
 
-def parse_csv_file(csv_path: str, deck_name: str, subfolder: str, model_name: str, fields: List[str]) -> List[Dict[str, Any]]:
-    """Lit le CSV et retourne une liste de notes pour Anki."""
+def record_stored_media(sent: List[Tuple[str, str]], responses: Optional[List[Dict[str, Any]]], start: int,
+                        known_media: Dict[str, str]) -> int:
+    """
+    Ajoute à known_media les images dont l'action storeMediaFile a réussi (réponses du multi
+    à partir de l'indice start, dans l'ordre de sent) et retourne leur nombre.
+    """
+    if responses is None:
+        return 0
+    stored = 0
+    for (media_name, digest), response in zip(sent, responses[start:start + len(sent)]):
+        if response["error"] is None:
+            known_media[media_name] = digest
+            stored += 1
+    return stored
+
+def parse_csv_file(csv_path: str, deck_name: str, model_name: str,
+                   fields: List[str]) -> Optional[Tuple[List[Dict[str, Any]], List[str]]]:
+    """
+    Lit le CSV et retourne la liste des notes pour Anki et les images référencées,
+    ou None si le CSV est illisible (rien ne doit alors être envoyé, ni supprimé).
+    """
     notes = []
+    # dict keeps insertion order and dedups images referenced several times
+    media_names: Dict[str, None] = {}
     
     try:
-        with open(csv_path, 'r', encoding='utf-8-sig') as f:
-            reader = csv.reader(f, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-            
-            for row in reader:
-                if len(row) < 2: 
-                    continue
-                    
-                front = row[0].strip()
-                back = row[1].strip()
-                tags = row[2].strip().split() if len(row) > 2 else []
+        for card in iter_cards(csv_path):
+            for ref in card.media_refs:
+                media_names[os.path.basename(ref)] = None
                 
-                # Process images
-                front = process_text_images(front, subfolder)
-                back = process_text_images(back, subfolder)
-                
-                if not front and not back:
-                    continue
-                    
-                note = {
-                    "deckName": deck_name,
-                    "modelName": model_name,
-                    "fields": {
-                        fields[0]: front,
-                        fields[1]: back
-                    },
-                    "tags": tags,
-                    "options": {
-                        "allowDuplicate": False,
-                        "duplicateScope": "deck"
-                    }
+            # Fix paths for Anki: src="../media/sub/image.jpg" -> src="image.jpg"
+            note = {
+                "deckName": deck_name,
+                "modelName": model_name,
+                "fields": {
+                    fields[0]: clean_media_paths(card.front),
+                    fields[1]: clean_media_paths(card.back)
+                },
+                "tags": card.tags,
+                "options": {
+                    "allowDuplicate": False,
+                    "duplicateScope": "deck"
                 }
-                notes.append(note)
+            }
+            notes.append(note)
                 
     except Exception as e:
         print(f"    ❌ Erreur CSV {os.path.basename(csv_path)}: {e}")
-        return []
+        return None
         
-    return notes
+    return notes, list(media_names)
 
-def import_file(csv_path: str, model_name: str, field_names: List[str]) -> None:
-    """Importe un fichier CSV spécifique."""
+def get_deck_target(csv_path: str) -> Tuple[str, str]:
+    """Retourne le nom du deck Anki et le sous-dossier média supposé d'un CSV."""
     filename = os.path.basename(csv_path)
     deck_name = filename.replace('.csv', '').replace('-', '::').replace('_', ' ')
     
     # Guess media subfolder from filename
     subfolder = filename.replace('.csv', '').lower().replace(" ", "_").replace("-", "_")
+    return deck_name, subfolder
+
+def import_file(client: AnkiConnectClient, csv_path: str, model_name: str, field_names: List[str],
+                media_index: Dict[str, List[str]], known_media: Dict[str, str]) -> None:
+    """Importe un fichier CSV spécifique."""
+    filename = os.path.basename(csv_path)
+    deck_name, subfolder = get_deck_target(csv_path)
     
     print(f"\n📥 Import de '{filename}' vers '{deck_name}'...")
     
-    # Create deck if needed
-    anki_connect_request("createDeck", deck=deck_name)
+    with instrumentation.stage('parse'):
+        parsed = parse_csv_file(csv_path, deck_name, model_name, field_names)
+    if parsed is None:
+        return
+    notes, media_names = parsed
+    
+    # Deck creation, media and notes go through batched `multi` calls
+    actions = [AnkiConnectClient.make_action("createDeck", deck=deck_name)]
+    with instrumentation.stage('media'):
+        sent_media, media_actions = media_upload_actions(client, media_names, subfolder, media_index, known_media)
+    actions.extend(media_actions)
+    if notes:
+        actions.append(AnkiConnectClient.make_action("addNotes", notes=notes))
     
-    notes = parse_csv_file(csv_path, deck_name, subfolder, model_name, field_names)
+    with instrumentation.stage('anki'):
+        responses = client.multi(actions)
+    # Media actions follow createDeck
+    stored = record_stored_media(sent_media, responses, 1, known_media)
     
+    if media_names:
+        print(f"   🖼️  {stored} image(s) envoyée(s), {len(media_names) - len(media_actions)} déjà présente(s).")
+        if stored < len(media_actions):
+            print(f"   ⚠️  {len(media_actions) - stored} image(s) non envoyée(s), nouvel essai au prochain deck.")
     if notes:
-        response = anki_connect_request("addNotes", notes=notes)
-        added = len([r for r in response.get("result", []) if r is not None]) if response else 0
+        # addNotes is the last action; it reports an error when every note is a duplicate
+        results = (responses[-1]["result"] or []) if responses else []
+        added = len([r for r in results if r is not None])
         print(f"   ✅ {added} cartes importées.")
     else:
         print("   ⚠️  Aucune carte importée.")
 
-def interactive_mode(model_name: str, field_names: List[str]) -> None:
+def fetch_deck_notes(client: AnkiConnectClient, deck_name: str) -> Optional[List[Dict[str, Any]]]:
+    """Récupère en bloc les notes existantes du deck (recto, verso, tags)."""
+    find_notes = client.request("findNotes", query=f'"deck:{deck_name}"')
+    if find_notes is None:
+        return None
+    if not find_notes["result"]:
+        return []
+        
+    notes_info = client.request("notesInfo", notes=find_notes["result"])
+    if notes_info is None:
+        return None
+        
+    existing = []
+    for note in notes_info["result"]:
+        # Fields keep the model order whatever their names
+        values = [f["value"] for f in sorted(note["fields"].values(), key=lambda f: f["order"])]
+        if len(values) < 2:
+            continue
+        existing.append({"id": note["noteId"], "front": values[0], "back": values[1], "tags": note["tags"]})
+    return existing
+
+def sync_file(client: AnkiConnectClient, csv_path: str, model_name: str, field_names: List[str],
+              media_index: Dict[str, List[str]], known_media: Dict[str, str], delete: bool = False) -> None:
+    """
+    Synchronise un CSV avec son deck : seules les notes nouvelles ou modifiées sont envoyées.
+    Les notes sont appariées par leur recto ; avec delete, celles absentes du CSV sont supprimées.
+    """
+    filename = os.path.basename(csv_path)
+    deck_name, subfolder = get_deck_target(csv_path)
+    
+    print(f"\n🔄 Synchronisation de '{filename}' avec '{deck_name}'...")
+    
+    with instrumentation.stage('parse'):
+        parsed = parse_csv_file(csv_path, deck_name, model_name, field_names)
+    if parsed is None:
+        # A CSV read halfway would make every note of the deck look stale
+        print("   ❌ Synchronisation annulée, aucune note modifiée ni supprimée.")
+        return
+    notes, media_names = parsed
+    with instrumentation.stage('fetch'):
+        existing = fetch_deck_notes(client, deck_name)
+    if existing is None:
+        return
+        
+    existing_by_front: Dict[str, List[Dict[str, Any]]] = {}
+    for note in existing:
+        existing_by_front.setdefault(note["front"], []).append(note)
+        
+    to_add = []
+    duplicates = []
+    seen_fronts = set()
+    actions = [AnkiConnectClient.make_action("createDeck", deck=deck_name)]
+    # Indices in actions of the updates of each modified note
+    updates: List[List[int]] = []
+    unchanged = 0
+    
+    for note in notes:
+        front = note["fields"][field_names[0]]
+        back = note["fields"][field_names[1]]
+        seen = front in seen_fronts
+        seen_fronts.add(front)
+        candidates = existing_by_front.get(front)
+        if not candidates:
+            # addNotes would reject it as a duplicate of the previous row
+            if seen:
+                duplicates.append(front)
+            else:
+                to_add.append(note)
+            continue
+            
+        current = candidates.pop(0)
+        if (back, sorted(note["tags"])) == (current["back"], sorted(current["tags"])):
+            unchanged += 1
+            continue
+            
+        indices = []
+        if back != current["back"]:
+            indices.append(len(actions))
+            actions.append(AnkiConnectClient.make_action(
+                "updateNoteFields", note={"id": current["id"], "fields": {field_names[1]: back}}))
+        if sorted(note["tags"]) != sorted(current["tags"]):
+            indices.append(len(actions))
+            actions.append(AnkiConnectClient.make_action("updateNoteTags", note=current["id"], tags=note["tags"]))
+        updates.append(indices)
+            
+    stale_ids = [note["id"] for candidates in existing_by_front.values() for note in candidates]
+    instrumentation.count('notes_unchanged', unchanged)
+    for front in duplicates:
+        print(f"   ⚠️  Recto en double dans le CSV, ligne non ajoutée : {front[:60]}")
+    
+    with instrumentation.stage('media'):
+        sent_media, media_actions = media_upload_actions(client, media_names, subfolder, media_index, known_media)
+    media_start = len(actions)
+    actions.extend(media_actions)
+    add_index = delete_index = None
+    if to_add:
+        add_index = len(actions)
+        actions.append(AnkiConnectClient.make_action("addNotes", notes=to_add))
+    if delete and stale_ids:
+        delete_index = len(actions)
+        actions.append(AnkiConnectClient.make_action("deleteNotes", notes=stale_ids))
+        
+    with instrumentation.stage('anki'):
+        responses = client.multi(actions)
+    record_stored_media(sent_media, responses, media_start, known_media)
+    if responses is None:
+        return
+        
+    errors = [r["error"] for r in responses if r["error"] is not None]
+    for error in errors:
+        print(f"   ⚠️  {error}")
+        
+    # Counts of what Anki actually did, not of what was sent
+    added = 0
+    if add_index is not None and responses[add_index]["error"] is None:
+        added = len([r for r in responses[add_index]["result"] or [] if r is not None])
+    updated = len([indices for indices in updates if all(responses[i]["error"] is None for i in indices)])
+    deleted = len(stale_ids) if delete_index is not None and responses[delete_index]["error"] is None else 0
+    print(f"   ✅ +{added} ajoutée(s), ~{updated} modifiée(s), -{deleted} supprimée(s), ={unchanged} inchangée(s).")
+    failed = (len(to_add) - added) + (len(updates) - updated) + (len(stale_ids) - deleted if delete else 0)
+    if failed:
+        print(f"   ⚠️  {failed} note(s) non synchronisée(s).")
+    if stale_ids and not delete:
+        print(f"   ℹ️  {len(stale_ids)} note(s) absente(s) du CSV conservée(s) (--delete pour les supprimer).")
+
+def interactive_mode(process_file: Callable[[str], None]) -> None:
     """Mode interactif pour choisir les fichiers."""
-    csv_files = []
-    for root, _, files in os.walk(DECKS_DIR):
-        for f in files:
-            if f.endswith('.csv'):
-                csv_files.append(os.path.join(root, f))
-                
-    csv_files.sort()
+    conn = open_catalog(decks_dir=DECKS_DIR)
+    card_counts = deck_card_counts(conn)
+    conn.close()
+    csv_files = [os.path.join(DECKS_DIR, *rel_path.split('/')) for rel_path in card_counts]
     
     if not csv_files:
         print(f"\n❌ Aucun fichier CSV trouvé dans {DECKS_DIR}")
@@ -172,9 +368,8 @@ def interactive_mode(model_name: str, field_names: List[str]) -> None:
 
     print("\n--- FICHIERS DISPONIBLES ---")
     pad = len(str(len(csv_files)))
-    for i, path in enumerate(csv_files):
-        rel_path = os.path.relpath(path, DECKS_DIR)
-        print(f"[{str(i).zfill(pad)}] {rel_path}")
+    for i, rel_path in enumerate(card_counts):
+        print(f"[{str(i).zfill(pad)}] {rel_path} ({card_counts[rel_path]} cartes)")
         
     selection = input("\nEntrez les numéros (ex: 1, 3) ou 'all' : ")
     
@@ -191,31 +386,63 @@ def interactive_mode(model_name: str, field_names: List[str]) -> None:
 
     print(f"\n🚀 Début de l'import pour {len(to_import)} fichier(s)...\n")
     for path in to_import:
-        import_file(path, model_name, field_names)
+        process_file(path)
 
-def main() -> None:
-    # Check connection
-    if not anki_connect_request("version"):
-        print("\n❌ AnkiConnect n'est pas accessible. Lancez Anki.")
-        return
-
-    model = get_anki_model()
-    if not model: return
+def run_import(args: argparse.Namespace) -> None:
+    """Importe le CSV demandé, ou ceux choisis interactivement."""
+    client = AnkiConnectClient(timeout=args.timeout)
     
-    fields = get_model_fields(model)
-    if not fields or len(fields) < 2:
-        print("❌ Le modèle doit avoir au moins 2 champs.")
-        return
+    with instrumentation.stage('connect'):
+        # Check connection
+        if not client.request("version"):
+            print("\n❌ AnkiConnect n'est pas accessible. Lancez Anki.")
+            return
+
+        model = get_anki_model(client)
+        if not model: return
+        
+        fields = get_model_fields(client, model)
+        if not fields or len(fields) < 2:
+            print("❌ Le modèle doit avoir au moins 2 champs.")
+            return
+
+    # Built once per run: repo media by name, and media Anki already has
+    with instrumentation.stage('media_index'):
+        media_index = build_media_index(MEDIA_DIR)
+        known_media = get_existing_media(client)
+
+    def process_file(path: str) -> None:
+        with instrumentation.stage('decks'), instrumentation.deck(os.path.basename(path)):
+            if args.sync:
+                sync_file(client, path, model, fields, media_index, known_media, args.delete)
+            else:
+                import_file(client, path, model, fields, media_index, known_media)
 
     # Check CLI args
-    if len(sys.argv) > 1:
-        file_path = sys.argv[1]
-        if os.path.exists(file_path):
-            import_file(file_path, model, fields)
+    if args.file:
+        if os.path.exists(args.file):
+            process_file(args.file)
         else:
-            print(f"❌ Fichier introuvable : {file_path}")
+            print(f"❌ Fichier introuvable : {args.file}")
     else:
-        interactive_mode(model, fields)
+        interactive_mode(process_file)
+        
+    save_uploaded_media(known_media)
+    client.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Importe les CSV du dépôt dans Anki.")
+    parser.add_argument("file", nargs="?", help="CSV à importer (sinon, choix interactif)")
+    parser.add_argument("--sync", action="store_true",
+                        help="N'envoie que les notes nouvelles ou modifiées (comparaison avec le deck existant)")
+    parser.add_argument("--delete", action="store_true",
+                        help="Avec --sync, supprime les notes du deck absentes du CSV")
+    parser.add_argument("--timeout", type=float, default=30.0,
+                        help="Délai d'attente des requêtes AnkiConnect, en secondes (défaut : 30)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.session("imports_decks", args):
+        run_import(args)
 
 if __name__ == "__main__":
     main()
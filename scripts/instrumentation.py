@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Instrumentation des scripts, activée à la demande (--report, --cprofile, --budget) :
+durée de chaque étape et de chaque deck, octets lus et écrits, allers-retours AnkiConnect
+et succès de cache, enregistrés dans un rapport JSON. Désactivée, chaque appel se limite
+à un test.
+
+Les étapes s'imbriquent : une étape "genanki" ouverte pendant "package" est rapportée
+sous "package/genanki". Les processus de travail mesurent leur deck avec collect() et
+le processus principal ajoute le résultat à l'étape en cours avec merge().
+
+Un fichier de budget donne la durée maximale de certaines étapes (et "total") :
+    {"package": 120, "package/genanki": 90, "total": 300}
+Le script échoue (code 1) si l'une d'elles est dépassée.
+"""
+
+import argparse
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+
+# Bump when the layout of the report changes
+REPORT_VERSION = 1
+
+def new_stage_entry() -> Dict[str, Any]:
+    return {'seconds': 0.0, 'calls': 0, 'bytes_read': 0, 'bytes_written': 0, 'counters': Counter()}
+
+class Recorder:
+    """Mesures d'un processus : étapes (par chemin), decks par étape, octets et compteurs totaux."""
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.decks: Dict[str, Dict[str, float]] = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+        # Stages opened by the main thread; other threads (export --jobs) report into them
+        self._main_path: List[str] = []
+        self._local = threading.local()
+
+    def _path(self) -> List[str]:
+        path = getattr(self._local, 'path', None)
+        return path if path is not None else self._main_path
+
+    def current_stage(self) -> Optional[str]:
+        path = self._path()
+        return path[-1] if path else None
+
+    def _stage_entry(self, name: str) -> Dict[str, Any]:
+        if name not in self.stages:
+            self.stages[name] = new_stage_entry()
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        parent = self._path()
+        full_name = f"{parent[-1]}/{name}" if parent else name
+        if threading.current_thread() is threading.main_thread():
+            path = self._main_path
+        else:
+            if getattr(self._local, 'path', None) is None:
+                self._local.path = list(parent)
+            path = self._local.path
+        path.append(full_name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            path.pop()
+            with self._lock:
+                entry = self._stage_entry(full_name)
+                entry['seconds'] += elapsed
+                entry['calls'] += 1
+
+    def add_bytes(self, read: int = 0, written: int = 0) -> None:
+        stage = self.current_stage()
+        with self._lock:
+            self.bytes_read += read
+            self.bytes_written += written
+            if stage is not None:
+                entry = self._stage_entry(stage)
+                entry['bytes_read'] += read
+                entry['bytes_written'] += written
+
+    def count(self, name: str, n: int = 1) -> None:
+        stage = self.current_stage()
+        with self._lock:
+            self.counters[name] += n
+            if stage is not None:
+                self._stage_entry(stage)['counters'][name] += n
+
+    def record_deck(self, deck: str, seconds: float) -> None:
+        stage = self.current_stage() or 'total'
+        with self._lock:
+            decks = self.decks.setdefault(stage, {})
+            decks[deck] = decks.get(deck, 0.0) + seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Mesures sous une forme transmissible entre processus (voir merge)."""
+        return {
+            'stages': {name: {**entry, 'counters': dict(entry['counters'])} for name, entry in self.stages.items()},
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'counters': dict(self.counters),
+        }
+
+    def merge(self, metrics: Dict[str, Any], deck: Optional[str] = None, seconds: Optional[float] = None) -> None:
+        """Ajoute les mesures d'un autre processus sous l'étape en cours (et la durée du deck)."""
+        parent = self.current_stage()
+        with self._lock:
+            self.bytes_read += metrics['bytes_read']
+            self.bytes_written += metrics['bytes_written']
+            self.counters.update(metrics['counters'])
+            if parent is not None:
+                entry = self._stage_entry(parent)
+                entry['bytes_read'] += metrics['bytes_read']
+                entry['bytes_written'] += metrics['bytes_written']
+                entry['counters'].update(metrics['counters'])
+            for name, values in metrics['stages'].items():
+                entry = self._stage_entry(f"{parent}/{name}" if parent else name)
+                for key in ('seconds', 'calls', 'bytes_read', 'bytes_written'):
+                    entry[key] += values[key]
+                entry['counters'].update(values['counters'])
+        if deck is not None and seconds is not None:
+            self.record_deck(deck, seconds)
+
+_recorder = Recorder()
+
+def is_enabled() -> bool:
+    return _recorder.enabled
+
+def enable() -> None:
+    """Active l'instrumentation du processus (mesures remises à zéro)."""
+    global _recorder
+    _recorder = Recorder(enabled=True)
+
+def disable() -> None:
+    global _recorder
+    _recorder = Recorder()
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Mesure une étape (imbriquée dans l'étape en cours, s'il y en a une)."""
+    if not _recorder.enabled:
+        yield
+        return
+    with _recorder.stage(name):
+        yield
+
+@contextlib.contextmanager
+def deck(name: str) -> Iterator[None]:
+    """Mesure la durée d'un deck dans l'étape en cours."""
+    if not _recorder.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _recorder.record_deck(name, time.perf_counter() - start)
+
+def add_bytes(read: int = 0, written: int = 0) -> None:
+    """Compte des octets lus ou écrits sur disque."""
+    if _recorder.enabled:
+        _recorder.add_bytes(read, written)
+
+def count(name: str, n: int = 1) -> None:
+    """Incrémente un compteur (allers-retours AnkiConnect, succès de cache...)."""
+    if _recorder.enabled:
+        _recorder.count(name, n)
+
+@contextlib.contextmanager
+def collect(enabled: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Mesure un traitement à part (typiquement un deck dans un processus de travail) :
+    le dictionnaire produit reçoit 'seconds' et les mesures à passer à merge().
+    """
+    global _recorder
+    metrics: Dict[str, Any] = {}
+    if not enabled:
+        yield metrics
+        return
+    previous = _recorder
+    _recorder = Recorder(enabled=True)
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics['seconds'] = time.perf_counter() - start
+        metrics.update(_recorder.snapshot())
+        _recorder = previous
+
+def merge(metrics: Dict[str, Any], deck: Optional[str] = None) -> None:
+    """Ajoute les mesures de collect() à l'étape en cours, avec la durée du deck."""
+    if _recorder.enabled and metrics:
+        _recorder.merge(metrics, deck, metrics.get('seconds'))
+
+def build_report(script: str, total_seconds: float) -> Dict[str, Any]:
+    """Rapport JSON des mesures du processus."""
+    snapshot = _recorder.snapshot()
+    return {
+        'version': REPORT_VERSION,
+        'script': script,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'argv': sys.argv[1:],
+        'total_seconds': round(total_seconds, 4),
+        'bytes_read': snapshot['bytes_read'],
+        'bytes_written': snapshot['bytes_written'],
+        'counters': dict(sorted(snapshot['counters'].items())),
+        'stages': {name: {**entry, 'seconds': round(entry['seconds'], 4),
+                          'counters': dict(sorted(entry['counters'].items()))}
+                   for name, entry in snapshot['stages'].items()},
+        'decks': {name: {deck: round(seconds, 4) for deck, seconds in sorted(decks.items())}
+                  for name, decks in _recorder.decks.items()},
+    }
+
+def check_budget(report: Dict[str, Any], budget: Dict[str, float]) -> List[str]:
+    """Étapes dont la durée dépasse le budget ("total" : durée du script), celles absentes du rapport sont ignorées."""
+    violations = []
+    for name, limit in budget.items():
+        if name == 'total':
+            seconds = report['total_seconds']
+        elif name in report['stages']:
+            seconds = report['stages'][name]['seconds']
+        else:
+            continue
+        if seconds > limit:
+            violations.append(f"{name} : {seconds:.2f} s > {limit:.2f} s")
+    return violations
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options d'instrumentation communes aux scripts."""
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument("--report", metavar="JSON",
+                       help="Enregistre la durée de chaque étape et de chaque deck, les octets lus et écrits "
+                            "et les compteurs (requêtes, cache) dans ce fichier JSON")
+    group.add_argument("--cprofile", metavar="FICHIER",
+                       help="Enregistre un profil cProfile du processus principal (à lire avec pstats)")
+    group.add_argument("--budget", metavar="JSON",
+                       help="Durées maximales par étape, en secondes : échoue si l'une est dépassée")
+
+@contextlib.contextmanager
+def session(script: str, args: argparse.Namespace) -> Iterator[None]:
+    """
+    Instrumente l'exécution d'un script selon ses options (voir add_arguments) :
+    rapport JSON, profil cProfile et vérification du budget à la fin.
+    """
+    if not (args.report or args.cprofile or args.budget):
+        yield
+        return
+
+    budget = None
+    if args.budget:
+        with open(args.budget, 'r', encoding='utf-8') as f:
+            budget = json.load(f)
+
+    enable()
+    profiler = cProfile.Profile() if args.cprofile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        total = time.perf_counter() - start
+        report = build_report(script, total)
+        if profiler is not None:
+            profiler.dump_stats(args.cprofile)
+            print(f"🔬 Profil cProfile : {args.cprofile}")
+        if args.report:
+            os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"⏱️ Rapport de durées : {args.report}")
+        disable()
+
+    if budget:
+        violations = check_budget(report, budget)
+        if violations:
+            print("❌ Budget de durée dépassé :")
+            for violation in violations:
+                print(f"   {violation}")
+            raise SystemExit(1)
+        print(f"✅ Budget de durée respecté ({len(budget)} limite(s))")
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Optimisation des images de media/ pour les .apkg et le site : réduction aux dimensions
+maximales et recompression, et variantes de tailles réduites pour les aperçus du site.
+Chaque image n'est traitée qu'une fois : le résultat est gardé dans .cache/media/<empreinte>/,
+l'empreinte couvrant l'image source et les réglages.
+Nécessite Pillow (optionnel) : sans lui, les images sont utilisées telles quelles.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
+from utils import file_sha256
+import instrumentation
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# --- CONFIGURATION ---
+SCRIPT_PATH = os.path.realpath(__file__)
+BASE_DIR = os.path.dirname(os.path.dirname(SCRIPT_PATH))
+MEDIA_CACHE_DIR = os.path.join(BASE_DIR, ".cache", "media")
+
+# Longest side of an optimized image, in pixels
+MAX_DIMENSION = 1600
+JPEG_QUALITY = 82
+# Bump when the processing changes so that every image is processed again
+OPTIMIZER_VERSION = 1
+
+OPTIMIZABLE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+# Widths of the preview variants (the preview card is at most 600 CSS px wide, 1200 for 2x screens)
+PREVIEW_WIDTHS = (400, 800, 1200)
+
+def is_available() -> bool:
+    """Indique si Pillow est installé."""
+    return Image is not None
+
+def get_settings_key(max_dimension: int, quality: int, **settings: Any) -> str:
+    """Réglages qui entrent dans l'empreinte d'une image produite."""
+    return json.dumps({'version': OPTIMIZER_VERSION, 'max': max_dimension, 'quality': quality, **settings},
+                      sort_keys=True)
+
+def get_cache_entry_dir(src_path: str, settings_key: str, cache_dir: Optional[str] = None) -> str:
+    """Dossier de cache des images produites à partir d'une source avec des réglages donnés."""
+    digest = hashlib.sha256(f"{file_sha256(src_path)}\n{settings_key}".encode('utf-8'))
+    return os.path.join(cache_dir or MEDIA_CACHE_DIR, digest.hexdigest())
+
+def get_cached_path(src_path: str, max_dimension: int = MAX_DIMENSION, quality: int = JPEG_QUALITY,
+                    cache_dir: Optional[str] = None) -> str:
+    """Chemin de la version optimisée d'une image dans le cache (même nom de fichier que la source)."""
+    entry_dir = get_cache_entry_dir(src_path, get_settings_key(max_dimension, quality), cache_dir)
+    return os.path.join(entry_dir, os.path.basename(src_path))
+
+def save_image(image: Any, dest_path: str, quality: int) -> None:
+    """Enregistre une image Pillow au format donné par l'extension de dest_path (PNG ou JPEG)."""
+    if dest_path.lower().endswith('.png'):
+        image.save(dest_path, format='PNG', optimize=True)
+    else:
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(dest_path, format='JPEG', quality=quality, optimize=True, progressive=True)
+
+def save_optimized(src_path: str, dest_path: str, max_dimension: int, quality: int) -> None:
+    """Redimensionne et recompresse une image vers dest_path."""
+    with Image.open(src_path) as image:
+        # Apply the EXIF orientation before the metadata is dropped
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        save_image(image, dest_path, quality)
+
+def optimize_image(src_path: str, max_dimension: int = MAX_DIMENSION, quality: int = JPEG_QUALITY,
+                   cache_dir: Optional[str] = None) -> str:
+    """
+    Retourne le chemin de la version optimisée d'une image, produite au premier appel.
+    La source est gardée si elle est déjà plus légère, si son format n'est pas géré
+    ou si Pillow est absent.
+    """
+    if not is_available() or os.path.splitext(src_path)[1].lower() not in OPTIMIZABLE_EXTENSIONS:
+        return src_path
+
+    cached_path = get_cached_path(src_path, max_dimension, quality, cache_dir)
+    if os.path.exists(cached_path):
+        instrumentation.count('media_cache_hits')
+        return cached_path
+    instrumentation.count('media_cache_misses')
+
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cached_path), suffix='.tmp')
+    os.close(fd)
+    try:
+        try:
+            save_optimized(src_path, tmp_path, max_dimension, quality)
+        except (OSError, ValueError) as e:
+            print(f"      ⚠️ Image non optimisée : {os.path.basename(src_path)} ({e})")
+            shutil.copy2(src_path, tmp_path)
+        if os.path.getsize(tmp_path) >= os.path.getsize(src_path):
+            # Recompressing would not help: cache the original so it is not tried again
+            shutil.copy2(src_path, tmp_path)
+        # Concurrent builds may race on the same image: the last identical copy wins
+        os.replace(tmp_path, cached_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return cached_path
+
+def optimize_media_files(media_files: List[str]) -> List[str]:
+    """Version optimisée de chaque image d'un deck (mêmes noms de fichiers, même ordre)."""
+    return [optimize_image(path) for path in media_files]
+
+def preview_variants(src_path: str, widths: tuple = PREVIEW_WIDTHS, quality: int = JPEG_QUALITY,
+                     cache_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Variantes d'une image pour les aperçus, de la plus petite à la plus grande :
+    [{'path', 'width', 'height'}]. Une image n'est jamais agrandie : les largeurs
+    au-delà de la sienne sont remplacées par sa largeur d'origine.
+    Liste vide si Pillow est absent ou si le format n'est pas géré.
+    """
+    if not is_available() or os.path.splitext(src_path)[1].lower() not in OPTIMIZABLE_EXTENSIONS:
+        return []
+
+    entry_dir = get_cache_entry_dir(src_path, get_settings_key(max(widths), quality, preview=list(widths)), cache_dir)
+    index_path = os.path.join(entry_dir, 'variants.json')
+    if os.path.exists(index_path):
+        instrumentation.count('media_cache_hits')
+        with open(index_path, 'r', encoding='utf-8') as f:
+            variants = json.load(f)
+        return [{**variant, 'path': os.path.join(entry_dir, variant['file'])} for variant in variants]
+
+    instrumentation.count('media_cache_misses')
+    variants = []
+    try:
+        with Image.open(src_path) as source:
+            source = ImageOps.exif_transpose(source)
+            for width in sorted({min(width, source.width) for width in widths}):
+                image = source.copy()
+                image.thumbnail((width, source.height), Image.LANCZOS)
+                file_name = f"{width}/{os.path.basename(src_path)}"
+                os.makedirs(os.path.join(entry_dir, str(width)), exist_ok=True)
+                save_image(image, os.path.join(entry_dir, file_name), quality)
+                variants.append({'file': file_name, 'width': image.width, 'height': image.height})
+    except (OSError, ValueError) as e:
+        print(f"      ⚠️ Variantes d'aperçu impossibles : {os.path.basename(src_path)} ({e})")
+        return []
+
+    # Written last: an interrupted run leaves no index and is simply redone
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(variants, f)
+    return [{**variant, 'path': os.path.join(entry_dir, variant['file'])} for variant in variants]
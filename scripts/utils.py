@@ -1,47 +1,222 @@
 
 import json
-import urllib.request
+import hashlib
+import http.client
+import time
+import urllib.parse
 import unicodedata
 import re
 import os
-from typing import Any, Dict, Optional
+import select
+from typing import Any, Dict, List, Optional
+import instrumentation
 
 ANKI_CONNECT_URL: str = "http://localhost:8765"
+ANKI_CONNECT_VERSION: int = 6
+# Actions Anki can run twice without harm: sent again when their response is lost
+REPLAYABLE_ACTIONS = frozenset({"version", "deckNames", "modelNames", "modelFieldNames", "findNotes",
+                                "notesInfo", "getMediaFilesNames", "createDeck", "storeMediaFile"})
 
-def anki_connect_request(action: str, **params: Any) -> Optional[Dict[str, Any]]:
+class AnkiConnectError(Exception):
+    """Erreur renvoyée par AnkiConnect ou connexion impossible."""
+
+class AnkiConnectClient:
     """
-    Communiquer avec Anki via l'add-on AnkiConnect.
+    Client AnkiConnect réutilisable : connexion HTTP persistante, délai d'attente,
+    nouvelles tentatives avec backoff exponentiel et regroupement d'actions via `multi`.
     """
-    try:
-        request_data = json.dumps({
-            "action": action,
-            "params": params,
-            "version": 6
-        }).encode("utf-8")
-        
-        request = urllib.request.Request(ANKI_CONNECT_URL, request_data)
-        
-        with urllib.request.urlopen(request) as response:
-            result = json.load(response)
-            
+
+    def __init__(self, url: str = ANKI_CONNECT_URL, timeout: float = 30.0, retries: int = 3,
+                 backoff: float = 0.5, batch_size: int = 100) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 80
+        self.path = parsed.path or "/"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.round_trips = 0
+        self._connection: Optional[http.client.HTTPConnection] = None
+
+    def close(self) -> None:
+        """Ferme la connexion persistante (elle sera rouverte au besoin)."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self) -> "AnkiConnectClient":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    @staticmethod
+    def make_action(action: str, **params: Any) -> Dict[str, Any]:
+        """Construit le corps d'une action AnkiConnect."""
+        return {"action": action, "params": params, "version": ANKI_CONNECT_VERSION}
+
+    @staticmethod
+    def is_replayable(payload: Dict[str, Any]) -> bool:
+        """Vrai si la requête (multi compris) ne contient que des actions rejouables."""
+        if payload.get("action") == "multi":
+            return all(AnkiConnectClient.is_replayable(action) for action in payload["params"]["actions"])
+        return payload.get("action") in REPLAYABLE_ACTIONS
+
+    def _connection_dropped(self) -> bool:
+        """Vrai si Anki a fermé la connexion persistante inutilisée (elle est lisible sans requête en cours)."""
+        sock = self._connection.sock if self._connection is not None else None
+        if sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Envoie une requête, avec nouvelles tentatives si la connexion échoue avant l'envoi.
+        Une fois la requête transmise (délai dépassé, connexion coupée sans réponse), Anki a pu
+        l'exécuter : seules les requêtes rejouables sont renvoyées.
+        """
+        body = json.dumps(payload).encode("utf-8")
+        replayable = self.is_replayable(payload)
+        last_error: Optional[Exception] = None
+
+        for attempt in range(self.retries + 1):
+            sent = False
+            try:
+                if self._connection_dropped():
+                    self.close()
+                if self._connection is None:
+                    self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self._connection.request("POST", self.path, body, {"Content-Type": "application/json"})
+                sent = True
+                response = self._connection.getresponse()
+                data = response.read()
+                self.round_trips += 1
+                instrumentation.count('anki_round_trips')
+                instrumentation.count('anki_bytes_sent', len(body))
+                instrumentation.count('anki_bytes_received', len(data))
+                if response.status != 200:
+                    raise AnkiConnectError(f"HTTP {response.status}")
+                return json.loads(data)
+            except (OSError, http.client.HTTPException) as e:
+                # Anki not started yet, stale keep-alive socket, timeout...
+                last_error = e
+                self.close()
+                if sent and not replayable:
+                    raise AnkiConnectError(f"pas de réponse, requête non renvoyée car Anki a pu l'exécuter ({e})")
+                if attempt < self.retries:
+                    time.sleep(self.backoff * (2 ** attempt))
+
+        raise AnkiConnectError(f"connexion impossible ({last_error})")
+
+    def invoke(self, action: str, **params: Any) -> Any:
+        """Exécute une action et retourne son résultat, lève AnkiConnectError en cas d'erreur."""
+        result = self._post(self.make_action(action, **params))
         if len(result) != 2:
-            raise Exception("Réponse inattendue d'AnkiConnect")
-            
+            raise AnkiConnectError("Réponse inattendue d'AnkiConnect")
         if result.get("error") is not None:
-            raise Exception(result["error"])
-            
-        return result
-        
-    except Exception as e:
-        print(f"\n[ERREUR] Impossible de connecter à Anki : {e}")
-        print("Vérifiez qu'Anki est ouvert et que l'add-on AnkiConnect est installé.")
-        return None
+            raise AnkiConnectError(result["error"])
+        return result["result"]
+
+    def request(self, action: str, **params: Any) -> Optional[Dict[str, Any]]:
+        """
+        Exécute une action et retourne la réponse complète ({"result", "error"}),
+        ou None après avoir affiché l'erreur.
+        """
+        try:
+            return {"result": self.invoke(action, **params), "error": None}
+        except (AnkiConnectError, ValueError) as e:
+            print(f"\n[ERREUR] Impossible de connecter à Anki : {e}")
+            print("Vérifiez qu'Anki est ouvert et que l'add-on AnkiConnect est installé.")
+            return None
+
+    def multi(self, actions: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Exécute plusieurs actions (voir make_action) en un aller-retour par lot de batch_size.
+        Retourne une réponse {"result", "error"} par action, ou None si un lot a échoué.
+        """
+        responses: List[Dict[str, Any]] = []
+        for start in range(0, len(actions), self.batch_size):
+            batch = actions[start:start + self.batch_size]
+            response = self.request("multi", actions=batch)
+            if response is None:
+                return None
+            for item in response["result"]:
+                # AnkiConnect only wraps results in {"result", "error"} for versioned actions
+                if isinstance(item, dict) and set(item) == {"result", "error"}:
+                    responses.append(item)
+                else:
+                    responses.append({"result": item, "error": None})
+        return responses
+
+# Shared client used by anki_connect_request
+_default_client: Optional[AnkiConnectClient] = None
+
+def get_anki_client() -> AnkiConnectClient:
+    """Retourne le client AnkiConnect partagé par le processus."""
+    global _default_client
+    if _default_client is None:
+        _default_client = AnkiConnectClient()
+    return _default_client
+
+def anki_connect_request(action: str, **params: Any) -> Optional[Dict[str, Any]]:
+    """
+    Communiquer avec Anki via l'add-on AnkiConnect.
+    """
+    return get_anki_client().request(action, **params)
+
+def fold_accents(value: str) -> str:
+    """Supprime les accents (et tout caractère non ASCII) et passe en minuscules."""
+    return unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode('ascii').lower()
 
 def slugify(value: str) -> str:
     """
     Normalise une chaîne de caractères pour l'utiliser dans les noms de fichiers ou d'ID.
     Supprime les accents et remplace les caractères spéciaux.
     """
-    value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode('ascii')
-    value = re.sub(r'[^\w\s-]', '', value).strip().lower()
+    value = re.sub(r'[^\w\s-]', '', fold_accents(value)).strip()
     return re.sub(r'[-\s]+', '_', value)
+
+def file_sha256(path: str, chunk_size: int = 1 << 16) -> str:
+    """
+    Calcule l'empreinte SHA-256 d'un fichier sans le charger entièrement en mémoire.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+        instrumentation.add_bytes(read=f.tell())
+    return digest.hexdigest()
+
+def build_media_index(media_dir: str) -> Dict[str, List[str]]:
+    """
+    Parcourt media/ une seule fois et associe chaque nom de fichier à ses chemins.
+    Les chemins sont triés pour que la résolution soit stable d'un build à l'autre.
+    """
+    index: Dict[str, List[str]] = {}
+    for root, dirs, files in os.walk(media_dir):
+        dirs.sort()
+        for name in sorted(files):
+            index.setdefault(name, []).append(os.path.join(root, name))
+    return index
+
+def resolve_media(index: Dict[str, List[str]], filename: str, subfolder_dir: Optional[str] = None) -> Optional[str]:
+    """
+    Retourne le chemin d'une image indexée, en privilégiant celle du sous-dossier attendu.
+    """
+    candidates = index.get(filename)
+    if not candidates:
+        return None
+    if subfolder_dir is not None:
+        preferred = os.path.join(subfolder_dir, filename)
+        if preferred in candidates:
+            return preferred
+    return candidates[0]
+
+def find_ambiguous_media(index: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """Noms de fichiers présents dans plusieurs sous-dossiers de media/."""
+    return {name: paths for name, paths in index.items() if len(paths) > 1}
@@ -0,0 +1,37 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add scripts and benchmarks folders to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../benchmarks'))
+
+from generate_corpus import generate_corpus
+from cards import iter_cards
+from utils import build_media_index
+
+class TestGenerateCorpus(unittest.TestCase):
+    def test_corpus_is_readable_and_deterministic(self):
+        with tempfile.TemporaryDirectory() as tmp_a, tempfile.TemporaryDirectory() as tmp_b:
+            stats = generate_corpus(tmp_a, decks=7, cards=100, images=5, seed=3)
+            generate_corpus(tmp_b, decks=7, cards=100, images=5, seed=3)
+
+            csv_files = sorted(os.path.join(root, name) for root, _, files in os.walk(os.path.join(tmp_a, "decks"))
+                               for name in files)
+            self.assertEqual(len(csv_files), 7)
+            cards = [card for path in csv_files for card in iter_cards(path)]
+            self.assertEqual(len(cards), stats['cards'])
+
+            # Every referenced image exists and is a PNG
+            media_index = build_media_index(os.path.join(tmp_a, "media"))
+            for ref in {ref for card in cards for ref in card.media_refs}:
+                with open(media_index[ref][0], "rb") as f:
+                    self.assertEqual(f.read(8), b'\x89PNG\r\n\x1a\n')
+
+            for path in csv_files:
+                with open(path, "rb") as f_a, open(path.replace(tmp_a, tmp_b), "rb") as f_b:
+                    self.assertEqual(f_a.read(), f_b.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import unittest
+import sys
+import os
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import re
+import shutil
+import subprocess
+import tempfile
+from unittest import mock
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+import build
+import catalog
+import generate_apkg
+from build import parse_stages, affected_csv_paths, snapshot_files, changed_files, BuildState, run_build
+from catalog import connect, update_catalog
+
+# src="..." and the URLs of srcset="..." in preview pages
+PREVIEW_URL_PATTERN = re.compile(r'(?:src|srcset)="([^"]+)"')
+
+class TestBuild(unittest.TestCase):
+    def test_parse_stages(self):
+        # Pipeline order whatever the order given, parse added for the stages that need it
+        self.assertEqual(parse_stages("previews,package"), ["parse", "package", "previews"])
+        self.assertEqual(parse_stages("sitemap, index"), ["index", "sitemap"])
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_stages("package,deploy")
+
+    def test_affected_csv_paths(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            decks_dir = os.path.join(tmp, "decks")
+            os.makedirs(os.path.join(decks_dir, "SI"))
+            with open(os.path.join(decks_dir, "SI", "a.csv"), "w", encoding="utf-8-sig") as f:
+                f.write("Q1;<img src='x.png'>\n")
+            conn = connect(os.path.join(tmp, "catalog.sqlite"))
+            update_catalog(conn, decks_dir)
+
+            changed = ["decks/Maths/b.csv", "media/si/x.png", "docs/index.html"]
+            self.assertEqual(affected_csv_paths(changed, conn), {"Maths/b.csv", "SI/a.csv"})
+            # A change in the generation code rebuilds everything
+            self.assertIsNone(affected_csv_paths(changed + ["scripts/cards.py"], conn))
+            conn.close()
+
+    def test_watch_snapshots(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "decks", "SI"))
+            os.makedirs(os.path.join(tmp, "media"))
+            for name in ["decks/SI/a.csv", "decks/SI/.a.csv.swp", "media/x.png", "docs/decks.html"]:
+                os.makedirs(os.path.dirname(os.path.join(tmp, name)), exist_ok=True)
+                with open(os.path.join(tmp, name), "w", encoding="utf-8") as f:
+                    f.write("Q1;R1\n")
+            before = snapshot_files(tmp, ["decks", "media"])
+            self.assertEqual(sorted(before), ["decks/SI/a.csv", "media/x.png"])
+
+            with open(os.path.join(tmp, "decks", "SI", "a.csv"), "a", encoding="utf-8") as f:
+                f.write("Q2;R2\n")
+            os.remove(os.path.join(tmp, "media", "x.png"))
+            with open(os.path.join(tmp, "decks", "b.csv"), "w", encoding="utf-8") as f:
+                f.write("Q3;R3\n")
+            after = snapshot_files(tmp, ["decks", "media"])
+            self.assertEqual(changed_files(before, after), ["decks/SI/a.csv", "decks/b.csv", "media/x.png"])
+            self.assertEqual(changed_files(after, after), [])
+
+    def test_heavy_modules_are_lazy(self):
+        # Fresh interpreter: other tests may already have imported them
+        code = "import build, sys; print(sorted({'genanki', 'jinja2'} & set(sys.modules)))"
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.join(os.path.dirname(__file__), '../scripts'),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+@unittest.skipUnless(importlib.util.find_spec("genanki"), "genanki n'est pas installé")
+class TestSinceBuild(unittest.TestCase):
+    """Build dans un dépôt temporaire : decks/, media/, docs/ et .cache/."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.base = tmp.name
+        self.docs = os.path.join(self.base, "docs")
+        cache = os.path.join(self.base, ".cache")
+        patches = [
+            (generate_apkg, "DECKS_DIR", os.path.join(self.base, "decks")),
+            (generate_apkg, "MEDIA_DIR", os.path.join(self.base, "media")),
+            (generate_apkg, "OUTPUT_DIR", self.docs),
+            (generate_apkg, "PREVIEWS_DIR", os.path.join(self.docs, "previews")),
+            (generate_apkg, "OUT_MEDIA_DIR", os.path.join(self.docs, "media")),
+            (generate_apkg, "CACHE_DIR", cache),
+            (generate_apkg, "BUILD_CACHE_PATH", os.path.join(cache, "build_cache.json")),
+            (build, "ARTIFACTS_DIR", os.path.join(cache, "artifacts")),
+            (build, "ARTIFACTS_MANIFEST_PATH", os.path.join(cache, "artifacts", "manifest.json")),
+        ]
+        connect_catalog = catalog.connect
+        patches.append((catalog, "connect", lambda: connect_catalog(os.path.join(cache, "catalog.sqlite"))))
+        for target, name, value in patches:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.write("decks/SI/SI-Cycle1.csv", 'Q1;"<img src=""../media/cycle1/x.png"">"\nQ2;R2\n')
+        self.write("decks/SI/SI-Cycle2.csv", "Q3;R3\n")
+        self.write("media/cycle1/x.png", "png")
+
+    def write(self, path, content):
+        path = os.path.join(self.base, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8-sig" if path.endswith(".csv") else "utf-8") as f:
+            f.write(content)
+
+    def build(self, changed=None, commit="c1", history=("c1",), stages=("parse", "package", "previews")):
+        """Build (--since si changed est donné) au commit commit, avec history pour historique de HEAD."""
+        state = BuildState(since="HEAD~1" if changed is not None else None)
+        with mock.patch.object(build, "git_changed_files", return_value=changed) as diff, \
+                mock.patch.object(build, "source_commit", return_value=commit), \
+                mock.patch.object(build, "is_ancestor", side_effect=lambda sha: sha in history), \
+                mock.patch.object(build, "git_output", return_value=None), \
+                contextlib.redirect_stdout(io.StringIO()):
+            run_build(list(stages), state)
+        self.diff_base = diff.call_args[0][0] if diff.called else None
+        return state
+
+    def test_restored_previews_have_their_images(self):
+        self.build()
+        # Fresh CI checkout: docs/ is gone, .cache/ is restored
+        shutil.rmtree(self.docs)
+        self.write("decks/SI/SI-Cycle2.csv", "Q3;R3 modifiée\n")
+        state = self.build(changed=["decks/SI/SI-Cycle2.csv"], commit="c2", history=("c1", "c2"))
+        self.assertEqual(list(state.restored), ["SI-Cycle1.apkg"])
+        self.assertEqual(self.diff_base, "c1")
+
+        pages = glob.glob(os.path.join(self.docs, "previews", "SI-Cycle1", "*.json"))
+        self.assertTrue(pages)
+        urls = []
+        for page in pages:
+            with open(page, encoding="utf-8") as f:
+                for card in json.load(f):
+                    for match in PREVIEW_URL_PATTERN.finditer(card["front"] + card["back"]):
+                        urls.extend(part.split()[0] for part in match.group(1).split(","))
+        self.assertTrue(urls)
+        for url in urls:
+            self.assertTrue(os.path.exists(os.path.join(self.docs, url)), url)
+
+    def test_unchanged_artifacts_are_not_copied_again(self):
+        self.build()
+        copied = []
+        copy2 = shutil.copy2
+
+        def record_copy(source, destination, **kwargs):
+            copied.append(os.path.relpath(destination, self.base).replace(os.sep, "/"))
+            return copy2(source, destination, **kwargs)
+
+        # Full build, nothing changed: packages come from the build cache, pages keep their names
+        with mock.patch.object(build.shutil, "copy2", record_copy), \
+                mock.patch.object(build.shutil, "copytree") as copytree:
+            self.build(commit="c2", history=("c1", "c2"))
+        self.assertEqual(sorted(copied), [".cache/artifacts/previews/SI-Cycle1.json",
+                                          ".cache/artifacts/previews/SI-Cycle2.json"])
+        copytree.assert_not_called()
+
+        # Only the edited deck goes to the artifacts
+        self.write("decks/SI/SI-Cycle2.csv", "Q3;R3 modifiée\n")
+        copied.clear()
+        with mock.patch.object(build.shutil, "copy2", record_copy):
+            self.build(commit="c3", history=("c1", "c2", "c3"))
+        self.assertEqual(sorted(path for path in copied if "SI-Cycle2/" not in path),
+                         [".cache/artifacts/SI-Cycle2.apkg", ".cache/artifacts/previews/SI-Cycle1.json",
+                          ".cache/artifacts/previews/SI-Cycle2.json"])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.base, ".cache", "artifacts", "previews", "SI-Cycle2"))),
+                         sorted(os.listdir(os.path.join(self.docs, "previews", "SI-Cycle2"))))
+
+    def test_since_diffs_from_the_artifacts_commit(self):
+        self.build(commit="c1")
+        # Cache restored from c1 while the previous push (HEAD~1) was c2, whose build failed
+        self.build(changed=[], commit="c3", history=("c1", "c2", "c3"))
+        self.assertEqual(self.diff_base, "c1")
+        with open(build.ARTIFACTS_MANIFEST_PATH, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["commit"], "c3")
+
+    def test_untrusted_artifacts_rebuild_everything(self):
+        # Artifacts from a commit missing from the history (force push)
+        self.build(commit="c1")
+        state = self.build(changed=[], commit="c2", history=("c2",))
+        self.assertEqual((state.restored, len(state.decks), self.diff_base), ({}, 2, None))
+
+        # Artifacts of a build stopped before its previews, or with uncommitted sources
+        self.build(commit="c2", stages=("parse", "package"))
+        state = self.build(changed=[], commit="c3", history=("c2", "c3"))
+        self.assertEqual((state.restored, len(state.decks), self.diff_base), ({}, 2, None))
+        self.build(commit=None)
+        state = self.build(changed=[], commit="c4", history=("c3", "c4"))
+        self.assertEqual((state.restored, len(state.decks), self.diff_base), ({}, 2, None))
+
+if __name__ == '__main__':
+    unittest.main()
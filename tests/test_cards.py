@@ -0,0 +1,43 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+from cards import iter_cards, iter_rows, write_rows, clean_media_paths, extract_media_refs
+
+class TestCards(unittest.TestCase):
+    def test_iter_cards(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "deck.csv")
+            with open(csv_path, "w", encoding="utf-8-sig") as f:
+                f.write('Q1;"R1 <img src=""../media/si/a.jpg"">";tag1 tag2\n')
+                f.write("ligne ignorée\n")
+                f.write("Q2;<img src='b.png'> <img src=\"https://x.org/c.png\">\n")
+
+            cards = list(iter_cards(csv_path))
+
+        self.assertEqual([c.front for c in cards], ["Q1", "Q2"])
+        self.assertEqual(cards[0].tags, ["tag1", "tag2"])
+        self.assertEqual(cards[0].media_refs, ["../media/si/a.jpg"])
+        self.assertEqual(cards[1].media_refs, ["b.png"])
+        self.assertEqual(cards[1].row, 3)
+
+    def test_media_paths(self):
+        self.assertEqual(clean_media_paths('<img src="../media/si/a.jpg">'), '<img src="a.jpg">')
+        self.assertEqual(clean_media_paths("<img src='media/b.png'>"), "<img src='b.png'>")
+        self.assertEqual(clean_media_paths('<img src="https://x.org/c.png">'), '<img src="https://x.org/c.png">')
+        self.assertEqual(extract_media_refs('<img src="data:image/png;base64,AA">'), [])
+
+    def test_write_rows_round_trip(self):
+        rows = [["Q;1", 'R "2"', "tag"], ["Q3", "R3", ""]]
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "deck.csv")
+            write_rows(csv_path, iter(rows))
+            self.assertEqual(list(iter_rows(csv_path)), rows)
+            self.assertEqual(os.listdir(tmp), ["deck.csv"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+from catalog import connect, update_catalog, deck_card_counts, decks_using_media, count_cards_with_tag
+
+class TestCatalog(unittest.TestCase):
+    def test_incremental_update_and_queries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            decks_dir = os.path.join(tmp, "decks")
+            os.makedirs(os.path.join(decks_dir, "SI"))
+            deck_a = os.path.join(decks_dir, "SI", "a.csv")
+            deck_b = os.path.join(decks_dir, "SI", "b.csv")
+            with open(deck_a, "w", encoding="utf-8-sig") as f:
+                f.write('Q1;"<img src=""../media/si/x.png"">";cycle1 meca\n')
+                f.write("Q2;R2;meca\n")
+            with open(deck_b, "w", encoding="utf-8-sig") as f:
+                f.write("Q3;<img src='x.png'>\n")
+
+            conn = connect(os.path.join(tmp, "catalog.sqlite"))
+            self.assertEqual(update_catalog(conn, decks_dir)['indexed'], 2)
+            self.assertEqual(deck_card_counts(conn), {"SI/a.csv": 2, "SI/b.csv": 1})
+            self.assertEqual(decks_using_media(conn, "x.png"), ["SI/a.csv", "SI/b.csv"])
+            self.assertEqual(count_cards_with_tag(conn, "meca"), 2)
+
+            # Unchanged files are not re-read, removed files leave the catalog
+            os.remove(deck_b)
+            self.assertEqual(update_catalog(conn, decks_dir), {'indexed': 0, 'unchanged': 1, 'removed': 1})
+            self.assertEqual(decks_using_media(conn, "x.png"), ["SI/a.csv"])
+            conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
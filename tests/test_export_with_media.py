@@ -0,0 +1,215 @@
+import unittest
+import sys
+import os
+import io
+import shutil
+import contextlib
+import tempfile
+import threading
+import time
+from unittest import mock
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+import export_with_media
+from export_with_media import MediaCopier, export_decks
+from fake_anki_connect import FakeAnkiConnect, FakeAnkiError
+from utils import AnkiConnectClient
+
+class ExportTestCase(unittest.TestCase):
+    """Dossiers temporaires à la place de decks/, media/, .cache/export et du dossier média d'Anki."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        for name, folder in [("OUTPUT_DIR", "decks"), ("MEDIA_REPO_DIR", "media"), ("EXPORT_STATE_DIR", "export")]:
+            patcher = mock.patch.object(export_with_media, name, os.path.join(self.tmp, folder))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.anki_media = os.path.join(self.tmp, "anki_media")
+        os.makedirs(self.anki_media)
+        with open(os.path.join(self.anki_media, "a.png"), "wb") as f:
+            f.write(b"png")
+
+    def start_fake(self):
+        fake = FakeAnkiConnect(media_dir=self.anki_media).start()
+        self.addCleanup(fake.stop)
+        return fake
+
+    def add_notes(self, fake, deck, rows):
+        """Ajoute des notes (recto, verso) à un deck de la fausse collection et retourne leurs ids."""
+        with AnkiConnectClient(fake.url) as client:
+            client.invoke("createDeck", deck=deck)
+            return client.invoke("addNotes", notes=[
+                {"deckName": deck, "modelName": "Basic", "fields": {"Front": front, "Back": back}, "tags": []}
+                for front, back in rows])
+
+    def export(self, fake, decks, jobs=1, incremental=False, copier=None,
+               chunk_size=export_with_media.NOTES_INFO_CHUNK_SIZE):
+        copier = copier or MediaCopier(self.anki_media, media_index={})
+        with contextlib.redirect_stdout(io.StringIO()):
+            return export_decks(decks, copier, lambda: AnkiConnectClient(fake.url), jobs, incremental, chunk_size)
+
+class TestMediaCopier(ExportTestCase):
+    def test_concurrent_sync_of_shared_image(self):
+        copier = MediaCopier(self.anki_media, media_index={}, link=True)
+        copy2 = shutil.copy2
+
+        def slow_copy(*args, **kwargs):
+            # Widens the window in which a second thread could copy the same file
+            time.sleep(0.01)
+            return copy2(*args, **kwargs)
+
+        barrier = threading.Barrier(8)
+        results = []
+
+        def sync(subfolder):
+            barrier.wait()
+            results.append(copier.sync_file("a.png", subfolder))
+
+        with mock.patch.object(shutil, "copy2", slow_copy), contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=sync, args=(f"cycle{i % 2}",)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(results, [True] * 8)
+        # One copy, then a hard link for the other subfolder; later calls hit the memo
+        self.assertEqual(copier.stats, {"copied": 1, "linked": 1})
+        self.assertEqual(sorted(copier.media_index["a.png"]),
+                         sorted(os.path.join(self.tmp, "media", f"cycle{i}", "a.png") for i in range(2)))
+
+class TestExportDecks(ExportTestCase):
+    def test_parallel_export_with_shared_media(self):
+        fake = self.start_fake()
+        decks = [f"SI::Cycle{i}" for i in range(6)]
+        for deck in decks:
+            self.add_notes(fake, deck, [(f"{deck} Q{j}", '<img src="a.png">') for j in range(3)])
+
+        copier = MediaCopier(self.anki_media, media_index={})
+        self.assertEqual(self.export(fake, decks, jobs=4, copier=copier), {deck: 3 for deck in decks})
+        # One copy per deck media subfolder, never twice
+        self.assertEqual(copier.stats, {"copied": 6})
+        for i in range(6):
+            with open(os.path.join(self.tmp, "decks", "si", f"cycle{i}.csv"), encoding="utf-8-sig") as f:
+                self.assertIn(f'src=""../media/cycle{i}/a.png""', f.read())
+            with open(os.path.join(self.tmp, "media", f"cycle{i}", "a.png"), "rb") as f:
+                self.assertEqual(f.read(), b"png")
+
+class TestStreamedExport(ExportTestCase):
+    DECK = "SI::Cycle5"
+
+    def setUp(self):
+        super().setUp()
+        self.fake = self.start_fake()
+        self.ids = self.add_notes(self.fake, self.DECK, [(f"Q{i}", f"R{i}") for i in range(5)])
+        _, self.csv_path, self.state_path = export_with_media.get_export_paths(self.DECK)
+
+    def test_notes_info_in_chunks(self):
+        self.assertEqual(self.export(self.fake, [self.DECK], chunk_size=2), {self.DECK: 5})
+        self.assertEqual(self.fake.stats["action:notesInfo"], 3)
+        self.assertEqual([row[:2] for row in export_with_media.iter_rows(self.csv_path)],
+                         [[f"Q{i}", f"R{i}"] for i in range(5)])
+
+    def test_failure_mid_stream_keeps_previous_csv(self):
+        self.export(self.fake, [self.DECK], chunk_size=2)
+        files = {}
+        for path in (self.csv_path, self.state_path):
+            with open(path, "rb") as f:
+                files[path] = f.read()
+
+        self.fake.collection.notes[self.ids[0]]["values"][1] = "R0 modifiée"
+        note_info = self.fake.collection.note_info
+
+        def failing_note_info(note_id):
+            # Second chunk: the first rows are already written to the new CSV
+            if note_id == self.ids[3]:
+                raise FakeAnkiError("collection is closed")
+            return note_info(note_id)
+
+        with mock.patch.object(self.fake.collection, "note_info", failing_note_info):
+            self.assertEqual(self.export(self.fake, [self.DECK], chunk_size=2), {self.DECK: None})
+        for path, content in files.items():
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), content, path)
+        self.assertEqual(os.listdir(os.path.dirname(self.csv_path)), [os.path.basename(self.csv_path)])
+
+class TestIncrementalExport(ExportTestCase):
+    DECK = "SI::Cycle5"
+
+    def setUp(self):
+        super().setUp()
+        self.fake = self.start_fake()
+        self.ids = self.add_notes(self.fake, self.DECK, [("Q1", "R1"), ("Q2", '<img src="a.png">'), ("Q3", "R3")])
+        _, self.csv_path, self.state_path = export_with_media.get_export_paths(self.DECK)
+        self.assertEqual(self.export(self.fake, [self.DECK]), {self.DECK: 3})
+
+    def read_csv(self):
+        with open(self.csv_path, "rb") as f:
+            return f.read()
+
+    def fronts(self):
+        return [row[0] for row in export_with_media.iter_rows(self.csv_path)]
+
+    def touch_note(self, note_id):
+        # Anki mod times are in seconds: move the edit past the previous export
+        self.fake.collection.notes[note_id]["mod"] += 10
+
+    def test_unchanged_deck_is_byte_identical(self):
+        before, mtime = self.read_csv(), os.stat(self.csv_path).st_mtime_ns
+        self.assertEqual(self.export(self.fake, [self.DECK], incremental=True), {self.DECK: 3})
+        self.assertEqual(self.read_csv(), before)
+        # Nothing changed: the CSV is not even rewritten
+        self.assertEqual(os.stat(self.csv_path).st_mtime_ns, mtime)
+
+    def test_edited_note_keeps_csv_order(self):
+        with AnkiConnectClient(self.fake.url) as client:
+            client.invoke("updateNoteFields", note={"id": self.ids[0], "fields": {"Back": "R1 modifiée"}})
+        self.touch_note(self.ids[0])
+        # Edited in Anki but with the mod time already exported: left as is
+        self.fake.collection.notes[self.ids[2]]["values"][1] = "R3 sans date"
+
+        self.assertEqual(self.export(self.fake, [self.DECK], incremental=True), {self.DECK: 3})
+        rows = list(export_with_media.iter_rows(self.csv_path))
+        self.assertEqual([row[:2] for row in rows], [["Q1", "R1 modifiée"],
+                                                     ["Q2", '<img src="../media/cycle5/a.png">'],
+                                                     ["Q3", "R3"]])
+
+    def test_added_and_deleted_notes(self):
+        new_id, = self.add_notes(self.fake, self.DECK, [("Q0", "R0")])
+        with AnkiConnectClient(self.fake.url) as client:
+            client.invoke("deleteNotes", notes=[self.ids[1]])
+
+        self.assertEqual(self.export(self.fake, [self.DECK], incremental=True), {self.DECK: 3})
+        # Remaining rows keep their place, new notes go last
+        self.assertEqual(self.fronts(), ["Q1", "Q3", "Q0"])
+        with open(self.state_path, encoding="utf-8") as f:
+            state = export_with_media.json.load(f)
+        self.assertEqual([note_id for note_id, _ in state["notes"]], [self.ids[0], self.ids[2], new_id])
+
+    def test_missing_or_corrupt_state_falls_back_to_full_export(self):
+        full_export = self.read_csv()
+        self.fake.collection.notes[self.ids[2]]["values"][1] = "R3 sans date"
+        expected = full_export.replace(b"R3", b"R3 sans date")
+
+        for damage in ("missing", "corrupt", "rows"):
+            with self.subTest(damage=damage):
+                if damage == "missing":
+                    os.remove(self.state_path)
+                elif damage == "corrupt":
+                    with open(self.state_path, "w", encoding="utf-8") as f:
+                        f.write("{pas du json")
+                else:
+                    # CSV edited by hand since the export: row count no longer matches
+                    with open(self.csv_path, "a", encoding="utf-8") as f:
+                        f.write("Q4;R4;\r\n")
+                self.assertEqual(self.export(self.fake, [self.DECK], incremental=True), {self.DECK: 3})
+                # A full export re-reads every note, even those whose mod time did not change
+                self.assertEqual(self.read_csv(), expected)
+                self.assertTrue(os.path.exists(self.state_path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import sys
+import os
+import base64
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+from fake_anki_connect import FakeAnkiConnect
+from utils import AnkiConnectClient, AnkiConnectError
+
+def basic_note(deck, front, back, tags=()):
+    return {"deckName": deck, "modelName": "Basic", "fields": {"Front": front, "Back": back},
+            "tags": list(tags), "options": {"allowDuplicate": False, "duplicateScope": "deck"}}
+
+class TestFakeAnkiConnect(unittest.TestCase):
+    def test_actions(self):
+        with FakeAnkiConnect() as fake, AnkiConnectClient(fake.url) as client:
+            responses = client.multi([
+                client.make_action("createDeck", deck="Maths::DL"),
+                client.make_action("storeMediaFile", filename="a.png", data=base64.b64encode(b"png").decode()),
+                client.make_action("addNotes", notes=[basic_note("Maths::DL", "Q1", "R1", ["dl"]),
+                                                      basic_note("Maths::DL", "Q1", "R1 bis")]),
+            ])
+            note_id, duplicate = responses[-1]["result"]
+            self.assertIsNone(duplicate)
+            self.assertEqual(client.invoke("getMediaFilesNames", pattern="*.png"), ["a.png"])
+
+            # Sub-decks match the parent deck query
+            self.assertEqual(client.invoke("findNotes", query='"deck:Maths"'), [note_id])
+            client.invoke("updateNoteFields", note={"id": note_id, "fields": {"Back": "R2"}})
+            info, = client.invoke("notesInfo", notes=[note_id])
+            self.assertEqual(info["fields"]["Back"], {"value": "R2", "order": 1})
+            self.assertEqual(info["tags"], ["dl"])
+
+            with self.assertRaises(AnkiConnectError):
+                client.invoke("addNotes", notes=[basic_note("Inconnu", "Q", "R")])
+            self.assertEqual(fake.stats["requests"], 6)
+            self.assertEqual(fake.stats["action:multi"], 1)
+
+    def test_injected_failures(self):
+        # Dropped connections are retried by the client, every action still runs once
+        with FakeAnkiConnect(failure_rate=0.5, seed=1) as fake:
+            with AnkiConnectClient(fake.url, retries=10, backoff=0) as client:
+                for _ in range(10):
+                    self.assertEqual(client.invoke("deckNames"), ["Default"])
+            self.assertGreater(fake.stats["failures"], 0)
+            self.assertEqual(fake.stats["action:deckNames"], 10)
+            self.assertEqual(client.round_trips, 10)
+
+        with FakeAnkiConnect(failure_rate=1.0, failure_mode='error') as fake, AnkiConnectClient(fake.url) as client:
+            with self.assertRaises(AnkiConnectError):
+                client.invoke("deckNames")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+import sys
+import os
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+from find_duplicates import CatalogCard, normalize_card, find_clusters, iter_signatures, shingle_hashes, minhash_signature
+
+class TestFindDuplicates(unittest.TestCase):
+    def test_normalize_card(self):
+        self.assertEqual(normalize_card("<b>Développement</b> de&nbsp;$e^x$", r"\( 1 + x \, + \quad o(x) \)"),
+                         normalize_card("developpement   de e^x", "1+x+o(x)"))
+        self.assertNotEqual(normalize_card("sin(x)", "x"), normalize_card("cos(x)", "x"))
+
+    def test_find_clusters(self):
+        dl = CatalogCard("Maths/DL.csv", 3, "DL de exp(x) en 0 à l'ordre 3", r"\(1 + x + \frac{x^2}{2} + \frac{x^3}{6} + o(x^3)\)")
+        copy = CatalogCard("Maths/Analyse.csv", 12, "DL de <b>exp(x)</b> en 0 à l'ordre 3 :",
+                           r"$1+x+\frac{x^2}{2}+\frac{x^3}{6}+o(x^3)$")
+        other = CatalogCard("Maths/DL.csv", 4, "DL de ln(1+x) en 0 à l'ordre 3", r"\(x - \frac{x^2}{2} + \frac{x^3}{3} + o(x^3)\)")
+        short = CatalogCard("SI/a.csv", 1, "Oui", "Non")
+        # Too short once normalized: never reported, even when identical
+        self.assertEqual(find_clusters([dl, other, copy, short, short]), [[copy, dl]])
+        self.assertEqual(find_clusters([dl, other, copy], min_length=0, threshold=1.0), [])
+
+    def test_parallel_signatures(self):
+        texts = [f"carte{i}developpementlimite" for i in range(20)]
+        expected = [minhash_signature(shingle_hashes(text)) for text in texts]
+        self.assertEqual(list(iter_signatures(texts, jobs=2)), expected)
+
+if __name__ == '__main__':
+    unittest.main()
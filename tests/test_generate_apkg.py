@@ -0,0 +1,192 @@
+import unittest
+import sys
+import os
+import tempfile
+import zipfile
+import json
+import importlib.util
+import multiprocessing
+import contextlib
+import io
+from unittest import mock
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+import generate_apkg
+from generate_apkg import get_unique_deck_id, normalize_zip, write_preview, rewrite_preview_images, ParsedDeck
+from generate_apkg import compute_deck_key, is_cache_hit, load_build_cache, save_build_cache
+from generate_apkg import DeckTask, run_deck_builds
+from utils import build_media_index
+
+class TestGenerateApkg(unittest.TestCase):
+    def test_deck_id_is_stable(self):
+        # Known value: the ID must not depend on the interpreter's hash seed
+        self.assertEqual(get_unique_deck_id("Maths::Chapitre 8"), 11888014)
+        self.assertNotEqual(get_unique_deck_id("Maths::Chapitre 8"), get_unique_deck_id("Maths::Chapitre 9"))
+        self.assertLess(get_unique_deck_id("SI::Cycle 5"), 10 ** 8)
+
+    def test_normalize_zip_is_byte_identical(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, date_time in enumerate([(2020, 1, 1, 0, 0, 0), (2024, 6, 1, 12, 30, 0)]):
+                path = os.path.join(tmp, f"{i}.apkg")
+                with zipfile.ZipFile(path, 'w') as z:
+                    z.writestr(zipfile.ZipInfo('collection.anki2', date_time=date_time), b'db')
+                    z.writestr(zipfile.ZipInfo('media', date_time=date_time), b'{}')
+                normalize_zip(path)
+                paths.append(path)
+
+            with open(paths[0], 'rb') as a, open(paths[1], 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_write_preview_pages(self):
+        notes = [(f"Q{i}", f'<img src="{i}.png">') for i in range(45)]
+        deck = ParsedDeck("x.csv", "SI", "SI::Cycle 5", "SI-Cycle 5.apkg", notes, [])
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch.object(generate_apkg, "PREVIEWS_DIR", tmp):
+                os.makedirs(os.path.join(tmp, "SI-Cycle 5"))
+                open(os.path.join(tmp, "SI-Cycle 5", "0123456789ab.json"), "w").close()
+                manifest = write_preview(deck)
+                # Same content, same page names
+                self.assertEqual(write_preview(deck), manifest)
+
+            with open(os.path.join(tmp, "SI-Cycle 5.json"), encoding="utf-8") as f:
+                self.assertEqual(json.load(f), manifest)
+            self.assertEqual(manifest["cards"], 45)
+            self.assertEqual(len(manifest["pages"]), 3)
+            self.assertTrue(all(page.startswith("SI-Cycle%205/") for page in manifest["pages"]))
+            # Pages of previous versions are removed
+            page_names = [page.split("/")[-1] for page in manifest["pages"]]
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp, "SI-Cycle 5"))), sorted(page_names))
+            with open(os.path.join(tmp, "SI-Cycle 5", page_names[-1]), encoding="utf-8") as f:
+                last_page = json.load(f)
+            self.assertEqual(last_page[-1], {"front": "Q44",
+                                             "back": '<img src="media/44.png" loading="lazy" decoding="async">'})
+
+    def test_rewrite_preview_images(self):
+        variants = {"a.jpg": [{"width": 400, "height": 200}, {"width": 964, "height": 482}]}
+        html = rewrite_preview_images('<img src="a.jpg"><img src="https://x.org/b.png"/>', variants)
+        self.assertEqual(html, '<img src="media/preview/964/a.jpg" '
+                               'srcset="media/preview/400/a.jpg 400w, media/preview/964/a.jpg 964w" '
+                               f'sizes="{generate_apkg.PREVIEW_IMAGE_SIZES}" width="964" height="482" '
+                               'loading="lazy" decoding="async"><img src="https://x.org/b.png"/>')
+        # Without variants (no Pillow, SVG...): full image, still lazily loaded
+        self.assertEqual(rewrite_preview_images("<img src='c.svg' />", {}),
+                         "<img src='media/c.svg' loading=\"lazy\" decoding=\"async\" />")
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        for name, value in [("OUTPUT_DIR", os.path.join(self.tmp, "docs")),
+                            ("PREVIEWS_DIR", os.path.join(self.tmp, "docs", "previews")),
+                            ("CACHE_DIR", os.path.join(self.tmp, ".cache")),
+                            ("BUILD_CACHE_PATH", os.path.join(self.tmp, ".cache", "build_cache.json"))]:
+            patcher = mock.patch.object(generate_apkg, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        os.makedirs(generate_apkg.PREVIEWS_DIR)
+        self.csv_path = os.path.join(self.tmp, "SI-Cycle5.csv")
+        self.media_path = os.path.join(self.tmp, "a.png")
+        self.write(self.csv_path, 'Q1;<img src="a.png">\n')
+        self.write(self.media_path, "png")
+        # Outputs of a previous build
+        self.write(os.path.join(generate_apkg.OUTPUT_DIR, "SI-Cycle5.apkg"), "apkg")
+        self.write(generate_apkg.get_preview_paths("SI-Cycle5.apkg")[0], "{}")
+
+    def write(self, path, content):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def key(self, reproducible=False):
+        return compute_deck_key(self.csv_path, [self.media_path], reproducible)
+
+    def test_unchanged_inputs_hit(self):
+        entry = {"key": self.key(), "cards": 1}
+        self.assertTrue(is_cache_hit(entry, self.key(), "SI-Cycle5.apkg"))
+        self.assertFalse(is_cache_hit(None, self.key(), "SI-Cycle5.apkg"))
+
+    def test_changed_inputs_miss(self):
+        entry = {"key": self.key(), "cards": 1}
+        self.assertFalse(is_cache_hit(entry, self.key(reproducible=True), "SI-Cycle5.apkg"))
+        with mock.patch.object(generate_apkg, "BUILD_CACHE_VERSION", generate_apkg.BUILD_CACHE_VERSION + 1):
+            self.assertFalse(is_cache_hit(entry, self.key(), "SI-Cycle5.apkg"))
+        # Preview variants and srcset depend on Pillow and its settings
+        pillow = generate_apkg.media_optimizer.is_available()
+        with mock.patch.object(generate_apkg.media_optimizer, "is_available", return_value=not pillow):
+            self.assertFalse(is_cache_hit(entry, self.key(), "SI-Cycle5.apkg"))
+        for name, value in [("PREVIEW_WIDTHS", (400,)), ("MAX_DIMENSION", 800), ("JPEG_QUALITY", 50)]:
+            with mock.patch.object(generate_apkg.media_optimizer, name, value):
+                self.assertFalse(is_cache_hit(entry, self.key(), "SI-Cycle5.apkg"), name)
+
+        self.write(self.media_path, "png modifié")
+        self.assertFalse(is_cache_hit(entry, self.key(), "SI-Cycle5.apkg"))
+        entry = {"key": self.key(), "cards": 1}
+        self.write(self.csv_path, 'Q1 modifiée;<img src="a.png">\n')
+        self.assertFalse(is_cache_hit(entry, self.key(), "SI-Cycle5.apkg"))
+
+    def test_missing_outputs_rebuild(self):
+        entry = {"key": self.key(), "cards": 1}
+        os.remove(generate_apkg.get_preview_paths("SI-Cycle5.apkg")[0])
+        self.assertFalse(is_cache_hit(entry, self.key(), "SI-Cycle5.apkg"))
+        # The package stage of build.py writes previews itself
+        self.assertTrue(is_cache_hit(entry, self.key(), "SI-Cycle5.apkg", require_preview=False))
+        os.remove(os.path.join(generate_apkg.OUTPUT_DIR, "SI-Cycle5.apkg"))
+        self.assertFalse(is_cache_hit(entry, self.key(), "SI-Cycle5.apkg", require_preview=False))
+
+    def test_cache_file_version(self):
+        save_build_cache({"SI-Cycle5.apkg": {"key": self.key(), "cards": 1}})
+        self.assertEqual(load_build_cache(), {"SI-Cycle5.apkg": {"key": self.key(), "cards": 1}})
+        # A cache written by another version is ignored as a whole
+        with mock.patch.object(generate_apkg, "BUILD_CACHE_VERSION", generate_apkg.BUILD_CACHE_VERSION + 1):
+            self.assertEqual(load_build_cache(), {})
+        self.write(generate_apkg.BUILD_CACHE_PATH, "{corrompu")
+        self.assertEqual(load_build_cache(), {})
+
+@unittest.skipUnless(importlib.util.find_spec("genanki"), "genanki n'est pas installé")
+# Workers must inherit the patched output folders
+@unittest.skipUnless(multiprocessing.get_start_method() == "fork", "processus créés sans fork")
+class TestParallelBuild(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.media_dir = os.path.join(self.tmp, "media")
+        os.makedirs(os.path.join(self.media_dir, "cycle1"))
+        with open(os.path.join(self.media_dir, "cycle1", "x.png"), "wb") as f:
+            f.write(b"png")
+        self.csv_files = []
+        for i in range(4):
+            csv_path = os.path.join(self.tmp, "decks", "SI", f"SI-Cycle{i}.csv")
+            os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+            with open(csv_path, "w", encoding="utf-8-sig") as f:
+                f.write(f'Q{i};"<img src=""../media/cycle1/x.png"">"\nQ{i} bis;R{i}\n')
+            self.csv_files.append(("SI", csv_path))
+        patcher = mock.patch.object(generate_apkg, "MEDIA_DIR", self.media_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self, jobs):
+        """Construit les decks dans docs-<jobs>/ et retourne le contenu des .apkg par nom."""
+        output_dir = os.path.join(self.tmp, f"docs-{jobs}")
+        os.makedirs(output_dir)
+        tasks = [DeckTask(csv_path, subject, None, True, jobs > 1, previews=False)
+                 for subject, csv_path in self.csv_files]
+        with mock.patch.object(generate_apkg, "OUTPUT_DIR", output_dir), contextlib.redirect_stdout(io.StringIO()):
+            results = list(run_deck_builds(tasks, jobs, build_media_index(self.media_dir)))
+        self.assertTrue(all(result["success"] for result in results))
+        packages = {}
+        for result in results:
+            with open(os.path.join(output_dir, result["output_filename"]), "rb") as f:
+                packages[result["output_filename"]] = f.read()
+        return packages
+
+    def test_parallel_build_is_byte_identical(self):
+        sequential = self.build(jobs=1)
+        self.assertEqual(len(sequential), 4)
+        self.assertEqual(self.build(jobs=2), sequential)
+
+if __name__ == '__main__':
+    unittest.main()
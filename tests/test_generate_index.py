@@ -0,0 +1,52 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+import generate_index
+from generate_index import search_tokens, build_search_index, update_deck_info
+
+class TestSearchIndex(unittest.TestCase):
+    def test_search_tokens(self):
+        text = r'<b>La Dérivée</b> de \(\frac{1}{x}\) &amp; \ln x'
+        self.assertEqual(search_tokens(text), ["derivee", "ln"])
+
+    def test_build_search_index(self):
+        decks = [
+            ("deck-a", [("Dérivée", "Limite"), ("Intégrale", "Dérivée seconde")]),
+            ("deck-b", [("Limite à droite", "")]),
+        ]
+        meta, shards = build_search_index(decks)
+        self.assertEqual(meta["decks"], ["deck-a", "deck-b"])
+        self.assertEqual(meta["offsets"], [0, 2, 3])
+        self.assertEqual(shards["de"]["derivee"], [0, 1])
+        self.assertEqual(shards["li"]["limite"], [0, 2])
+        self.assertNotIn("a", shards)
+
+class TestDecksInfo(unittest.TestCase):
+    def test_update_deck_info(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(generate_index, "OUTPUT_DIR", Path(tmp)):
+            for name in ["SI-Cycle1.apkg", "Maths-DL.apkg"]:
+                (Path(tmp) / name).write_bytes(b"apkg")
+            data = {"Si": [{"filename": "SI-Cycle2.apkg"}]}
+
+            # Added in place, subjects ordered as by collect_decks_info
+            update_deck_info(data, "SI-Cycle1.apkg", 12)
+            update_deck_info(data, "Maths-DL.apkg", 3)
+            self.assertEqual(list(data), ["Maths", "Si"])
+            self.assertEqual([deck["filename"] for deck in data["Si"]], ["SI-Cycle1.apkg", "SI-Cycle2.apkg"])
+            self.assertEqual(data["Si"][0]["cards"], 12)
+
+            update_deck_info(data, "SI-Cycle1.apkg", 13)
+            self.assertEqual(len(data["Si"]), 2)
+            self.assertEqual(data["Si"][0]["cards"], 13)
+            update_deck_info(data, "Maths-DL.apkg", None)
+            self.assertEqual(list(data), ["Si"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest
+import sys
+import os
+import io
+import contextlib
+import tempfile
+from unittest import mock
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+import imports_decks
+from imports_decks import import_file, sync_file, record_stored_media, get_existing_media, save_uploaded_media
+from fake_anki_connect import FakeAnkiConnect, FakeAnkiError
+from utils import AnkiConnectClient, build_media_index, file_sha256
+
+FIELDS = ["Front", "Back"]
+DECK = "SI::Cycle5"
+
+class TestImportsDecks(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        media_dir = os.path.join(tmp.name, "media")
+        os.makedirs(os.path.join(media_dir, "si"))
+        self.media_path = os.path.join(media_dir, "si", "a.png")
+        with open(self.media_path, "wb") as f:
+            f.write(b"png")
+        for name, value in [("MEDIA_DIR", media_dir),
+                            ("UPLOADED_MEDIA_PATH", os.path.join(tmp.name, ".cache", "anki_media.json"))]:
+            patcher = mock.patch.object(imports_decks, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.media_index = build_media_index(media_dir)
+        self.csv_path = os.path.join(tmp.name, "SI-Cycle5.csv")
+
+        self.fake = FakeAnkiConnect().start()
+        self.addCleanup(self.fake.stop)
+        self.client = AnkiConnectClient(self.fake.url, retries=0)
+        self.addCleanup(self.client.close)
+
+    def write_csv(self, lines):
+        with open(self.csv_path, "w", encoding="utf-8-sig") as f:
+            f.write("".join(f"{line}\n" for line in lines))
+
+    def run_quietly(self, function, *args, **kwargs):
+        """Appelle import_file ou sync_file sur le CSV et retourne leur sortie."""
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            function(self.client, self.csv_path, "Basic", FIELDS, self.media_index, *args, **kwargs)
+        return output.getvalue()
+
+    def deck_notes(self):
+        notes = self.fake.collection.notes.values()
+        return sorted((note["values"][0], note["values"][1], tuple(note["tags"]))
+                      for note in notes if note["deckName"] == DECK)
+
+    def test_sync_diff(self):
+        self.write_csv(["Q1;R1;meca", "Q2;R2", "Q3;R3", "Q4;R4"])
+        self.run_quietly(import_file, {})
+        ids_before = {note["values"][0]: note_id for note_id, note in self.fake.collection.notes.items()}
+
+        # Q1 unchanged, Q2 edited, Q3 retagged, Q4 removed, Q5 added
+        self.write_csv(["Q1;R1;meca", "Q2;R2 modifiée", "Q3;R3;cycle5", "Q5;R5"])
+        self.fake.reset_stats()
+        self.run_quietly(sync_file, {}, delete=True)
+        self.assertEqual(self.deck_notes(), [("Q1", "R1", ("meca",)), ("Q2", "R2 modifiée", ()),
+                                             ("Q3", "R3", ("cycle5",)), ("Q5", "R5", ())])
+        self.assertEqual(self.fake.stats["action:updateNoteFields"], 1)
+        self.assertEqual(self.fake.stats["action:updateNoteTags"], 1)
+        self.assertEqual(self.fake.stats["action:deleteNotes"], 1)
+        # Edited notes are updated in place, not re-created
+        ids_after = {note["values"][0]: note_id for note_id, note in self.fake.collection.notes.items()}
+        self.assertEqual([ids_after[front] for front in ("Q1", "Q2", "Q3")],
+                         [ids_before[front] for front in ("Q1", "Q2", "Q3")])
+
+        # Nothing left to send: only the deck creation goes out
+        self.fake.reset_stats()
+        self.run_quietly(sync_file, {}, delete=True)
+        for action in ("addNotes", "updateNoteFields", "updateNoteTags", "deleteNotes", "storeMediaFile"):
+            self.assertEqual(self.fake.stats[f"action:{action}"], 0, action)
+        self.assertEqual(len(self.deck_notes()), 4)
+
+    def test_sync_keeps_removed_rows_without_delete(self):
+        self.write_csv(["Q1;R1", "Q2;R2"])
+        self.run_quietly(import_file, {})
+        self.write_csv(["Q1;R1"])
+        self.run_quietly(sync_file, {})
+        self.assertEqual(self.deck_notes(), [("Q1", "R1", ()), ("Q2", "R2", ())])
+
+    def test_sync_aborts_on_unreadable_csv(self):
+        self.write_csv(["Q1;R1", "Q2;R2"])
+        self.run_quietly(import_file, {})
+        # Invalid UTF-8 on line 2: nothing may be deleted from a half-read CSV
+        with open(self.csv_path, "wb") as f:
+            f.write(b"Q1;R1\nQ2;\xff\n")
+        self.fake.reset_stats()
+        output = self.run_quietly(sync_file, {}, delete=True)
+        self.assertEqual(self.deck_notes(), [("Q1", "R1", ()), ("Q2", "R2", ())])
+        self.assertEqual(self.fake.stats["action:deleteNotes"], 0)
+        self.assertNotIn("✅", output)
+
+    def test_sync_reports_what_anki_did(self):
+        self.write_csv(["Q1;R1", "Q2;R2"])
+        self.run_quietly(import_file, {})
+        self.write_csv(["Q1;R1 modifiée", "Q3;R3"])
+        with mock.patch.object(self.fake.collection, "update_note_fields", side_effect=FakeAnkiError("boom")):
+            output = self.run_quietly(sync_file, {}, delete=True)
+        self.assertIn("+1 ajoutée(s), ~0 modifiée(s), -1 supprimée(s)", output)
+        self.assertIn("1 note(s) non synchronisée(s)", output)
+
+    def test_sync_skips_duplicate_fronts(self):
+        # addNotes rejects a batch holding the same front twice
+        self.write_csv(["Q1;R1", "Q1;R1 bis", "Q2;R2"])
+        output = self.run_quietly(sync_file, {})
+        self.assertEqual(self.deck_notes(), [("Q1", "R1", ()), ("Q2", "R2", ())])
+        self.assertIn("Recto en double dans le CSV, ligne non ajoutée : Q1", output)
+        self.assertIn("+2 ajoutée(s)", output)
+
+    def test_media_known_only_once_stored(self):
+        self.write_csv(['Q1;<img src="../media/si/a.png">'])
+        known_media = {}
+        # The whole multi request fails: the image must be sent again by the next deck
+        self.fake.failure_rate, self.fake.failure_mode = 1.0, 'error'
+        self.run_quietly(import_file, known_media)
+        self.assertEqual(known_media, {})
+
+        self.fake.failure_rate = 0.0
+        self.run_quietly(sync_file, known_media)
+        self.assertEqual(known_media, {"a.png": file_sha256(self.media_path)})
+        self.assertEqual(self.fake.collection.media_names(), ["a.png"])
+
+    def test_edited_media_is_sent_again(self):
+        self.write_csv(['Q1;<img src="../media/si/a.png">'])
+        known_media = {}
+        self.run_quietly(import_file, known_media)
+        # Same name, new content
+        with open(self.media_path, "wb") as f:
+            f.write(b"png v2")
+        self.run_quietly(sync_file, known_media)
+        self.assertEqual(self.fake.collection.media["a.png"], b"png v2")
+        self.assertEqual(known_media, {"a.png": file_sha256(self.media_path)})
+
+        self.fake.reset_stats()
+        self.run_quietly(sync_file, known_media)
+        self.assertEqual(self.fake.stats["action:storeMediaFile"], 0)
+
+    def test_existing_media_content(self):
+        self.fake.collection.media.update({"a.png": b"png", "b.png": b"b"})
+        # c.png was deleted from Anki, b.png was added without this script: both are sent again
+        save_uploaded_media({"a.png": "sha-a", "c.png": "sha-c"})
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(get_existing_media(self.client), {"a.png": "sha-a"})
+
+    def test_record_stored_media(self):
+        responses = [{"result": 1, "error": None}, {"result": "a.png", "error": None},
+                     {"result": None, "error": "disk full"}, {"result": [1], "error": None}]
+        known_media = {}
+        self.assertEqual(record_stored_media([("a.png", "sha-a"), ("b.png", "sha-b")], responses, 1, known_media), 1)
+        self.assertEqual(known_media, {"a.png": "sha-a"})
+        self.assertEqual(record_stored_media([("b.png", "sha-b")], None, 1, known_media), 0)
+
+if __name__ == '__main__':
+    unittest.main()
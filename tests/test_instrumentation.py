@@ -0,0 +1,49 @@
+import unittest
+import sys
+import os
+import threading
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+import instrumentation
+
+class TestInstrumentation(unittest.TestCase):
+    def tearDown(self):
+        instrumentation.disable()
+
+    def test_disabled_records_nothing(self):
+        with instrumentation.stage("parse"):
+            instrumentation.count("build_cache_hits")
+        self.assertEqual(instrumentation.build_report("test", 0)["stages"], {})
+
+    def test_nested_stages_and_merge(self):
+        instrumentation.enable()
+        with instrumentation.stage("package"):
+            # What a worker process sends back for its deck
+            with instrumentation.collect() as metrics:
+                with instrumentation.stage("genanki"):
+                    instrumentation.add_bytes(written=100)
+                instrumentation.count("build_cache_misses")
+            instrumentation.merge(metrics, deck="SI-a.apkg")
+
+            # Export threads report into the stage opened by the main thread
+            thread = threading.Thread(target=instrumentation.count, args=("anki_round_trips",))
+            thread.start()
+            thread.join()
+
+        report = instrumentation.build_report("test", 1.0)
+        self.assertEqual(set(report["stages"]), {"package", "package/genanki"})
+        self.assertEqual(report["stages"]["package/genanki"]["bytes_written"], 100)
+        self.assertEqual(report["stages"]["package"]["counters"],
+                         {"anki_round_trips": 1, "build_cache_misses": 1})
+        self.assertEqual(report["bytes_written"], 100)
+        self.assertEqual(list(report["decks"]["package"]), ["SI-a.apkg"])
+
+    def test_check_budget(self):
+        report = {"total_seconds": 5.0, "stages": {"package": {"seconds": 3.0}}}
+        self.assertEqual(instrumentation.check_budget(report, {"package": 10, "total": 10, "index": 0}), [])
+        self.assertEqual(len(instrumentation.check_budget(report, {"package": 1, "total": 1})), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add scripts folder to sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
+
+import media_optimizer
+from media_optimizer import optimize_image
+
+class TestMediaOptimizer(unittest.TestCase):
+    def test_unsupported_files_are_kept(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "schema.svg")
+            with open(src, "w") as f:
+                f.write("<svg/>")
+            self.assertEqual(optimize_image(src, cache_dir=os.path.join(tmp, "cache")), src)
+
+    @unittest.skipUnless(media_optimizer.is_available(), "Pillow n'est pas installé")
+    def test_large_image_is_downscaled_once(self):
+        from PIL import Image
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "photo.jpg")
+            Image.effect_noise((3200, 1600), 64).convert("RGB").save(src, quality=95)
+            cache_dir = os.path.join(tmp, "cache")
+
+            optimized = optimize_image(src, max_dimension=800, cache_dir=cache_dir)
+            self.assertEqual(os.path.basename(optimized), "photo.jpg")
+            self.assertLess(os.path.getsize(optimized), os.path.getsize(src))
+            with Image.open(optimized) as image:
+                self.assertEqual(image.size, (800, 400))
+
+            # Cached by source content and settings
+            mtime = os.path.getmtime(optimized)
+            self.assertEqual(optimize_image(src, max_dimension=800, cache_dir=cache_dir), optimized)
+            self.assertEqual(os.path.getmtime(optimized), mtime)
+            self.assertNotEqual(optimize_image(src, max_dimension=400, cache_dir=cache_dir), optimized)
+
+if __name__ == '__main__':
+    unittest.main()
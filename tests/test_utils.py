@@ -1,11 +1,20 @@
 import unittest
 import sys
 import os
+import tempfile
+import time
+from unittest import mock
 
 # Add scripts folder to sys.path
 sys.path.append(os.path.join(os.path.dirname(__file__), '../scripts'))
 
-from utils import slugify
+import utils
+from utils import slugify, build_media_index, resolve_media, find_ambiguous_media
+from utils import AnkiConnectClient, AnkiConnectError
+from fake_anki_connect import FakeAnkiConnect
+
+def basic_note(front):
+    return {"deckName": "Default", "modelName": "Basic", "fields": {"Front": front, "Back": "R"}}
 
 class TestUtils(unittest.TestCase):
     def test_slugify(self):
@@ -15,5 +24,63 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(slugify("Special-Char_test"), "special_char_test")
         self.assertEqual(slugify("C'est l'été"), "cest_lete")
 
+    def test_media_index(self):
+        with tempfile.TemporaryDirectory() as media_dir:
+            for subfolder, name in [("si", "a.jpg"), ("maths", "a.jpg"), ("maths", "b.png")]:
+                os.makedirs(os.path.join(media_dir, subfolder), exist_ok=True)
+                open(os.path.join(media_dir, subfolder, name), "wb").close()
+
+            index = build_media_index(media_dir)
+            si_dir = os.path.join(media_dir, "si")
+
+            # Expected subfolder first, then the first indexed path
+            self.assertEqual(resolve_media(index, "a.jpg", si_dir), os.path.join(si_dir, "a.jpg"))
+            self.assertEqual(resolve_media(index, "b.png", si_dir), os.path.join(media_dir, "maths", "b.png"))
+            self.assertIsNone(resolve_media(index, "c.gif", si_dir))
+            self.assertEqual(list(find_ambiguous_media(index)), ["a.jpg"])
+
+class TestAnkiConnectClient(unittest.TestCase):
+    def test_retries_with_backoff(self):
+        with FakeAnkiConnect(failure_rate=1.0) as fake, AnkiConnectClient(fake.url, retries=3, backoff=0.5) as client:
+            with mock.patch.object(utils.time, "sleep") as sleep, self.assertRaises(AnkiConnectError):
+                client.invoke("deckNames")
+            self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.5, 1.0, 2.0])
+            self.assertEqual(fake.stats["requests"], 4)
+
+            # Dropped connections are retried until one succeeds
+            fake.failure_rate = 0.5
+            with mock.patch.object(utils.time, "sleep"):
+                for _ in range(10):
+                    self.assertEqual(client.invoke("deckNames"), ["Default"])
+
+    def test_writes_are_not_sent_twice(self):
+        # Response lost after Anki received the request: it may have been applied
+        with FakeAnkiConnect(failure_rate=1.0) as fake, AnkiConnectClient(fake.url, retries=3, backoff=0) as client:
+            self.assertIsNone(client.multi([client.make_action("addNotes", notes=[basic_note("Q1")])]))
+            self.assertEqual(fake.stats["requests"], 1)
+
+        with FakeAnkiConnect(latency=0.3) as fake, AnkiConnectClient(fake.url, timeout=0.1, retries=3) as client:
+            with self.assertRaises(AnkiConnectError):
+                client.invoke("addNotes", notes=[basic_note("Q1")])
+            time.sleep(0.3)
+            self.assertEqual(fake.stats["requests"], 1)
+            self.assertEqual(len(fake.collection.notes), 1)
+
+    def test_reconnects_after_dropped_keep_alive(self):
+        with FakeAnkiConnect(idle_timeout=0.05) as fake, AnkiConnectClient(fake.url, retries=0) as client:
+            self.assertEqual(client.invoke("version"), 6)
+            # The server closed the idle connection: a new one is opened before sending
+            time.sleep(0.2)
+            self.assertEqual(len(client.invoke("addNotes", notes=[basic_note("Q1")])), 1)
+            self.assertEqual((client.round_trips, fake.stats["requests"]), (2, 2))
+
+    def test_multi_batches(self):
+        with FakeAnkiConnect() as fake, AnkiConnectClient(fake.url, batch_size=2) as client:
+            responses = client.multi([client.make_action("createDeck", deck=f"D{i}") for i in range(5)])
+            self.assertEqual(fake.stats["action:multi"], 3)
+            self.assertEqual(fake.stats["action:createDeck"], 5)
+            self.assertEqual([r["result"] for r in responses], [fake.collection.decks[f"D{i}"] for i in range(5)])
+            self.assertTrue(all(r["error"] is None for r in responses))
+
 if __name__ == '__main__':
     unittest.main()